@@ -0,0 +1,292 @@
+"""
+Simulated Amazon Echo load generator for fauxmo.
+
+Behaves like one or more Echos on the network:
+
+1. discovery - sends the Echo's WeMo M-SEARCH, multicast to
+   239.255.255.250:1900 or unicast to --ssdp host:port, and collects the
+   LOCATION of every device that answers
+2. setup - fetches each device's /setup.xml for its name
+3. toggles - fires SetBinaryState ON/OFF requests at random devices from
+   --concurrency threads, at --rate requests per second in total (0 for
+   as fast as they come back), posted like the Echo's to the bare
+   /upnp/control/basicevent1 on the device's port whatever controlURL
+   setup.xml gives
+
+and reports the latency percentiles of each phase and the toggle
+throughput. Without --ssdp or --multicast it starts a fauxmo server with
+--devices dummy_handler switches in this process, on 127.0.0.1.
+
+Usage:
+    PYTHONPATH=. python benchmarks/echo_simulator.py --devices 20 --requests 2000 --concurrency 8
+    PYTHONPATH=. python benchmarks/echo_simulator.py --multicast --rate 50 --keep-alive
+    PYTHONPATH=. python benchmarks/echo_simulator.py --ssdp 192.168.1.20:1900
+"""
+
+import argparse
+import itertools
+import random
+import re
+import socket
+import threading
+import time
+import urllib.parse
+
+import fauxmo
+from fauxmo_pool import percentiles, unicast_responder
+
+SSDP_ADDR = ('239.255.255.250', 1900)
+
+SEARCH = ('M-SEARCH * HTTP/1.1\r\n'
+          'HOST: 239.255.255.250:1900\r\n'
+          'MAN: "ssdp:discover"\r\n'
+          'MX: %d\r\n'
+          'ST: urn:Belkin:device:**\r\n\r\n')
+
+SET_STATE = ('POST %s HTTP/1.1\r\n'
+             'HOST: %s:%d\r\n'
+             'CONTENT-TYPE: text/xml; charset="utf-8"\r\n'
+             'SOAPACTION: "urn:Belkin:service:basicevent:1#SetBinaryState"\r\n'
+             'CONNECTION: %s\r\n'
+             'CONTENT-LENGTH: %d\r\n\r\n%s')
+
+SET_STATE_BODY = ('<?xml version="1.0" encoding="utf-8"?>'
+                  '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+                  's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>'
+                  '<u:SetBinaryState xmlns:u="urn:Belkin:service:basicevent:1">'
+                  '<BinaryState>%d</BinaryState>'
+                  '</u:SetBinaryState></s:Body></s:Envelope>')
+
+LOCATION = re.compile(r'^LOCATION:\s*(\S+)', re.IGNORECASE | re.MULTILINE)
+FRIENDLY_NAME = re.compile(r'<friendlyName>(.*?)</friendlyName>')
+CONTENT_LENGTH = re.compile(rb'^content-length:\s*(\d+)', re.IGNORECASE | re.MULTILINE)
+
+
+class Device:
+    """A switch found by discovery."""
+
+    def __init__(self, location):
+        url = urllib.parse.urlsplit(location)
+        self.location = location
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.setup_path = url.path
+        self.name = None
+        self.control_path = '/upnp/control/basicevent1'
+
+
+def read_response(sock):
+    """Read one Content-Length delimited response; returns (head, body)."""
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError('connection closed before the response')
+        data += chunk
+    head, body = data.split(b'\r\n\r\n', 1)
+    match = CONTENT_LENGTH.search(head)
+    length = int(match.group(1)) if match else 0
+    while len(body) < length:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise ConnectionError('connection closed in the response body')
+        body += chunk
+    return head, body
+
+
+def discover(target, mx, echos):
+    """
+    Send each simulated Echo's M-SEARCH to target and collect the replies.
+
+    Returns:
+        tuple: (devices by LOCATION, list of reply latencies in seconds)
+    """
+    sockets = []
+    for _ in range(echos):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.bind(('', 0))
+        sock.settimeout(0.1)
+        sockets.append(sock)
+
+    devices = {}
+    latencies = []
+    started = time.perf_counter()
+    for sock in sockets:
+        sock.sendto((SEARCH % mx).encode(), target)
+    deadline = started + mx + 1
+    try:
+        while time.perf_counter() < deadline:
+            for sock in sockets:
+                try:
+                    data = sock.recv(2048).decode('latin-1')
+                except socket.timeout:
+                    continue
+                latencies.append(time.perf_counter() - started)
+                match = LOCATION.search(data)
+                if match and match.group(1) not in devices:
+                    devices[match.group(1)] = Device(match.group(1))
+    finally:
+        for sock in sockets:
+            sock.close()
+    return devices, latencies
+
+
+def fetch_setup(device):
+    """GET the device's setup.xml; returns the request latency."""
+    started = time.perf_counter()
+    with socket.create_connection((device.host, device.port), timeout=5) as sock:
+        sock.sendall(('GET %s HTTP/1.1\r\nHOST: %s:%d\r\nCONNECTION: close\r\n\r\n'
+                      % (device.setup_path, device.host, device.port)).encode())
+        head, body = read_response(sock)
+    latency = time.perf_counter() - started
+    if not head.startswith(b'HTTP/1.1 200'):
+        raise RuntimeError(f'{device.location}: {head.splitlines()[0]!r}')
+    xml = body.decode('utf-8', 'replace')
+    name = FRIENDLY_NAME.search(xml)
+    device.name = name.group(1) if name else device.location
+    return latency
+
+
+class ToggleLoad:
+    """
+    Fires SetBinaryState requests from several threads.
+
+    Request k is due at start + k / rate, so a slow server shows up as
+    latency rather than as a lower send rate; each thread takes the next
+    due request when it is free.
+    """
+
+    def __init__(self, devices, requests, rate, concurrency, keep_alive):
+        self.devices = devices
+        self.requests = requests
+        self.rate = rate
+        self.concurrency = concurrency
+        self.keep_alive = keep_alive
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    def send(self, connections, device, state):
+        body = SET_STATE_BODY % state
+        request = (SET_STATE % (device.control_path, device.host, device.port,
+                                'keep-alive' if self.keep_alive else 'close',
+                                len(body), body)).encode()
+        key = (device.host, device.port)
+        sock = connections.pop(key, None)
+        if sock is None:
+            sock = socket.create_connection(key, timeout=5)
+        try:
+            sock.sendall(request)
+            head, _ = read_response(sock)
+        except Exception:
+            sock.close()
+            raise
+        if self.keep_alive:
+            connections[key] = sock
+        else:
+            sock.close()
+        if not head.startswith(b'HTTP/1.1 200'):
+            raise RuntimeError(f'{device.name}: {head.splitlines()[0]!r}')
+
+    def worker(self, started):
+        connections = {}
+        try:
+            while True:
+                k = next(self.counter)
+                if k >= self.requests:
+                    return
+                if self.rate:
+                    delay = started + k / self.rate - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                sent = time.perf_counter()
+                try:
+                    self.send(connections, random.choice(self.devices), k % 2)
+                except Exception:
+                    with self.lock:
+                        self.errors += 1
+                    continue
+                with self.lock:
+                    self.latencies.append(time.perf_counter() - sent)
+        finally:
+            for sock in connections.values():
+                sock.close()
+
+    def run(self):
+        """Returns the seconds taken to complete all requests."""
+        started = time.perf_counter()
+        threads = [threading.Thread(target=self.worker, args=(started,))
+                   for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def serve(count):
+    """Start fauxmo with count dummy switches on 127.0.0.1; returns (poller, ssdp address)."""
+    p = fauxmo.poller()
+    responder = unicast_responder(p)
+    for i in range(count):
+        fauxmo.fauxmo(f'dummy {i}', responder, p, '127.0.0.1', 0,
+                      action_handler=fauxmo.dummy_handler(f'dummy {i}'))
+    threading.Thread(target=p.run, daemon=True).start()
+    return p, responder.ssock.getsockname()
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(':')
+    return host, int(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    where = parser.add_mutually_exclusive_group()
+    where.add_argument('--multicast', action='store_true', help='search the SSDP multicast group')
+    where.add_argument('--ssdp', type=parse_address, help='send unicast searches to host:port')
+    parser.add_argument('--devices', type=int, default=10,
+                        help='dummy switches to serve in-process when no target is given')
+    parser.add_argument('--echos', type=int, default=1, help='simulated Echos searching at once')
+    parser.add_argument('--mx', type=int, default=1, help='MX of the searches')
+    parser.add_argument('--requests', type=int, default=1000, help='SetBinaryState requests to send')
+    parser.add_argument('--rate', type=float, default=0, help='requests per second in total, 0 = unlimited')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight at once')
+    parser.add_argument('--keep-alive', action='store_true', help='reuse connections between requests')
+    args = parser.parse_args()
+
+    server = None
+    if args.multicast:
+        target = SSDP_ADDR
+    elif args.ssdp:
+        target = args.ssdp
+    else:
+        server, target = serve(args.devices)
+        print(f'serving {args.devices} dummy switches, SSDP on {target[0]}:{target[1]}')
+
+    try:
+        devices, replies = discover(target, args.mx, args.echos)
+        if not devices:
+            print(f'discovery: no devices answered within {args.mx + 1} s')
+            return
+        print(f'discovery: {len(devices)} devices, {len(replies)} replies  {percentiles(replies)}')
+
+        setup = [fetch_setup(device) for device in devices.values()]
+        print(f'setup.xml: {len(setup)} fetches  {percentiles(setup)}')
+
+        load = ToggleLoad(list(devices.values()), args.requests, args.rate,
+                          args.concurrency, args.keep_alive)
+        elapsed = load.run()
+        print(f'toggle:    {len(load.latencies)} ok, {load.errors} errors in {elapsed:.2f} s '
+              f'({len(load.latencies) / elapsed:.0f} req/s)')
+        if load.latencies:
+            print(f'           {percentiles(load.latencies)}')
+    finally:
+        if server is not None:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
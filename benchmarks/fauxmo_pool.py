@@ -0,0 +1,172 @@
+"""
+Benchmark for serving many fauxmo devices.
+
+Registers hundreds of virtual switches on one poller, either each with
+its own listening socket (dedicated) or from a listener_pool (pooled),
+then measures:
+
+- discovery: time from an M-SEARCH to the first and the last device's
+  reply (the replies are spread over the search's MX seconds)
+- toggle: round-trip latency of SetBinaryState requests to random
+  devices, each on a fresh connection to the bare control path as the
+  Echo sends them
+
+Pooled mode uses --ports listeners, one per device by default. The Echo
+can't reach a second device on a port, so fewer ports than devices needs
+--overcommit and then the toggles go to the path-prefixed controlURL,
+which only clients that read setup.xml follow.
+
+SSDP runs over unicast on 127.0.0.1 rather than the multicast group, so
+the benchmark needs no network and can run next to a live fauxmo.
+
+Usage:
+    PYTHONPATH=. python benchmarks/fauxmo_pool.py --devices 300 --mode pooled
+    PYTHONPATH=. python benchmarks/fauxmo_pool.py --devices 300 --mode pooled --ports 4 --overcommit
+    PYTHONPATH=. python benchmarks/fauxmo_pool.py --devices 300 --mode dedicated
+"""
+
+import argparse
+import random
+import socket
+import statistics
+import threading
+import time
+
+import fauxmo
+
+SEARCH = ('M-SEARCH * HTTP/1.1\r\n'
+          'HOST: 239.255.255.250:1900\r\n'
+          'MAN: "ssdp:discover"\r\n'
+          'MX: %d\r\n'
+          'ST: urn:Belkin:device:**\r\n\r\n')
+
+CONTROL_PATH = '/upnp/control/basicevent1'
+
+SET_STATE = ('POST %s HTTP/1.1\r\n'
+             'SOAPACTION: "urn:Belkin:service:basicevent:1#SetBinaryState"\r\n'
+             'Content-Length: %d\r\n\r\n%s')
+
+
+class NullHandler:
+    """Action handler that only counts calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def on(self, client_address=None, name=None):
+        self.calls += 1
+        return True
+
+    def off(self, client_address=None, name=None):
+        self.calls += 1
+        return True
+
+
+def percentiles(samples):
+    """Median, p95 and max of samples in seconds, formatted in ms."""
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    return (f'p50 {statistics.median(samples) * 1000:.2f} ms  '
+            f'p95 {p95 * 1000:.2f} ms  max {samples[-1] * 1000:.2f} ms')
+
+
+def unicast_responder(poller):
+    """upnp_broadcast_responder listening on a loopback UDP port."""
+    responder = fauxmo.upnp_broadcast_responder()
+    responder.ssock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    responder.ssock.bind(('127.0.0.1', 0))
+    poller.add(responder)
+    return responder
+
+
+def make_devices(poller, responder, args):
+    handler = NullHandler()
+    actions = fauxmo.action_queue(window=0)
+    http = None
+    if args.mode == 'pooled':
+        http = fauxmo.listener_pool(poller, '127.0.0.1', ports=[0] * (args.ports or args.devices),
+                                    overcommit=args.overcommit)
+    started = time.perf_counter()
+    devices = [fauxmo.fauxmo(f'room {i}', responder, poller, '127.0.0.1', 0,
+                             action_handler=handler, actions=actions, http=http)
+               for i in range(args.devices)]
+    return devices, handler, actions, time.perf_counter() - started
+
+
+def bench_discovery(poller, responder, devices, args):
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(('127.0.0.1', 0))
+    client.settimeout(args.mx + 5)
+    try:
+        started = time.perf_counter()
+        client.sendto((SEARCH % args.mx).encode(), responder.ssock.getsockname())
+        client.recv(2048)
+        first = time.perf_counter() - started
+        for _ in range(len(devices) - 1):
+            client.recv(2048)
+        return first, time.perf_counter() - started
+    finally:
+        client.close()
+
+
+def bench_toggles(devices, handler, actions, args):
+    latencies = []
+    for i in range(args.toggles):
+        device = random.choice(devices)
+        body = '<BinaryState>%d</BinaryState>' % (i % 2)
+        path = device.path_prefix + CONTROL_PATH if args.overcommit else CONTROL_PATH
+        request = (SET_STATE % (path, len(body), body)).encode()
+        started = time.perf_counter()
+        with socket.create_connection(('127.0.0.1', device.port)) as client:
+            client.sendall(request)
+            response = b''
+            while b'\r\n\r\n' not in response:
+                chunk = client.recv(4096)
+                if not chunk:
+                    break
+                response += chunk
+        latencies.append(time.perf_counter() - started)
+        if not response.startswith(b'HTTP/1.1 200 OK'):
+            raise RuntimeError(f'{device.name}: unexpected response {response[:40]!r}')
+    actions.join(timeout=5)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--devices', type=int, default=300, help='virtual switches to register')
+    parser.add_argument('--mode', choices=('dedicated', 'pooled'), default='pooled',
+                        help='a listener per device, or shared listeners')
+    parser.add_argument('--ports', type=int, default=0,
+                        help='listeners in pooled mode, 0 = one per device')
+    parser.add_argument('--overcommit', action='store_true',
+                        help='let pooled devices share ports, reached by path prefix')
+    parser.add_argument('--toggles', type=int, default=1000, help='ON/OFF requests to send')
+    parser.add_argument('--mx', type=int, default=1, help='MX of the discovery search')
+    args = parser.parse_args()
+
+    poller = fauxmo.poller()
+    responder = unicast_responder(poller)
+    devices, handler, actions, setup = make_devices(poller, responder, args)
+    listeners = len(poller.targets) - 1
+    print(f'{args.devices} devices, {args.mode}: {listeners} listening sockets, '
+          f'set up in {setup * 1000:.1f} ms')
+
+    thread = threading.Thread(target=poller.run, daemon=True)
+    thread.start()
+    try:
+        first, last = bench_discovery(poller, responder, devices, args)
+        print(f'discovery: first reply {first * 1000:.1f} ms, all {len(devices)} '
+              f'in {last * 1000:.1f} ms (MX={args.mx} s)')
+
+        latencies = bench_toggles(devices, handler, actions, args)
+        print(f'toggle:    {len(latencies)} requests  {percentiles(latencies)}')
+        print(f'handler:   {handler.calls} actions run after coalescing')
+    finally:
+        poller.stop()
+        thread.join()
+        poller.close()
+
+
+if __name__ == '__main__':
+    main()
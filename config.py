@@ -38,6 +38,12 @@ DEFAULT_MODE = os.getenv('DEFAULT_MODE', 'SAFE_MODE')
 FAUXMO_DEVICE_NAME = os.getenv('FAUXMO_DEVICE_NAME', "Stardust Destroyer")
 FAUXMO_PORT = int(os.getenv('FAUXMO_PORT', '52000'))
 FAUXMO_DEBUG = os.getenv('FAUXMO_DEBUG', 'true').lower() == 'true'
+# Shared HTTP listeners for all virtual switches, on ports FAUXMO_PORT onwards;
+# the Echo reaches one switch per port, so it must be at least the number of
+# switches. 0 gives every switch a listener on a port of its own choosing
+FAUXMO_SHARED_PORTS = int(os.getenv('FAUXMO_SHARED_PORTS', '0'))
+# Port for the Prometheus /metrics endpoint; 0 disables it
+FAUXMO_METRICS_PORT = int(os.getenv('FAUXMO_METRICS_PORT', '0'))
 
 # Logging configuration
 LOG_LEVEL_STR = os.getenv('LOG_LEVEL', 'INFO')
@@ -48,6 +54,11 @@ LOG_FILE = os.getenv('LOG_FILE', None)
 # Installation directory (auto-detect if not set)
 INSTALL_DIR = os.getenv('INSTALL_DIR', str(Path(__file__).parent.absolute()))
 
+# Robot daemon socket (see roomba/daemon.py)
+ROBOT_SOCKET = os.getenv('ROBOT_SOCKET') or str(Path(INSTALL_DIR) / 'roomba.sock')
+# Seconds without a command before warm standby lets the robot sleep; 0 never
+ROBOT_STANDBY_IDLE = float(os.getenv('ROBOT_STANDBY_IDLE', '600'))
+
 # Python executable (auto-detect if not set)
 PYTHON_EXEC = os.getenv('PYTHON_EXEC', 'python3')
 
@@ -56,6 +67,11 @@ WHEEL_SPAN_MM = 235.0      # Distance between wheels
 WHEEL_DIAMETER_MM = 72.0   # Wheel diameter
 ANGULAR_ERROR_FACTOR = 360.0 / 450.0  # Calibration factor for turning
 
+# Odometry calibration (see roomba/calibration.py)
+ROBOT_ID = os.getenv('ROBOT_ID', 'default')
+FLOOR_TYPE = os.getenv('FLOOR_TYPE', 'default')
+CALIBRATION_FILE = os.getenv('CALIBRATION_FILE') or str(Path(INSTALL_DIR) / 'calibration.json')
+
 # Movement limits (safety bounds)
 MAX_VELOCITY_CM_S = 50     # Maximum velocity in cm/s
 MAX_SPIN_VELOCITY = 100    # Maximum spin velocity
@@ -126,6 +142,7 @@ def print_config():
     print(f"Operating Mode:   {DEFAULT_MODE}")
     print(f"Log Level:        {LOG_LEVEL_STR}")
     print(f"Install Dir:      {INSTALL_DIR}")
+    print(f"Robot Socket:     {ROBOT_SOCKET}")
     print("=" * 60)
 
 
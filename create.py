@@ -24,9 +24,10 @@
 import serial
 import math
 import time
-import thread
 import threading
-import serial 
+import functools
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # For a complete discussion, see http://www.makermusings.com
 # TODO(semartin): investigate time.sleep usage in here...
@@ -111,6 +112,7 @@ SCRIPT = bytes([152])
 ENDSCRIPT = bytes([153])
 WAITDIST = bytes([156])
 WAITANGLE = bytes([157])
+MAX_SCRIPT_LENGTH = 100     # longest script body the OI stores
 
 # the four SCI modes
 # the code will try to keep track of which mode the system is in,
@@ -120,6 +122,33 @@ PASSIVE_MODE = 1
 SAFE_MODE = 2
 FULL_MODE = 3
 
+# mode changes are confirmed by polling OI_MODE (packet 35) rather than
+# sleeping a fixed time; each poll waits at most MODE_POLL_TIMEOUT for
+# the reply and the whole handshake gives up after MODE_HANDSHAKE_TIMEOUT;
+# a command the robot hasn't acted on within MODE_RESEND_INTERVAL (or at
+# once, if it didn't answer the poll at all) is sent again, in case the
+# byte was lost
+MODE_POLL_TIMEOUT = 0.05
+MODE_RESEND_INTERVAL = 0.1
+MODE_HANDSHAKE_TIMEOUT = 0.5
+
+# a confirmed mode is trusted for MODE_VERIFY_INTERVAL seconds; after that,
+# or after an event that makes the robot leave safe mode on its own (cliff,
+# wheel drop, charger), ensureMode re-reads OI_MODE before acting on it
+MODE_VERIFY_INTERVAL = 5.0
+
+# the OI drops serial input while a script is waiting, so a finished script
+# is detected by the first SENSORS probe that gets an answer; each probe
+# waits at most SCRIPT_POLL_TIMEOUT for its one-byte reply
+SCRIPT_POLL_TIMEOUT = 0.05
+
+# moveAsync/turnAsync drive from the host and check the encoders this often
+# (the OI itself updates its sensor data every 15 ms)
+MOTION_POLL_INTERVAL = 0.015
+
+# song slots playSong may use for its cache of uploaded songs
+SONG_CACHE_SLOTS = (0, 1, 2, 3)
+
 # the sensors
 BUMPS_AND_WHEEL_DROPS = 7
 WALL_IR_SENSOR = 8
@@ -481,6 +510,17 @@ class SensorFrame:
 
 
 
+def _serialized(method):
+    """ runs a Create method while holding the robot's serial lock,
+    so a command and its reply never interleave with another thread's
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._serialLock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 #
 # the robot class
 #
@@ -508,6 +548,9 @@ class Create:
         
         # if PORT is the string 'simulated' (or any string for the moment)
         # we use our SRSerial class
+        # held for each command/reply exchange - see _serialized
+        self._serialLock = threading.RLock()
+
         print('PORT is', PORT)
         if isinstance(PORT, str):
             if PORT == 'sim':
@@ -551,29 +594,52 @@ class Create:
         self.leftEncoder_old = -1
         self.rightEncoder_old = -1
         
-        time.sleep(0.3)
-        self._start()  # go to passive mode - want to do this
-        # regardless of the final mode we'd like to be in...
-        time.sleep(0.3)
-        
+        # each mode change below returns as soon as the robot
+        # reports the new mode, so there are no fixed sleeps here - not
+        # even to let the port settle after opening: a command lost
+        # meanwhile is sent again by _changeMode until the robot answers,
+        # within a handshake longer than the 0.3 s settle this replaces
         if (startingMode == SAFE_MODE):
             print('Putting the robot into safe mode...')
             self.toSafeMode()
-
-        if (startingMode == FULL_MODE):
+        elif (startingMode == FULL_MODE):
             print('Putting the robot into full mode...')
-            self.toSafeMode()
-            time.sleep(0.3)
             self.toFullMode()
+        else:
+            # toSafeMode and toFullMode go through passive mode themselves
+            self._start()
         
-        # We need to read the angle and distance sensors so that
-        # their values clear out!
-        time.sleep(0.25)
         #self.sensors(6) # read all sensors to establish the sensord dictionary
         self.setPose(0,0,0)
     
     _debug = False
+
+    # monotonic time sciMode was last confirmed by the robot,
+    # None while sciMode is only a guess
+    _modeConfirmedAt = None
+
+    # worker thread for _endScriptAsync and moveAsync/turnAsync,
+    # created on first use
+    _scriptExecutor = None
+
+    # replaced per instance in __init__
+    _serialLock = threading.RLock()
+
+    # song slot -> notes we uploaded there, least recently used first;
+    # created on first use
+    _loadedSongs = None
+
+    # roomba.scheduler.MusicScheduler for playMelody(wait=False),
+    # created on first use
+    _musicScheduler = None
+
+    # odometry constants - class-level defaults, so they can be
+    # replaced per robot (and per floor) by setCalibration
+    wheelSpan = WHEEL_SPAN
+    tickPerMM = TICK_PER_MM
+    angularError = ANGULAR_ERROR
     
+    @_serialized
     def _write(self, byte):
         if self._debug==True:
             print(ord(byte))
@@ -622,6 +688,18 @@ class Create:
         """ resetPose simply sets the internal odometry to 0,0,0
         """
         self.setPose(0.0,0.0,0.0)
+
+    def setCalibration(self, wheelSpan=None, tickPerMM=None, angularError=None):
+        """ setCalibration replaces the odometry constants for this robot
+        wheelSpan: distance between the wheels in mm
+        tickPerMM: encoder ticks per mm of wheel travel
+        angularError: correction factor applied to encoder-derived turns
+        any value left as None keeps its current setting
+        (see roomba.calibration for fitting these from test runs)
+        """
+        if wheelSpan is not None: self.wheelSpan = float(wheelSpan)
+        if tickPerMM is not None: self.tickPerMM = float(tickPerMM)
+        if angularError is not None: self.angularError = float(angularError)
     
     def _getEncoderDelta(self, oldEnc, newEnc):
         #encoder wrap around at 2^16
@@ -642,12 +720,12 @@ class Create:
         left_diff  = self._getEncoderDelta(self.leftEncoder_old,self.leftEncoder)
         right_diff = self._getEncoderDelta(self.rightEncoder_old,self.rightEncoder)
 
-        left_mm = left_diff / TICK_PER_MM;
-        right_mm = right_diff / TICK_PER_MM;
+        left_mm = left_diff / self.tickPerMM;
+        right_mm = right_diff / self.tickPerMM;
 
         distance = (left_mm + right_mm) / 2.0;        
-        dAngle = (right_mm - left_mm) / WHEEL_SPAN
-        dAngle *= ANGULAR_ERROR
+        dAngle = (right_mm - left_mm) / self.wheelSpan
+        dAngle *= self.angularError
         self.thrPose += dAngle
         
         if self.thrPose > 100*math.pi:
@@ -683,7 +761,7 @@ class Create:
         # perhaps there's nothing to do...
         if distance == 0 and rawAngle == 0:
             return
-        print rawAngle
+        print(rawAngle)
         # then again, maybe there is something to do...
         dthr = math.radians(rawAngle)  # angle traveled
         d = distance              # distance traveled
@@ -773,7 +851,7 @@ class Create:
             else: dirstr = 'CW'
             # compute the velocity, given that the robot's
             # radius is 258mm/2.0
-            vel_mm_sec = math.fabs(rad_per_sec) * (WHEEL_SPAN/2.0)
+            vel_mm_sec = math.fabs(rad_per_sec) * (self.wheelSpan/2.0)
             # send it off to the robot
             self._drive( vel_mm_sec, 0, dirstr )
         
@@ -798,11 +876,118 @@ class Create:
     
     def _start(self):
         """ changes from OFF_MODE to PASSIVE_MODE """
-        self._write( START )
-        # they recommend 20 ms between mode-changing commands
-        time.sleep(0.25)
-        # change the mode we think we're in...
-        return
+        return self._changeMode( START, PASSIVE_MODE )
+
+    def _queryMode(self):
+        """ asks the robot for its OI mode (packet 35)
+        returns the mode, or None if the robot didn't answer in time
+        """
+        r = self._getRawSensorDataAsList( [OI_MODE] )
+        if len(r) < 1:
+            return None
+        return r[0]
+
+    @_serialized
+    def _changeMode(self, command, targetMode, timeout=MODE_HANDSHAKE_TIMEOUT):
+        """ sends a mode-changing command and polls OI_MODE until
+        the robot reports targetMode or the timeout runs out, sending
+        the command again between polls if it seems to have been lost
+        returns True if the change was confirmed
+        """
+        self._write( command )
+        if self.ser == 'sim':
+            self._confirmMode( targetMode )
+            return True
+
+        # the robot handles bytes in order, so the first reply normally
+        # already shows the new mode - poll with a short read timeout
+        # in case it is still waking up
+        oldTimeout = self.ser.timeout
+        self.ser.timeout = MODE_POLL_TIMEOUT
+        sent = time.monotonic()
+        deadline = sent + timeout
+        confirmed = False
+        try:
+            while True:
+                mode = self._queryMode()
+                if mode == targetMode:
+                    confirmed = True
+                    break
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                if mode is None or now - sent >= MODE_RESEND_INTERVAL:
+                    self._write( command )
+                    sent = now
+        finally:
+            self.ser.timeout = oldTimeout
+            # late replies to earlier polls would corrupt the next read
+            self.ser.reset_input_buffer()
+
+        if confirmed:
+            self._confirmMode( targetMode )
+        else:
+            print('Warning: robot did not confirm', modeStr(targetMode),
+                  'within', timeout, 'seconds')
+            # change the mode we think we're in, but keep it a guess
+            self.sciMode = targetMode
+            self._invalidateMode()
+        return confirmed
+
+    def _confirmMode(self, mode):
+        """ records a mode the robot has just reported """
+        self.sciMode = mode
+        self._modeConfirmedAt = time.monotonic()
+
+    def _invalidateMode(self):
+        """ the robot may have changed mode by itself - the next
+        ensureMode checks OI_MODE before trusting sciMode
+        """
+        self._modeConfirmedAt = None
+
+    def _modeIsFresh(self, maxAge):
+        """ True if sciMode was confirmed less than maxAge seconds ago """
+        if self._modeConfirmedAt is None:
+            return False
+        return time.monotonic() - self._modeConfirmedAt < maxAge
+
+    def verifyMode(self):
+        """ reads OI_MODE (packet 35) and updates the tracked mode
+        returns the mode, or None if the robot didn't answer
+        """
+        if self.ser == 'sim':
+            return self.sciMode
+        mode = self._queryMode()
+        if mode is None:
+            self._invalidateMode()
+        else:
+            self._confirmMode( mode )
+        return mode
+
+    def ensureMode(self, mode, maxAge=MODE_VERIFY_INTERVAL):
+        """ puts the robot into mode (PASSIVE_MODE, SAFE_MODE or FULL_MODE)
+        sending only the commands needed from the mode it is in
+        a mode confirmed less than maxAge seconds ago is trusted,
+        an older one is checked against OI_MODE first
+        returns True once the robot is confirmed to be in mode
+        """
+        if self.sciMode == mode and self._modeIsFresh(maxAge):
+            return True
+        # the OI doesn't answer sensor queries before START
+        if self.sciMode != OFF_MODE and not self._modeIsFresh(maxAge):
+            self.verifyMode()
+        if self.sciMode == mode and self._modeConfirmedAt is not None:
+            return True
+
+        if mode == PASSIVE_MODE:
+            return self._start()
+        # SAFE and FULL are accepted from PASSIVE, SAFE or FULL mode,
+        # so START is only needed when the OI isn't running yet
+        if self.sciMode == OFF_MODE or self._modeConfirmedAt is None:
+            self._start()
+        if mode == FULL_MODE:
+            return self._changeMode( FULL, FULL_MODE )
+        return self._changeMode( SAFE, SAFE_MODE )
     
     def close(self):
         """ tries to shutdown the robot as kindly as possible, by
@@ -817,7 +1002,13 @@ class Create:
         time.sleep(0.1)
         self._start()       # send Create back to passive mode
         time.sleep(0.1)
+        if self._musicScheduler is not None:
+            self._musicScheduler.stop()
+            self._musicScheduler = None
         self.ser.close()
+        if self._scriptExecutor is not None:
+            self._scriptExecutor.shutdown(wait=False)
+            self._scriptExecutor = None
         return
     
     def _closeSer(self):
@@ -830,6 +1021,7 @@ class Create:
         self.ser.open()
         return
 
+    @_serialized
     def _drive(self, roomba_mm_sec, roomba_radius_mm, turn_dir='CCW'):
         """ implements the drive command as specified
         the turn_dir should be either 'CW' or 'CCW' for
@@ -881,6 +1073,7 @@ class Create:
         self._write( bytes([radiusLowVal]) )
 
     
+    @_serialized
     def setLEDs(self, power_color, power_intensity, play, advance ):
         """ The setLEDs method sets each of the three LEDs, from left to right:
         the power LED, the play LED, and the status LED.
@@ -925,6 +1118,7 @@ class Create:
     #    if you call this without integrating odometry, the
     #    distance and rawAngle reported will be lost...
     #
+    @_serialized
     def _getRawSensorFrameAsList(self, packetnumber):
         """ gets back a raw string of sensor data
         which then can be used to create a SensorFrame
@@ -957,6 +1151,7 @@ class Create:
         return r
     
     
+    @_serialized
     def _getRawSensorDataAsList(self, listofsensors):
         """ gets the chosen sensors
         and returns the raw bytes, as a string
@@ -981,6 +1176,27 @@ class Create:
         """
         self.demo(1)
 
+
+    def clean(self):
+        """ starts the default cleaning cycle (Roomba)
+        the OI drops to PASSIVE_MODE while cleaning, where PLAY is
+        ignored, so background music is allowed to finish first
+        """
+        self.waitForMusic()
+        self._write( CLEAN )
+        self.sciMode = PASSIVE_MODE
+        self._invalidateMode()
+
+
+    def power(self):
+        """ powers the robot down (Roomba)
+        """
+        self._write( POWER )
+        self.sciMode = OFF_MODE
+        self._invalidateMode()
+        # the robot forgets its songs when it powers down
+        self._loadedSongs = None
+
     
     def demo(self, demoNumber=-1):
         """ runs one of the built-in demos for Create
@@ -1005,14 +1221,20 @@ class Create:
         if (demoNumber < -1 or demoNumber > 9):
             demoNumber = -1 # stop current demo
         
+        # demos run in PASSIVE_MODE, where background music can't play on
+        self.waitForMusic()
         self._write( DEMO )
         if demoNumber < 0 or demoNumber > 9:
             # invalid values are equivalent to stopping
             self._write( bytes([255]) ) # -1
         else:
             self._write( bytes([demoNumber]) )
+        # demos run in PASSIVE_MODE
+        self.sciMode = PASSIVE_MODE
+        self._invalidateMode()
 
     
+    @_serialized
     def setSong(self, songNumber, songDataList):
         """ this stores a song to roomba's memory to play later
         with the playSong command
@@ -1022,6 +1244,8 @@ class Create:
         note is the midi note number, from 31 to 127
         (outside this range, the note is a rest)
         duration is from 0 to 255 in 1/64ths of a second
+
+        nothing is sent if the slot already holds these notes
         """
         # any notes to play?
         if not isinstance(songDataList, (list, tuple)):
@@ -1034,45 +1258,106 @@ class Create:
         
         if songNumber < 0: songNumber = 0
         if songNumber > 15: songNumber = 15
-        
-        # indicate that a song is coming
-        self._write( SONG )
-        self._write( bytes([songNumber]) )
 
-        L = min(len(songDataList), 16)
-        self._write( bytes([L]) )
+        notes = self._songNotes(songDataList)
+        loaded = self._songCache()
+        if loaded.get(songNumber) == notes:
+            loaded.move_to_end(songNumber)
+            return
+
+        # indicate that a song is coming, then the notes - in one write
+        data = [songNumber, len(notes)]
+        for note, duration in notes:
+            data += [note, duration]
+        self._write( SONG + bytes(data) )
+        loaded[songNumber] = notes
+        loaded.move_to_end(songNumber)
+        return
 
+    def _songNotes(self, songDataList):
+        """ the (note, duration) tuple setSong uploads for songDataList """
+        notes = []
         # loop through the notes, up to 16
-        for note in songDataList[:L]:
+        for note in songDataList[:16]:
             # make sure its a tuple, or else we rest for 1/4 second
             if isinstance(note, tuple):
-                #more error checking here!
-                self._write( bytes([note[0]]) )  # note number
-                self._write( bytes([note[1]]) )  # duration
+                notes.append( (int(note[0]), int(note[1])) )
             else:
-                self._write( bytes([30]) )   # a rest note
-                self._write( bytes([16]) )   # 1/4 of a second
-                
-        return
-
+                notes.append( (30, 16) )   # a rest note, 1/4 of a second
+        return tuple(notes)
+
+    def _songCache(self):
+        if self._loadedSongs is None:
+            self._loadedSongs = OrderedDict()
+        return self._loadedSongs
+
+    @_serialized
+    def loadSong(self, list_of_notes, slots=SONG_CACHE_SLOTS):
+        """ makes sure list_of_notes is stored in one of slots and
+        returns that slot number
+        a song that is already loaded isn't sent again; otherwise it
+        goes into an empty slot or the least recently used one
+        """
+        notes = self._songNotes(list_of_notes)
+        loaded = self._songCache()
+        for slot, slotNotes in loaded.items():
+            if slot in slots and slotNotes == notes:
+                loaded.move_to_end(slot)
+                return slot
+        empty = [slot for slot in slots if slot not in loaded]
+        if empty:
+            slot = empty[0]
+        else:
+            # OrderedDict iterates least recently used first
+            slot = next(slot for slot in loaded if slot in slots)
+        self.setSong(slot, list_of_notes)
+        return slot
 
     def playSong(self, list_of_notes):
         """ The input to <tt>playSong</tt> should be specified as a list
         of pairs of [ note_number, note_duration ] format. Thus, 
         r.playSong( [(60,8),(64,8),(67,8),(72,8)] ) plays a quick C chord.
+        playing the same notes again only sends PLAY (see loadSong)
         """
-        # implemented by setting song #1 to the notes and then playing it
-        self.setSong(1, list_of_notes)
-        self.playSongNumber(1)
+        self.playSongNumber( self.loadSong(list_of_notes) )
 
     
+    def playMelody(self, melody, wait=True):
+        """ plays a melody of any length, streamed through the song
+        slots (see roomba.songs)
+        with wait=False, the melody is played by a scheduler thread and
+        a Future is returned at once, so driving can start right away;
+        cancelling the Future stops after the chunk that is playing
+        """
+        # imported here because the roomba package imports this module
+        from roomba.songs import SongPlayer
+        if wait:
+            SongPlayer(self).play(melody)
+            return None
+        return self._getMusicScheduler().schedule(SongPlayer(self).steps(melody))
+
+    def waitForMusic(self, timeout=None):
+        """ blocks until melodies started with wait=False are done
+        returns False if some are still playing after timeout seconds
+        """
+        if self._musicScheduler is None:
+            return True
+        return self._musicScheduler.join(timeout)
+
+    def _getMusicScheduler(self):
+        if self._musicScheduler is None:
+            from roomba.scheduler import MusicScheduler
+            self._musicScheduler = MusicScheduler()
+        return self._musicScheduler
+
     def playSongNumber(self, songNumber):
         """ plays song songNumber """
         if songNumber < 0: songNumber = 0
         if songNumber > 15: songNumber = 15
         
-        self._write( PLAY )
-        self._write( bytes([songNumber]) )
+        self._write( PLAY + bytes([songNumber]) )
+        if self._loadedSongs is not None and songNumber in self._loadedSongs:
+            self._loadedSongs.move_to_end(songNumber)
         
     
     def playNote(self, noteNumber, duration, songNumber=0):
@@ -1149,6 +1434,7 @@ class Create:
         r = self.ser.read(size=nBytesWaiting)
         return r
     
+    @_serialized
     def sensors( self, list_of_sensors_to_poll=6 ):
         """ this function updates the robot's currently maintained
         state of its robot sensors for those sensors requested
@@ -1376,12 +1662,12 @@ class Create:
             
             if (width == 1):
                 if startofdata >= len(r):
-                    print "Incomplete Sensor Packet"
+                    print("Incomplete Sensor Packet")
                     break
                 else: interpretedData = dataGetter(r[startofdata])
             if (width == 2):
                 if startofdata >= len(r) - 1:
-                    print "Incomplete Sensor Packet"
+                    print("Incomplete Sensor Packet")
                     break
                 else: interpretedData = dataGetter(r[startofdata], r[startofdata+1] )
                 
@@ -1416,6 +1702,17 @@ class Create:
             
             if sensorNum == DIRT_DETECTED:
                 self.sensord[DIRT_DETECTED] = interpretedData
+
+            # the robot reported its mode - no need to ask again for a while
+            if sensorNum == OI_MODE:
+                self._confirmMode( interpretedData )
+            # in SAFE_MODE a wheel drop, a cliff or a charger drops the
+            # robot to PASSIVE_MODE without telling us
+            if sensorNum == BUMPS_AND_WHEEL_DROPS and any(interpretedData[:3]):
+                self._invalidateMode()
+            if sensorNum in (CLIFF_LEFT, CLIFF_FRONT_LEFT, CLIFF_FRONT_RIGHT,
+                             CLIFF_RIGHT, CHARGING_SOURCES_AVAILABLE) and interpretedData:
+                self._invalidateMode()
                 
             # handle special cases
             if (sensorNum == DISTANCE):
@@ -1444,84 +1741,38 @@ class Create:
 
     def toFullMode(self):
         """ changes the state to FULL_MODE
+        does nothing if the robot is already confirmed in FULL_MODE
+        returns True once the robot has confirmed the change
         """
-        self._start()
-        time.sleep(0.03)
-        self.toSafeMode()
-        time.sleep(0.03)
-        self._write( FULL )
-        time.sleep(0.03)
-        self.sciMode = FULL_MODE
-        
-        return
+        return self.ensureMode( FULL_MODE )
 
     
     def toSafeMode(self):
         """ changes the state (from PASSIVE_MODE or FULL_MODE)
         to SAFE_MODE
+        does nothing if the robot is already confirmed in SAFE_MODE
+        returns True once the robot has confirmed the change
         """
-        self._start()
-        time.sleep(0.03)
-        # now we're in PASSIVE_MODE, so we repeat the above code...
-        self._write( SAFE )
-        # they recommend 20 ms between mode-changing commands
-        time.sleep(0.03)
-        # change the mode we think we're in...
-        self.sciMode = SAFE_MODE
-        # no response here, so we don't get any...
-        return
+        return self.ensureMode( SAFE_MODE )
 
-    def play_starwars(robot):
-        starwars1 = [(a4,Q), (a4,Q), (a4,Q), (f4,Ed), (c5,S), (a4,Q), (f4,Ed), (c5,S), (a4,HALF)]
-        starwars2 = [(e5,Q), (e5,Q), (e5,Q), (f5,Ed), (c5,S),(aes4,Q), (f4,Ed), (c5,S), (a4,HALF)]
-        starwars3 = [(a5,Q), (a4,Ed), (a4,S), (a5,Q), (aes5,E), (g5,E),(ges5,S), (f5,S), (ges5,S)]
-        starwars4 = [(r,E), (bes4,E), (ees5,Q), (d5,E), (des5,E),(c5,S), (b4,S), (c5,E), (c5,E)]
-        starwars5 = [(r,E), (f4,E), (aes4,Q), (f4,Ed), (aes4,S),(c5,Q), (a4,Ed), (c5,S), (e5,HALF)]
-        starwars6 = [(r,E), (f4,E), (aes4,Q), (f4,Ed), (c5,S),(a4,Q), (f4,Ed), (c5,S), (a4,HALF)]
-        print("uploading songs")
-        robot.setSong( 1, starwars1 )
-        robot.setSong( 2, starwars2 )
-        robot.setSong( 3, starwars3 )
-        time.sleep(2.0)
-        print("playing part 1")
-        robot.playSongNumber(1)
-        time.sleep(MEASURE_TIME*2.01)
-        print("playing part 2")
-        robot.playSongNumber(2)
-        time.sleep(MEASURE_TIME*2.01)
-#        print("playing part 3")
-#        robot.playSongNumber(3)
-#        robot.setSong( 1, starwars4 )
-#        time.sleep(MEASURE_TIME*1.26)
-#        print("playing part 4")
-#        robot.playSongNumber(1)
-#        robot.setSong( 2, starwars5 )
-#        time.sleep(MEASURE_TIME*1.15)
-#        print("playing part 5")
-#        robot.playSongNumber(2)
-#        robot.setSong( 3, starwars3 )
-#        time.sleep(MEASURE_TIME*1.76)
-#        print("playing part 3 again")
-#        robot.playSongNumber(3)
-#        robot.setSong( 2, starwars6 )
-#        time.sleep(MEASURE_TIME*1.26)
-#        print("playing part 4 again")
-#        robot.playSongNumber(1)
-#        time.sleep(MEASURE_TIME*1.15)
-#        print("playing part 6")
-#        robot.playSongNumber(2)
-#        time.sleep(MEASURE_TIME*1.76)
-        print("done")
-
-        ser = serial.Serial('/dev/ttyUSB0', 115200)
-        ser.close()
-
-        ser.open()
-        ser.write(bytes([128])) # 128: start command
-        ser.write(bytes([131])) # 131: safe command
-        time.sleep(1)
-        ser.write(bytes([135])) # 135: clean command
-        ser.close()
+    def play_starwars(robot, wait=True):
+        """ plays the Imperial March, in full and without gaps
+        with wait=False, returns a Future at once (see playMelody)
+        """
+        # imported here because the roomba package imports this module
+        from roomba.songs import STARWARS
+        print("playing the Imperial March")
+        return robot.playMelody(STARWARS, wait)
+
+    def playJingle(self, melody=None):
+        """ plays the opening of melody (the Imperial March by default),
+        as much as fits in one song slot, with a single PLAY and
+        without waiting: the robot finishes the song by itself, so
+        clean() can follow at once and start cleaning while it plays
+        """
+        # imported here because the roomba package imports this module
+        from roomba.songs import STARWARS, iter_chunks
+        self.playSong( next(iter_chunks(melody or STARWARS)) )
 
     
     def getMode(self):
@@ -1568,28 +1819,78 @@ class Create:
         self._write( bytes([number_of_bytes]) )
         return
     
+    @_serialized
     def _endScript(self, timeout=-1.0):
+        """ runs the script and returns once it has finished
+        (or after timeout seconds, if timeout is not negative)
+        returns True if the script was seen to finish
+        """
         # issue the ENDSCRIPT command to start the script
         self._write( ENDSCRIPT )
-        interval = 1.0
-        total = 0.0
-        
-        # strip out all existing crap
-        while(self.ser.read(8192) != b''):
-            continue
-        
-        # poll
-        while(timeout<0.0 or total < timeout):
-            self._write(SENSORS)
-            self._write(bytes([7]))  # smallest packet value that I can tell
-            if self.ser.read(1) != b'':
-                break
-            time.sleep(interval - 0.5)
-            total = total + interval
-    
-        # strip out again, we buffered up lots of junk
-        while(self.ser.read(8192) != b''):
-            continue
+        return self._waitForScript(timeout)
+
+    def _endScriptAsync(self, timeout=-1.0):
+        """ runs the script without waiting for it
+        returns a concurrent.futures.Future that resolves to the
+        _endScript result; leave the serial port alone until it's done
+        """
+        self._write( ENDSCRIPT )
+        return self._getScriptExecutor().submit(self._waitForScript, timeout)
+
+    def _getScriptExecutor(self):
+        if self._scriptExecutor is None:
+            self._scriptExecutor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix='create-script')
+        return self._scriptExecutor
+
+    def runScripts(self, scripts, wait=True):
+        """ uploads and runs script bodies one after another -
+        roomba.script.compile_path turns a whole path into these
+        each body is at most MAX_SCRIPT_LENGTH bytes
+        with wait=False, returns a Future for the whole sequence
+        returns True if every script was seen to finish
+        """
+        for script in scripts:
+            if len(script) > MAX_SCRIPT_LENGTH:
+                raise ValueError('script of %d bytes is longer than %d'
+                                 % (len(script), MAX_SCRIPT_LENGTH))
+        if not wait:
+            return self._getScriptExecutor().submit(self.runScripts, scripts)
+        finished = True
+        with self._serialLock:
+            for script in scripts:
+                # one write per script: opcode, length and body
+                self._write( SCRIPT + bytes([len(script)]) + bytes(script) )
+                finished = self._endScript() and finished
+        return finished
+
+    @_serialized
+    def _waitForScript(self, timeout=-1.0):
+        """ probes with SENSORS 7 until the robot answers, which
+        it only does once the running script has finished
+        """
+        if self.ser == 'sim':
+            return True
+
+        # anything buffered before the script started isn't a probe reply
+        self.ser.reset_input_buffer()
+        oldTimeout = self.ser.timeout
+        self.ser.timeout = SCRIPT_POLL_TIMEOUT
+        deadline = time.monotonic() + timeout
+        finished = False
+        try:
+            while True:
+                # smallest packet value that I can tell
+                self._write( SENSORS + bytes([BUMPS_AND_WHEEL_DROPS]) )
+                if self.ser.read(1) != b'':
+                    finished = True
+                    break
+                if timeout >= 0.0 and time.monotonic() >= deadline:
+                    break
+        finally:
+            self.ser.timeout = oldTimeout
+            self.ser.reset_input_buffer()
+        return finished
     
     def _waitForDistance(self, distance_mm):
         self._write(WAITDIST)
@@ -1605,34 +1906,126 @@ class Create:
         self._write( bytes([leftLowVal]) )
         return
     
-    def turn(self, angle_deg, deg_per_sec=20):
+    def turn(self, angle_deg, deg_per_sec=20, wait=True):
+        """ turns angle_deg in place on the robot
+        with wait=False, returns a Future for the script instead
+        of waiting for it to finish
+        """
         if angle_deg==0:
             return
         if deg_per_sec==0:
             deg_per_sec=20
         if (angle_deg < 0 and deg_per_sec > 0) or (angle_deg > 0 and deg_per_sec < 0):
             deg_per_sec = 0 - deg_per_sec
-        self._startScript(13)
-        self.go(0, deg_per_sec)
-        self._waitForAngle(angle_deg)
-        self.stop()
-        self._endScript()
+        # hold the port for the whole upload, so background music
+        # can't land in the middle of the script
+        with self._serialLock:
+            self._startScript(13)
+            self.go(0, deg_per_sec)
+            self._waitForAngle(angle_deg)
+            self.stop()
+            if not wait:
+                return self._endScriptAsync()
+            self._endScript()
         #self.sensors([POSE])   # updated by Sean
 
-    def move(self, distance_cm, cm_per_sec=10):
+    def move(self, distance_cm, cm_per_sec=10, wait=True):
+        """ drives distance_cm straight on the robot
+        with wait=False, returns a Future for the script instead
+        of waiting for it to finish
+        """
         if distance_cm==0:
             return
         if cm_per_sec==0:
             cm_per_sec=10
         if (distance_cm < 0 and cm_per_sec > 0) or (distance_cm > 0 and cm_per_sec < 0):
             cm_per_sec = 0 - cm_per_sec
-        self._startScript(13)
-        self.go(cm_per_sec, 0)
-        self._waitForDistance(distance_cm*10)
-        self.stop()
-        self._endScript()
+        # the whole upload under the lock, as in turn()
+        with self._serialLock:
+            self._startScript(13)
+            self.go(cm_per_sec, 0)
+            self._waitForDistance(distance_cm*10)
+            self.stop()
+            if not wait:
+                return self._endScriptAsync()
+            self._endScript()
         #self.sensors([POSE])   # updated by Sean
 
+    def moveAsync(self, distance_cm, cm_per_sec=10):
+        """ starts driving distance_cm straight and returns at once
+        returns a concurrent.futures.Future for the distance actually
+        driven (cm, from the encoders) once the robot has stopped
+
+        unlike move(wait=False), which runs an OI script the robot won't
+        interrupt, this drives from the host: cancelling the future stops
+        the robot where it is, and other threads can keep reading sensors
+        """
+        if cm_per_sec==0:
+            cm_per_sec=10
+        if (distance_cm < 0 and cm_per_sec > 0) or (distance_cm > 0 and cm_per_sec < 0):
+            cm_per_sec = 0 - cm_per_sec
+        def progress(start, pose):
+            # distance along the starting heading, in cm
+            along = ((pose[0] - start[0]) * math.cos(start[2]) +
+                     (pose[1] - start[1]) * math.sin(start[2]))
+            return math.fabs(along) / 10.0
+        return self._startMotion(cm_per_sec, 0, progress, math.fabs(distance_cm))
+
+    def turnAsync(self, angle_deg, deg_per_sec=20):
+        """ starts turning angle_deg in place and returns at once
+        returns a concurrent.futures.Future for the angle actually
+        turned (degrees, from the encoders) once the robot has stopped
+        cancelling the future stops the robot - see moveAsync
+        """
+        if deg_per_sec==0:
+            deg_per_sec=20
+        if (angle_deg < 0 and deg_per_sec > 0) or (angle_deg > 0 and deg_per_sec < 0):
+            deg_per_sec = 0 - deg_per_sec
+        def progress(start, pose):
+            turned = pose[2] - start[2]
+            # _integrateNextEncoderStep wraps theta at +-100 pi
+            if math.fabs(turned) > 50*math.pi:
+                turned -= math.copysign(101*math.pi, turned)
+            return math.fabs(math.degrees(turned))
+        return self._startMotion(0, deg_per_sec, progress, math.fabs(angle_deg))
+
+    def _startMotion(self, cm_per_sec, deg_per_sec, progress, target):
+        # the future stays pending while the robot moves, so that
+        # cancel() works until the motion has finished
+        future = Future()
+        self._getScriptExecutor().submit(
+            self._runMotion, future, cm_per_sec, deg_per_sec, progress, target)
+        return future
+
+    def _runMotion(self, future, cm_per_sec, deg_per_sec, progress, target):
+        """ drives until progress(startPose, pose) reaches target
+        or the future is cancelled, then stops the robot
+        """
+        if future.cancelled():
+            return
+        done = 0.0
+        try:
+            try:
+                # the first reading sets the encoder baseline
+                self.sensors([ENCODER_LEFT, ENCODER_RIGHT])
+                start = self.getPose(dist='mm', angle='rad')
+                self.go(cm_per_sec, deg_per_sec)
+                while not future.cancelled():
+                    time.sleep(MOTION_POLL_INTERVAL)
+                    self.sensors([ENCODER_LEFT, ENCODER_RIGHT])
+                    done = progress(start, self.getPose(dist='mm', angle='rad'))
+                    if done >= target:
+                        break
+            finally:
+                self.stop()
+        except Exception as e:
+            # a future cancelled meanwhile stays cancelled
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(done)
+
     # James' syntactic sugar/kludgebox
 
     def senseFunc(self, sensorName):
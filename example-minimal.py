@@ -2,7 +2,7 @@
 
     This is a demo python file showing what can be done with the debounce_handler.
     The handler prints True when you say "Alexa, device on" and False when you say
-    "Alexa, device off".
+    "Alexa, device off", and starts or stops the robot.
 
     If you have two or more Echos, it only handles the one that hears you more clearly.
     You can have an Echo per room and not worry about your handlers triggering for
@@ -14,7 +14,6 @@
 
 import fauxmo
 import logging
-import time
 
 from debounce_handler import debounce_handler
 
@@ -26,10 +25,16 @@ class device_handler(debounce_handler):
     """
     TRIGGERS = {"Stardust Destroyer": 52000}
 
+    def __init__(self):
+        debounce_handler.__init__(self)
+        self.robot = fauxmo.robot_handler()
+
     def act(self, client_address, state, name):
         print("State", state, "on ", name, "from client @", client_address)
-        return True
-        #print "echo test456"
+        # runs on fauxmo's action queue, after the Echo has had its reply
+        if state:
+            return self.robot.on(client_address, name)
+        return self.robot.off(client_address, name)
 
 if __name__ == "__main__":
     # Startup the fauxmo server
@@ -46,11 +51,10 @@ if __name__ == "__main__":
 
     # Loop and poll for incoming Echo requests
     logging.debug("Entering fauxmo polling loop")
-    while True:
-        try:
-            # Allow time for a ctrl-c to stop the process
-            p.poll(100)
-            time.sleep(0.1)
-        except Exception as e:
-            logging.critical("Critical exception: " + str(e))
-            break
+    try:
+        # Blocks until a request arrives; ctrl-c stops the process
+        p.run()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logging.critical("Critical exception: " + str(e))
@@ -6,7 +6,7 @@ multiple behaviors: spiral pattern movement, bump-and-turn obstacle avoidance,
 and cliff detection. Showcases advanced robotics concepts for portfolio.
 
 Key Concepts Demonstrated:
-- Coverage path planning (spiral pattern)
+- Coverage path planning (spiral pattern steered by a coverage map)
 - Behavior-based architecture
 - Obstacle avoidance (bump sensors)
 - Safety mechanisms (cliff detection)
@@ -14,16 +14,24 @@ Key Concepts Demonstrated:
 - Real-time decision making
 """
 
+import math
 import time
 import random
 import logging
 from roomba import Create, SAFE_MODE
 from roomba.sensors import (
     BUMPS_AND_WHEEL_DROPS, CLIFF_LEFT, CLIFF_FRONT_LEFT,
-    CLIFF_FRONT_RIGHT, CLIFF_RIGHT, BATTERY_CHARGE, BATTERY_CAPACITY
+    CLIFF_FRONT_RIGHT, CLIFF_RIGHT, BATTERY_CHARGE, BATTERY_CAPACITY,
+    ENCODER_LEFT, ENCODER_RIGHT
 )
 from config import DEFAULT_PORT, configure_logging
 
+# The coverage map needs NumPy; without it the cleaner drives blind
+try:
+    from roomba.mapping import CoverageGrid, SWEPT
+except ImportError:
+    CoverageGrid = None
+
 # Configure logging
 configure_logging(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -47,24 +55,42 @@ class AutonomousCleaner:
     # Battery threshold for low battery warning
     LOW_BATTERY_THRESHOLD = 20  # percent
 
-    def __init__(self, robot):
-        """Initialize autonomous cleaner with robot instance."""
+    # Coverage map parameters
+    LOOKAHEAD_MM = 300  # How far ahead to check for already-swept floor
+    STEER_GAIN = 1.5  # deg/s of spin per degree of heading error
+
+    def __init__(self, robot, coverage=None):
+        """
+        Initialize autonomous cleaner with robot instance.
+
+        Args:
+            robot: Create instance
+            coverage: Optional CoverageGrid; one is created when NumPy is available
+        """
         self.robot = robot
         self.running = True
         self.current_speed = 10  # Start slow
         self.coverage_time = 0
         self.bumps_handled = 0
         self.cliffs_avoided = 0
+        if coverage is None and CoverageGrid is not None:
+            coverage = CoverageGrid()
+        self.coverage = coverage
 
     def read_sensors(self):
         """Read and return all relevant sensor data."""
         self.robot.sensors([
             BUMPS_AND_WHEEL_DROPS,
             CLIFF_LEFT, CLIFF_FRONT_LEFT, CLIFF_FRONT_RIGHT, CLIFF_RIGHT,
-            BATTERY_CHARGE, BATTERY_CAPACITY
+            BATTERY_CHARGE, BATTERY_CAPACITY,
+            ENCODER_LEFT, ENCODER_RIGHT
         ])
         d = self.robot.sensord
 
+        # Reading the encoders updated the pose estimate; fold it into the map
+        if self.coverage is not None:
+            self.coverage.update_from_robot(self.robot)
+
         return {
             'left_bump': (d.get(BUMPS_AND_WHEEL_DROPS, 0) & 0x02) != 0,
             'right_bump': (d.get(BUMPS_AND_WHEEL_DROPS, 0) & 0x01) != 0,
@@ -157,19 +183,44 @@ class AutonomousCleaner:
             return True
         return False
 
+    def steer_to_frontier(self):
+        """
+        Return a spin rate toward unexplored floor, or None to keep spiralling.
+
+        Only steers when the floor just ahead has already been swept.
+        """
+        if self.coverage is None:
+            return None
+        x, y, theta = self.robot.getPose(dist='mm', angle='rad')
+        ahead_x = x + self.LOOKAHEAD_MM * math.cos(theta)
+        ahead_y = y + self.LOOKAHEAD_MM * math.sin(theta)
+        if self.coverage.state_at(ahead_x, ahead_y) != SWEPT:
+            return None
+
+        target = self.coverage.nearest_frontier(ahead_x, ahead_y)
+        if target is None:
+            return None
+        bearing = math.atan2(target[1] - y, target[0] - x)
+        error = math.degrees(math.atan2(math.sin(bearing - theta), math.cos(bearing - theta)))
+        return max(-self.TURN_SPEED, min(self.TURN_SPEED, self.STEER_GAIN * error))
+
     def execute_spiral_pattern(self):
         """
         Execute spiral coverage pattern - default cleaning behavior.
 
-        Gradually increases turning radius to cover maximum area.
+        Gradually increases turning radius to cover maximum area. When the
+        coverage map shows the path ahead is already clean, steers toward
+        the nearest unexplored frontier instead of re-sweeping it.
         """
         # Slowly increase forward speed to create spiral
         if self.current_speed < self.MAX_SPIRAL_SPEED:
             self.current_speed += 0.1
 
-        # Constant gentle turn creates spiral
-        # Positive spin = clockwise spiral
-        spin_rate = 15
+        spin_rate = self.steer_to_frontier()
+        if spin_rate is None:
+            # Constant gentle turn creates spiral
+            # Positive spin = clockwise spiral
+            spin_rate = 15
 
         self.robot.go(int(self.current_speed), spin_rate)
 
@@ -180,6 +231,8 @@ class AutonomousCleaner:
         logger.info(f"  Coverage Time:    {self.coverage_time:.1f} seconds")
         logger.info(f"  Obstacles Avoided: {self.bumps_handled}")
         logger.info(f"  Cliffs Avoided:    {self.cliffs_avoided}")
+        if self.coverage is not None:
+            logger.info(f"  Floor Covered:     {self.coverage.coverage_percentage():.1f}%")
         logger.info("=" * 60)
 
     def run(self, duration=60):
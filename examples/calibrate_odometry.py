@@ -0,0 +1,67 @@
+"""
+Odometry calibration tool.
+
+Drives a square and a multi-turn rotation, fits WHEEL_SPAN, TICK_PER_MM and
+ANGULAR_ERROR, and stores the result for this robot and floor type.
+
+Before running, put a strip of tape under the robot's front edge so you can
+measure how far it actually turned. Pass the measurement with --measured-deg
+for an accurate ANGULAR_ERROR fit.
+
+Usage:
+    python examples/calibrate_odometry.py --floor carpet --measured-deg 700
+"""
+
+import argparse
+import logging
+from roomba import Create, SAFE_MODE
+from roomba.calibration import OdometryCalibrator, CalibrationStore
+from config import DEFAULT_PORT, ROBOT_ID, FLOOR_TYPE, CALIBRATION_FILE, configure_logging
+
+# Configure logging
+configure_logging(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """Run the calibration maneuvers and store the fitted constants."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--robot', default=ROBOT_ID, help='robot id to store results under')
+    parser.add_argument('--floor', default=FLOOR_TYPE, help='floor type to store results under')
+    parser.add_argument('--side-cm', type=float, default=50, help='square side length')
+    parser.add_argument('--turns', type=int, default=2, help='full turns for the rotation run')
+    parser.add_argument('--measured-deg', type=float, default=None,
+                        help='angle actually turned during the rotation run')
+    args = parser.parse_args()
+
+    logger.info(f"Connecting to Roomba on {DEFAULT_PORT}")
+    robot = Create(DEFAULT_PORT, startingMode=SAFE_MODE)
+
+    try:
+        calibrator = OdometryCalibrator(robot)
+
+        logger.info(f"Driving a {args.side_cm:.0f} cm square...")
+        calibrator.run_square(side_cm=args.side_cm)
+
+        logger.info(f"Rotating {args.turns} full turns...")
+        calibrator.run_rotation(turns=args.turns, measured_deg=args.measured_deg)
+
+        result = calibrator.fit()
+        logger.info(f"Result: {result}")
+
+        store = CalibrationStore(CALIBRATION_FILE)
+        store.save(args.robot, args.floor, result)
+        result.apply(robot)
+
+    except KeyboardInterrupt:
+        logger.info("Calibration interrupted by user")
+    except Exception as e:
+        logger.error(f"Error during calibration: {e}")
+    finally:
+        # Always close the connection
+        logger.info("Closing robot connection")
+        robot.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,16 @@
 Music playback example demonstrating MIDI note control.
 
 This example shows how to compose and play songs using the roomba package.
+Pass a .mid file to play its first track with notes instead:
+
+    python play_music.py imperial_march.mid
 """
 
-import time
 import logging
+import sys
 from roomba import Create, SAFE_MODE
 from roomba.music import c5, d5, e5, f5, g5, a5, QUARTER, HALF, EIGHTH
+from roomba.midi import play_midi
 from config import DEFAULT_PORT, configure_logging
 
 # Configure logging
@@ -24,8 +28,13 @@ def main():
     robot = Create(DEFAULT_PORT, startingMode=SAFE_MODE)
 
     try:
+        if len(sys.argv) > 1:
+            logger.info(f"Playing MIDI file {sys.argv[1]}...")
+            play_midi(robot, sys.argv[1])
+            return
+
         # Define a simple melody (C major scale)
-        logger.info("Playing C major scale...")
+        logger.info("Playing C major scale while turning...")
         scale = [
             (c5, QUARTER),
             (d5, QUARTER),
@@ -34,10 +43,13 @@ def main():
             (g5, QUARTER),
             (a5, QUARTER),
         ]
-        robot.playSong(scale)
-        time.sleep(3.0)
+        # the scale plays on the music scheduler thread, so the turn
+        # starts right away instead of after the last note
+        song = robot.playMelody(scale, wait=False)
+        robot.turn(360)
+        song.result()
 
-        # Define Mary Had a Little Lamb
+        # Define Mary Had a Little Lamb (longer than one 16-note song slot)
         logger.info("Playing Mary Had a Little Lamb...")
         mary = [
             (e5, QUARTER), (d5, QUARTER), (c5, QUARTER), (d5, QUARTER),
@@ -49,8 +61,7 @@ def main():
             (d5, QUARTER), (d5, QUARTER), (e5, QUARTER), (d5, QUARTER),
             (c5, HALF),
         ]
-        robot.playSong(mary)
-        time.sleep(8.0)
+        robot.playMelody(mary)
 
         logger.info("Music demo complete!")
 
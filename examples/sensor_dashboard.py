@@ -47,6 +47,9 @@ sensor_data = {
     'connected': False
 }
 
+# Seconds without a new snapshot before /stream sends a keepalive comment
+STREAM_KEEPALIVE = 15.0
+
 # Historical data for charts (last 60 readings)
 sensor_history = {
     'timestamps': deque(maxlen=60),
@@ -380,6 +383,76 @@ DASHBOARD_HTML = """
 """
 
 
+class SnapshotBroadcaster:
+    """
+    Fans sensor snapshots out to every /stream client.
+
+    publish() serialises a snapshot once, as a ready-to-send SSE frame, and
+    wakes the subscribers only if it differs from the last one. Each client
+    waits on the same condition variable, so N browser tabs cost one
+    json.dumps() per change instead of N per tick.
+    """
+
+    def __init__(self, keepalive=STREAM_KEEPALIVE):
+        """
+        Args:
+            keepalive (float): Idle seconds before a subscriber gets a comment
+        """
+        self.keepalive = keepalive
+        self._cond = threading.Condition()
+        self._version = 0
+        self._payload = None
+        self._frame = None
+        self._closed = False
+
+    def publish(self, data):
+        """
+        Share a new snapshot with the subscribers.
+
+        Returns:
+            bool: True if it differed from the previous snapshot
+        """
+        payload = json.dumps(data)
+        with self._cond:
+            if payload == self._payload:
+                return False
+            self._payload = payload
+            self._frame = f"data: {payload}\n\n".encode('utf-8')
+            self._version += 1
+            self._cond.notify_all()
+        return True
+
+    def close(self):
+        """End every subscription."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def subscribe(self):
+        """
+        Yield SSE frames: the latest snapshot at once, then each new one.
+
+        A ': keepalive' comment goes out after keepalive idle seconds so
+        proxies and browsers keep the connection open.
+        """
+        seen = 0
+        while True:
+            with self._cond:
+                changed = self._cond.wait_for(
+                    lambda: self._closed or self._version != seen, self.keepalive)
+                if self._closed:
+                    return
+                if changed:
+                    seen, frame = self._version, self._frame
+                else:
+                    frame = b': keepalive\n\n'
+            yield frame
+
+
+# One broadcaster for all /stream clients
+broadcaster = SnapshotBroadcaster()
+
+
 class SensorMonitor:
     """Monitors robot sensors and updates global data."""
 
@@ -415,6 +488,7 @@ class SensorMonitor:
             logger.info(f"Connecting to robot on {self.robot_port}...")
             self.robot = Create(self.robot_port, startingMode=SAFE_MODE)
             sensor_data['connected'] = True
+            broadcaster.publish(sensor_data)
             logger.info("✅ Robot connected")
 
             while self.running:
@@ -424,6 +498,7 @@ class SensorMonitor:
         except Exception as e:
             logger.error(f"Error in sensor monitor: {e}")
             sensor_data['connected'] = False
+            broadcaster.publish(sensor_data)
         finally:
             if self.robot:
                 self.robot.close()
@@ -492,6 +567,9 @@ class SensorMonitor:
             sensor_history['voltage'].append(d.get(VOLTAGE, 0))
             sensor_history['wall_signal'].append(d.get(WALL_SIGNAL, 0))
 
+            # Wake the /stream clients if anything changed
+            broadcaster.publish(sensor_data)
+
         except Exception as e:
             logger.error(f"Error reading sensors: {e}")
 
@@ -512,13 +590,8 @@ def api_sensors():
 @app.route('/stream')
 def stream():
     """Server-Sent Events stream for real-time updates."""
-    def event_stream():
-        while True:
-            # Send current sensor data
-            yield f"data: {json.dumps(sensor_data)}\n\n"
-            time.sleep(0.5)  # Update every 500ms
-
-    return Response(event_stream(), mimetype='text/event-stream')
+    return Response(broadcaster.subscribe(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
 
 def main():
@@ -541,6 +614,7 @@ def main():
     except KeyboardInterrupt:
         logger.info("\n🛑 Shutting down...")
     finally:
+        broadcaster.close()
         monitor.stop()
 
 
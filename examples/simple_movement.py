@@ -7,6 +7,7 @@ This example shows basic robot control using the new modular structure.
 import time
 import logging
 from roomba import Create, SAFE_MODE
+from roomba.script import square, run_path
 from config import DEFAULT_PORT, configure_logging
 
 # Configure logging
@@ -55,6 +56,11 @@ def main():
         # Stop
         logger.info("Stopping")
         robot.stop()
+        time.sleep(1.0)
+
+        # Drive a square as a single on-robot script
+        logger.info("Driving a 50 cm square")
+        run_path(robot, square(side_cm=50))
 
         logger.info("Demo complete!")
 
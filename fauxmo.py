@@ -27,19 +27,29 @@ THE SOFTWARE.
 # For a complete discussion, see http://www.makermusings.com
 # TODO(semartin): investigate time.sleep usage in here...
 
+import bisect
 import email.utils
+import heapq
+import itertools
+import os
+import random
+import re
 import requests
 import select
+import selectors
+import signal
 import socket
 import struct
 import sys
+import threading
 import time
 import urllib
 import uuid
 import logging
-import serial
-import time
 import create
+import config
+from roomba.calibration import CalibrationStore
+from roomba.daemon import RobotClient, run_command
 
 # define silence
 #r = 30
@@ -101,51 +111,828 @@ SETUP_XML = """<?xml version="1.0"?>
     <modelName>Emulated Socket</modelName>
     <modelNumber>3.1415</modelNumber>
     <UDN>uuid:Socket-1_0-%(device_serial)s</UDN>
+    <serviceList>
+      <service>
+        <serviceType>urn:Belkin:service:basicevent:1</serviceType>
+        <serviceId>urn:Belkin:serviceId:basicevent1</serviceId>
+        <controlURL>%(path_prefix)s/upnp/control/basicevent1</controlURL>
+        <eventSubURL>%(path_prefix)s/upnp/event/basicevent1</eventSubURL>
+        <SCPDURL>%(path_prefix)s/eventservice.xml</SCPDURL>
+      </service>
+    </serviceList>
   </device>
 </root>
 """
 
 
+SERVER_VERSION = "Unspecified, UPnP/1.0, Unspecified"
+BELKIN_SEARCH_TARGET = "urn:Belkin:device:**"
+SET_BINARY_STATE = "urn:Belkin:service:basicevent:1#SetBinaryState"
+GET_BINARY_STATE = "urn:Belkin:service:basicevent:1#GetBinaryState"
+BINARY_STATE = re.compile(br'<BinaryState>(\d)</BinaryState>')
+
+# An M-SEARCH's MX header is the number of seconds over which devices should
+# spread their replies; UPnP treats anything above 5 as 5.
+DEFAULT_MX = 1
+MAX_MX = 5
+MX_HEADER = re.compile(br'^MX:[ \t]*(\d+)[ \t]*\r?$', re.IGNORECASE | re.MULTILINE)
+
+
 def dbg(msg):
     logging.debug(msg)
 
 
+# Responses are rendered to bytes once per device, split around the value
+# of their DATE header. Only the date changes between requests, and it is
+# formatted at most once a second, so answering a burst of requests from
+# several Echos costs a couple of byte joins per device.
+
+_date_second = None
+_date_bytes = b""
+
+
+def http_date():
+    """ the current time as an HTTP date, formatted at most once a second """
+    global _date_second, _date_bytes
+    now = int(time.time())
+    if now != _date_second:
+        _date_bytes = email.utils.formatdate(now, localtime=False, usegmt=True).encode("ascii")
+        _date_second = now
+    return _date_bytes
+
+
+def search_mx(data):
+    """ the MX of an M-SEARCH request in seconds, clamped to 0-MAX_MX """
+    match = MX_HEADER.search(data)
+    if not match:
+        return DEFAULT_MX
+    return min(int(match.group(1)), MAX_MX)
+
+
+def dated(template):
+    """ joins a (before the date, after the date) template with the current date """
+    return template[0] + http_date() + template[1]
+
+
+def http_response_template(body, content_type, extra_headers="", connection="close", status="200 OK"):
+    """ renders a response carrying body, as a template for dated() """
+    body = body.encode("utf-8")
+    head = ("HTTP/1.1 %s\r\n"
+            "CONTENT-LENGTH: %d\r\n"
+            "CONTENT-TYPE: %s\r\n"
+            "DATE: " % (status, len(body), content_type))
+    tail = ("\r\n"
+            "%s"
+            "SERVER: %s\r\n"
+            "X-User-Agent: redsonic\r\n"
+            "CONNECTION: %s\r\n"
+            "\r\n" % (extra_headers, SERVER_VERSION, connection))
+    return head.encode("utf-8"), tail.encode("utf-8") + body
+
+
+def http_response_templates(body, content_type, extra_headers="", status="200 OK"):
+    """ the (close, keep-alive) templates of a response - index with request.keep_alive() """
+    return (http_response_template(body, content_type, extra_headers, "close", status),
+            http_response_template(body, content_type, extra_headers, "keep-alive", status))
+
+
+# GetBinaryState answers, indexed by state and then keep_alive
+
+GET_STATE_XML = """<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>
+<u:GetBinaryStateResponse xmlns:u="urn:Belkin:service:basicevent:1">
+<BinaryState>%d</BinaryState>
+</u:GetBinaryStateResponse>
+</s:Body> </s:Envelope>"""
+
+GET_STATE_RESPONSES = [http_response_templates(GET_STATE_XML % state, "text/xml charset=\"utf-8\"", "EXT:\r\n") for state in (0, 1)]
+NOT_FOUND_RESPONSES = http_response_templates("", "text/plain", status="404 Not Found")
+BAD_REQUEST_RESPONSES = http_response_templates("", "text/plain", status="400 Bad Request")
+
+
+# An HTTP request parsed by http_parser. Header names are lower case.
+
+class http_request(object):
+    def __init__(self, method, path, version, headers):
+        self.method = method
+        self.path = path
+        self.version = version
+        self.headers = headers
+        self.body = b""
+        # set by the device that handles it, for the metrics
+        self.action = "unknown"
+
+    def header(self, name, default = ""):
+        return self.headers.get(name, default)
+
+    def content_length(self):
+        try:
+            length = int(self.header("content-length", "0"))
+        except ValueError:
+            raise ValueError("bad Content-Length %r" % self.header("content-length"))
+        if length < 0:
+            raise ValueError("bad Content-Length %d" % length)
+        return length
+
+    def keep_alive(self):
+        connection = self.header("connection").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+# Incremental parser for the requests on one connection. feed() takes
+# whatever recv() returned and hands back every request it completes, so
+# a request split over several reads, and several pipelined or keep-alive
+# requests in one read, are both handled. Only the new bytes are scanned
+# for the end of the headers.
+
+class http_parser(object):
+    MAX_HEADER_SIZE = 8192
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.scanned = 0
+        self.request = None
+
+    def feed(self, data):
+        """ returns the http_requests completed by data; raises ValueError on a malformed request """
+        self.buffer += data
+        completed = []
+        while True:
+            if self.request is None:
+                # blank lines between requests are allowed
+                while self.buffer[:2] == b"\r\n":
+                    del self.buffer[:2]
+                    self.scanned = 0
+                end = self.buffer.find(b"\r\n\r\n", max(0, self.scanned - 3))
+                if end == -1:
+                    self.scanned = len(self.buffer)
+                    if self.scanned > self.MAX_HEADER_SIZE:
+                        raise ValueError("request headers too long")
+                    return completed
+                self.request = self.parse_head(bytes(self.buffer[:end]))
+                del self.buffer[:end + 4]
+                self.scanned = 0
+            length = self.request.content_length()
+            if len(self.buffer) < length:
+                return completed
+            self.request.body = bytes(self.buffer[:length])
+            del self.buffer[:length]
+            completed.append(self.request)
+            self.request = None
+
+    @staticmethod
+    def parse_head(head):
+        lines = head.decode("latin-1").split("\r\n")
+        request_line = lines[0].split()
+        if len(request_line) != 3 or not request_line[2].startswith("HTTP/"):
+            raise ValueError("bad request line %r" % lines[0])
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise ValueError("bad header line %r" % line)
+            headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise ValueError("chunked request bodies are not supported")
+        method, path, version = request_line
+        return http_request(method.upper(), path, version.upper(), headers)
+
+
+def search_response_template(location_url, nls_uuid, server_version, search_target, persistent_uuid, other_headers = None):
+    """ renders an SSDP search reply, as a template for dated() """
+    head = ("HTTP/1.1 200 OK\r\n"
+            "CACHE-CONTROL: max-age=86400\r\n"
+            "DATE: ")
+    tail = ("\r\n"
+            "EXT:\r\n"
+            "LOCATION: %s\r\n"
+            "OPT: \"http://schemas.upnp.org/upnp/1/0/\"; ns=01\r\n"
+            "01-NLS: %s\r\n"
+            "SERVER: %s\r\n"
+            "ST: %s\r\n"
+            "USN: uuid:%s::%s\r\n" % (location_url, nls_uuid, server_version, search_target, persistent_uuid, search_target))
+    for header in other_headers or []:
+        tail += "%s\r\n" % header
+    tail += "\r\n"
+    return head.encode("utf-8"), tail.encode("utf-8")
+
+
+# Request timings, kept as fixed-bucket histograms and rendered in the
+# Prometheus text format by metrics_device. Observing a value is a
+# bisect and two additions, cheap enough for every request, unlike the
+# dbg() prints.
+
+class histogram(object):
+    # seconds; covers microsecond replies up to SSDP's MX delays
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+               0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets = None):
+        self.buckets = buckets or self.BUCKETS
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class metrics(object):
+    HELP = {
+        'fauxmo_request_seconds': 'HTTP request time from accept (or the first byte of a keep-alive request) to response sent',
+        'fauxmo_request_stage_seconds': 'HTTP request time spent parsing, in the device handler and sending',
+        'fauxmo_action_seconds': 'Action handler ON/OFF run time on the action queue',
+        'fauxmo_ssdp_reply_seconds': 'SSDP search received to reply sent, including the MX delay',
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = histogram()
+            h.observe(seconds)
+
+    @staticmethod
+    def format_labels(labels, extra = None):
+        labels = list(labels) + ([extra] if extra else [])
+        if not labels:
+            return ""
+        escaped = ['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                   for k, v in labels]
+        return "{%s}" % ",".join(escaped)
+
+    def render(self):
+        """ the histograms in the Prometheus text exposition format """
+        lines = []
+        with self.lock:
+            items = sorted(self.histograms.items())
+            snapshot = [(key, list(h.buckets), list(h.counts), h.sum, h.count) for key, h in items]
+        last_name = None
+        for (name, labels), buckets, counts, total, count in snapshot:
+            if name != last_name:
+                lines.append("# HELP %s %s" % (name, self.HELP.get(name, name)))
+                lines.append("# TYPE %s histogram" % name)
+                last_name = name
+            cumulative = 0
+            for bound, n in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += n
+                lines.append("%s_bucket%s %d" % (name, self.format_labels(labels, ("le", bound)), cumulative))
+            lines.append("%s_sum%s %.9g" % (name, self.format_labels(labels), total))
+            lines.append("%s_count%s %d" % (name, self.format_labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+
+_shared_metrics = None
+
+
+def shared_metrics():
+    """ the metrics every listener, device and action queue records to by default """
+    global _shared_metrics
+    if _shared_metrics is None:
+        _shared_metrics = metrics()
+    return _shared_metrics
+
+
+# Robot commands go through the robot daemon (roomba-daemon.py), which keeps
+# the serial port open. If no daemon is running, fall back to opening the
+# port for the duration of the commands.
+
+# the ON routine waits out the Imperial March, longer than a daemon
+# client's default timeout
+ROBOT_COMMAND_TIMEOUT = 120
+
+def robot_commands(*commands):
+    try:
+        with RobotClient(config.ROBOT_SOCKET, timeout=ROBOT_COMMAND_TIMEOUT) as client:
+            return [client.call(*command) for command in commands]
+    except (FileNotFoundError, ConnectionRefusedError):
+        dbg("No robot daemon on %s, opening %s directly" % (config.ROBOT_SOCKET, config.DEFAULT_PORT))
+    robot = create.Create(config.DEFAULT_PORT, config.DEFAULT_BAUD_RATE)
+    CalibrationStore(config.CALIBRATION_FILE).apply(robot, config.ROBOT_ID, config.FLOOR_TYPE)
+    try:
+        return [run_command(robot, *command) for command in commands]
+    finally:
+        # let background music finish before the port is closed
+        robot.waitForMusic()
+        robot.close()
+
+
+# Robot routines for a fauxmo device: ON starts the opening of the
+# Imperial March and cleans, OFF powers the robot down.
+
+class robot_handler(object):
+    def on(self, client_address = None, name = None):
+        # CLEAN drops the OI to passive mode, where PLAY is ignored, so
+        # the jingle is played first; the robot finishes it by itself
+        # while cleaning starts, and nothing waits for the full march
+        robot_commands(('safe',), ('play_jingle',), ('clean',))
+        return True
+
+    def off(self, client_address = None, name = None):
+        robot_commands(('safe',), ('power',))
+        return True
+
+
+# The last known ON (1) or OFF (0) state of each device, by name, so
+# GetBinaryState is answered without going near the robot. fauxmo
+# records every SetBinaryState it accepts and robot_telemetry corrects
+# the table from what the robot reports.
+
+class state_table(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+
+    def get(self, name):
+        return self.states.get(name, 0)
+
+    def set(self, name, state):
+        """ returns True if the state changed """
+        with self.lock:
+            changed = self.states.get(name, 0) != state
+            self.states[name] = state
+        if changed:
+            dbg("%s is now %s" % (name, "ON" if state else "OFF"))
+        return changed
+
+
+_shared_state_table = None
+
+
+def shared_state_table():
+    """ the table devices use unless given their own """
+    global _shared_state_table
+    if _shared_state_table is None:
+        _shared_state_table = state_table()
+    return _shared_state_table
+
+
+# Polls the robot daemon for the OI mode and charging state every
+# TELEMETRY_INTERVAL seconds and turns the named device OFF in the state
+# table when the robot is off or charging on the dock. It only talks to
+# a running daemon: opening the serial port itself would restart the
+# robot's Open Interface on every poll.
+
+class robot_telemetry(object):
+    TELEMETRY_INTERVAL = 30
+    OI_MODE = 35
+    CHARGING_STATE = 21
+    # charging states 1-4 are reconditioning, full, trickle and waiting
+    CHARGING = (1, 2, 3, 4)
+
+    def __init__(self, name, states = None, interval = None):
+        self.name = name
+        self.states = states or shared_state_table()
+        self.interval = self.TELEMETRY_INTERVAL if interval is None else interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='fauxmo-telemetry', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def robot_state(self, sensors):
+        """ 0 if the sensors show the robot off or charging, None if they can't tell """
+        mode = sensors.get(str(self.OI_MODE))
+        charging = sensors.get(str(self.CHARGING_STATE))
+        if mode == 0 or charging in self.CHARGING:
+            return 0
+        return None
+
+    def poll(self):
+        try:
+            with RobotClient(config.ROBOT_SOCKET) as client:
+                sensors = client.call('sensors', [self.OI_MODE, self.CHARGING_STATE])
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        except Exception as e:
+            dbg("Telemetry for %s failed: %s" % (self.name, e))
+            return None
+        state = self.robot_state(sensors)
+        if state is not None:
+            self.states.set(self.name, state)
+        return state
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.poll()
+
+
+# Runs action handler calls one at a time on a worker thread, so fauxmo
+# can answer the Echo at once instead of after the robot routine. Each
+# action waits COALESCE_WINDOW seconds before it runs; if another action
+# for the same handler and device arrives meanwhile it replaces the
+# waiting one, so an ON quickly followed by an OFF only turns the device
+# off. Devices sharing a handler are queued separately. A handler with
+# a debounce(name, state) method, such as legacy/debounce_handler.py, is
+# debounced when the request arrives rather than when its action runs, so
+# a repeat from a second Echo is dropped even while the first is in
+# flight; its act() is then called directly.
+
+class action_queue(object):
+    COALESCE_WINDOW = 0.1
+
+    def __init__(self, window = None, metrics = None):
+        self.window = self.COALESCE_WINDOW if window is None else window
+        self.metrics = metrics or shared_metrics()
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.busy = False
+        self.thread = threading.Thread(target=self.run, name='fauxmo-actions', daemon=True)
+        self.thread.start()
+
+    def put(self, handler, state, client_address, name):
+        """ queues handler.on() or handler.off() for the worker thread """
+        debounce = getattr(handler, 'debounce', None)
+        if debounce is not None and debounce(name, state):
+            dbg("Dropped repeated %s for %s from %s" % ("ON" if state else "OFF", name, client_address))
+            return True
+        with self.cond:
+            key = (id(handler), name)
+            replaced = self.pending.pop(key, None)
+            if replaced:
+                dbg("Coalesced %s for %s into %s" % ("ON" if replaced[2] else "OFF", name, "ON" if state else "OFF"))
+            self.pending[key] = (time.monotonic() + self.window, handler, state, client_address, name)
+            self.cond.notify_all()
+        return True
+
+    def join(self, timeout = None):
+        """ waits until every queued action has run """
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.pending and not self.busy, timeout)
+
+    def next_action(self):
+        with self.cond:
+            while True:
+                if not self.pending:
+                    self.cond.wait()
+                    continue
+                key = min(self.pending, key=lambda k: self.pending[k][0])
+                remaining = self.pending[key][0] - time.monotonic()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                self.busy = True
+                return self.pending.pop(key)[1:]
+
+    def run(self):
+        while True:
+            handler, state, client_address, name = self.next_action()
+            started = time.monotonic()
+            try:
+                if hasattr(handler, 'debounce'):
+                    handler.act(client_address, state, name)
+                elif state:
+                    handler.on(client_address, name)
+                else:
+                    handler.off(client_address, name)
+            except Exception as e:
+                logging.error("Action %s for %s failed: %s" % ("ON" if state else "OFF", name, e))
+            finally:
+                self.metrics.observe('fauxmo_action_seconds', time.monotonic() - started,
+                                     device = name, action = "on" if state else "off")
+                with self.cond:
+                    self.busy = False
+                    self.cond.notify_all()
+
+
+_shared_action_queue = None
+
+
+def shared_action_queue():
+    """ the queue devices use unless given their own, so all actions run one at a time """
+    global _shared_action_queue
+    if _shared_action_queue is None:
+        _shared_action_queue = action_queue()
+    return _shared_action_queue
+
+
 # A simple utility class to wait for incoming data to be
-# ready on a socket.
+# ready on a socket, or for a timer to come due. It blocks (epoll on
+# Linux) until there is something to do, so an idle fauxmo uses no CPU
+# and a request is handled as soon as it arrives. wakeup() and stop()
+# may be called from other threads or signal handlers.
 
 class poller:
     def __init__(self):
-        self.poller = select.poll()
+        self.selector = selectors.DefaultSelector()
         self.targets = {}
+        self.timers = []
+        self.timer_lock = threading.Lock()
+        self.timer_seq = itertools.count()
+        self.running = False
+
+        # writing a byte here interrupts a blocking poll()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(self.wakeup_w, False)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ)
 
     def add(self, target, fileno = None):
-        if not fileno:
+        if fileno is None:
             fileno = target.fileno()
-        self.poller.register(fileno, select.POLLIN)
+        self.selector.register(fileno, selectors.EVENT_READ)
         self.targets[fileno] = target
 
     def remove(self, target, fileno = None):
-        if not fileno:
+        if fileno is None:
             fileno = target.fileno()
-        self.poller.unregister(fileno)
+        self.selector.unregister(fileno)
         del(self.targets[fileno])
 
-    def poll(self, timeout = 0):
-        ready = self.poller.poll(timeout)
-        num = len(ready)
-        for one_ready in ready:
-            target = self.targets.get(one_ready[0], None)
+    def call_later(self, delay, callback, *args):
+        """ runs callback(*args) from poll() after delay seconds
+        returns a handle for cancel_timer()
+        """
+        timer = [time.monotonic() + delay, next(self.timer_seq), callback, args]
+        with self.timer_lock:
+            heapq.heappush(self.timers, timer)
+        self.wakeup()
+        return timer
+
+    def cancel_timer(self, timer):
+        timer[2] = None
+
+    def wakeup(self):
+        try:
+            os.write(self.wakeup_w, b'\0')
+        except BlockingIOError:
+            pass    # a wakeup is already pending
+
+    def stop(self):
+        self.running = False
+        self.wakeup()
+
+    def close(self):
+        self.selector.close()
+        os.close(self.wakeup_r)
+        os.close(self.wakeup_w)
+
+    def _run_timers(self):
+        due = []
+        now = time.monotonic()
+        with self.timer_lock:
+            while self.timers and self.timers[0][0] <= now:
+                due.append(heapq.heappop(self.timers))
+        ran = 0
+        for deadline, seq, callback, args in due:
+            if callback is not None:
+                callback(*args)
+                ran += 1
+        return ran
+
+    def poll(self, timeout = None):
+        """ waits up to timeout milliseconds (forever if None, and never
+        past the next timer) and dispatches whatever is ready
+        returns the number of sockets and timers handled
+        """
+        wait = None if timeout is None else timeout / 1000.0
+        with self.timer_lock:
+            next_timer = self.timers[0][0] if self.timers else None
+        if next_timer is not None:
+            due = max(0.0, next_timer - time.monotonic())
+            wait = due if wait is None else min(wait, due)
+        num = 0
+        for key, events in self.selector.select(wait):
+            if key.fd == self.wakeup_r:
+                try:
+                    while os.read(self.wakeup_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+            target = self.targets.get(key.fd, None)
             if target:
-                target.do_read(one_ready[0])
-        return num
+                target.do_read(key.fd)
+                num += 1
+        return num + self._run_timers()
+
+    def run(self):
+        """ dispatches sockets and timers until stop() is called """
+        self.running = True
+        while self.running:
+            self.poll()
+
+
+# An HTTP listening socket and its client connections. A listener made
+# for one device hands it every request; a shared listener serves many
+# devices and routes on the first path segment, which is the device's
+# persistent uuid (/Socket-1_0-<serial>/setup.xml). Requests without a
+# known prefix go to the listener's only device, if it has just one.
+
+class http_listener(object):
+    # idle keep-alive connections are closed after this many seconds
+    KEEPALIVE_TIMEOUT = 60
+
+    def __init__(self, poller, ip_address, port = 0, shared = False, metrics = None):
+        self.poller = poller
+        self.metrics = metrics or shared_metrics()
+        self.ip_address = ip_address
+        self.shared = shared
+        self.routes = {}
+        self.devices = []
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((ip_address, port))
+        self.socket.listen(128 if shared else 5)
+        self.port = self.socket.getsockname()[1]
+        self.poller.add(self)
+        self.client_sockets = {}
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def add_device(self, device):
+        """ serves device from this listener, setting its http, port and path_prefix """
+        prefix = ""
+        if self.shared:
+            prefix = "/" + device.persistent_uuid
+            self.routes[device.persistent_uuid] = device
+        self.devices.append(device)
+        device.http = self
+        device.port = self.port
+        device.path_prefix = prefix
+
+    def route(self, request):
+        """ returns the device for a request, stripping its path prefix; None if unknown """
+        name, sep, rest = request.path[1:].partition("/")
+        device = self.routes.get(name)
+        if device:
+            request.path = "/" + rest
+            return device
+        if len(self.devices) == 1:
+            return self.devices[0]
+        return None
+
+    def do_read(self, fileno):
+        if fileno == self.socket.fileno():
+            (client_socket, client_address) = self.socket.accept()
+            client_fileno = client_socket.fileno()
+            self.poller.add(self, client_fileno)
+            # then the idle timer, when the request being read started
+            # and when the connection was last active
+            now = time.monotonic()
+            self.client_sockets[client_fileno] = [client_socket, client_address, http_parser(), None, now, now]
+            self.touch_client(client_fileno)
+            return
+
+        client = self.client_sockets[fileno]
+        client_socket, client_address, parser = client[:3]
+        try:
+            data = client_socket.recv(4096)
+            received = time.monotonic()
+            if client[4] is None:
+                client[4] = received
+            completed = parser.feed(data) if data else None
+            parsed = time.monotonic()
+        except (OSError, ValueError) as e:
+            dbg("Dropping connection from %s: %s" % (client_address[0], e))
+            completed = None
+        if completed is None:
+            self.close_client(fileno)
+            return
+
+        for request in completed:
+            device = self.route(request)
+            handling = time.monotonic()
+            if device:
+                response = device.handle_request(request, client_address)
+            else:
+                dbg("No device for %s %s" % (request.method, request.path))
+                response = dated(NOT_FOUND_RESPONSES[request.keep_alive()])
+            handled = time.monotonic()
+            try:
+                if response:
+                    client_socket.sendall(response)
+            except OSError as e:
+                dbg("Dropping connection from %s: %s" % (client_address[0], e))
+                self.close_client(fileno)
+                return
+            sent = time.monotonic()
+            self.observe(device, request, client[4], received, parsed, handling, handled, sent)
+            # pipelined requests, and any partial one left over, came with this read
+            client[4] = received
+            if not request.keep_alive():
+                self.close_client(fileno)
+                return
+        if parser.request is None and not parser.buffer:
+            client[4] = None
+        self.touch_client(fileno)
+
+    def observe(self, device, request, started, received, parsed, handling, handled, sent):
+        labels = {'device' : device.get_name() if device else "unknown", 'action' : request.action}
+        self.metrics.observe('fauxmo_request_seconds', sent - started, **labels)
+        self.metrics.observe('fauxmo_request_stage_seconds', parsed - received, stage = "parse", **labels)
+        self.metrics.observe('fauxmo_request_stage_seconds', handled - handling, stage = "handler", **labels)
+        self.metrics.observe('fauxmo_request_stage_seconds', sent - handled, stage = "send", **labels)
+
+    def touch_client(self, fileno):
+        """ restarts the idle timeout of a client connection - only the
+        time is recorded, so a busy connection doesn't pile up timers
+        """
+        client = self.client_sockets[fileno]
+        client[5] = time.monotonic()
+        if not client[3]:
+            client[3] = self.poller.call_later(self.KEEPALIVE_TIMEOUT, self.check_idle, fileno)
+
+    def check_idle(self, fileno):
+        """ closes a connection idle for KEEPALIVE_TIMEOUT, or waits out the rest """
+        client = self.client_sockets.get(fileno)
+        if not client:
+            return
+        idle = time.monotonic() - client[5]
+        if idle >= self.KEEPALIVE_TIMEOUT:
+            dbg("Closing idle connection from %s" % client[1][0])
+            self.close_client(fileno)
+        else:
+            client[3] = self.poller.call_later(self.KEEPALIVE_TIMEOUT - idle, self.check_idle, fileno)
+
+    def close_client(self, fileno):
+        client = self.client_sockets.pop(fileno, None)
+        if client:
+            if client[3]:
+                self.poller.cancel_timer(client[3])
+            self.poller.remove(self, fileno)
+            client[0].close()
+
+    def close(self):
+        for fileno in list(self.client_sockets):
+            self.close_client(fileno)
+        self.poller.remove(self)
+        self.socket.close()
+
+
+# A fixed set of shared listeners on the given ports. Each device added
+# goes to the listener with the fewest devices, so every device has a port
+# of its own. The Echo posts its ON/OFF requests to the bare
+# /upnp/control/basicevent1 on the device's port rather than to the
+# controlURL from setup.xml, so a second device on a port could never be
+# switched: adding more devices than ports raises ValueError unless
+# overcommit is set, for clients that do follow the path prefix.
+
+class listener_pool(object):
+    def __init__(self, poller, ip_address = None, ports = (0,), overcommit = False):
+        ip_address = ip_address or upnp_device.local_ip_address()
+        self.listeners = [http_listener(poller, ip_address, port, shared = True) for port in ports]
+        self.overcommit = overcommit
+
+    def add_device(self, device):
+        listener = min(self.listeners, key = lambda listener: len(listener.devices))
+        if listener.devices:
+            if not self.overcommit:
+                raise ValueError("no free port for %s: %d ports already serve a device each, "
+                                 "and the Echo can only reach one device per port"
+                                 % (device.name, len(self.listeners)))
+            dbg("%s shares port %d, an Echo can't switch it" % (device.name, listener.port))
+        listener.add_device(device)
+
+    def close(self):
+        for listener in self.listeners:
+            listener.close()
+
+
+# Serves GET /metrics in the Prometheus text format from a listener of
+# its own, e.g. metrics_device(http_listener(p, "0.0.0.0", 9120)).
+
+class metrics_device(object):
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, http, metrics = None):
+        self.metrics = metrics or shared_metrics()
+        self.persistent_uuid = "metrics"
+        http.add_device(self)
+
+    def get_name(self):
+        return "metrics"
+
+    def handle_request(self, request, client_address):
+        keep_alive = request.keep_alive()
+        if request.method == "GET" and request.path == "/metrics":
+            request.action = "metrics"
+            connection = "keep-alive" if keep_alive else "close"
+            return dated(http_response_template(self.metrics.render(), self.CONTENT_TYPE, connection = connection))
+        return dated(NOT_FOUND_RESPONSES[keep_alive])
 
 
 # Base class for a generic UPnP device. This is far from complete
 # but it supports either specified or automatic IP address and port
-# selection.
+# selection. By default each device listens on its own socket; pass an
+# http_listener or listener_pool as http to serve it from a shared one.
 
 class upnp_device(object):
     this_host_ip = None
+    reply_socket = None
 
     @staticmethod
     def local_ip_address():
@@ -161,7 +948,7 @@ class upnp_device(object):
         return upnp_device.this_host_ip
 
 
-    def __init__(self, listener, poller, port, root_url, server_version, persistent_uuid, other_headers = None, ip_address = None):
+    def __init__(self, listener, poller, port, root_url, server_version, persistent_uuid, other_headers = None, ip_address = None, http = None):
         self.listener = listener
         self.poller = poller
         self.port = port
@@ -176,58 +963,38 @@ class upnp_device(object):
         else:
             self.ip_address = upnp_device.local_ip_address()
 
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind((self.ip_address, self.port))
-        self.socket.listen(5)
-        if self.port == 0:
-            self.port = self.socket.getsockname()[1]
-        self.poller.add(self)
-        self.client_sockets = {}
+        if http is None:
+            http = http_listener(self.poller, self.ip_address, self.port)
+        http.add_device(self)
+        self.ip_address = self.http.ip_address
+        self.socket = self.http.socket
+        self.client_sockets = self.http.client_sockets
+        self.search_templates = {}
+        self.search_template(BELKIN_SEARCH_TARGET)
         self.listener.add_device(self)
 
-    def fileno(self):
-        return self.socket.fileno()
-
-    def do_read(self, fileno):
-        if fileno == self.socket.fileno():
-            (client_socket, client_address) = self.socket.accept()
-            self.poller.add(self, client_socket.fileno())
-            self.client_sockets[client_socket.fileno()] = (client_socket, client_address)
-        else:
-            data, sender = self.client_sockets[fileno][0].recvfrom(4096)
-            if not data:
-                self.poller.remove(self, fileno)
-                del(self.client_sockets[fileno])
-            else:
-                self.handle_request(data, sender, self.client_sockets[fileno][0], self.client_sockets[fileno][1])
-
-    def handle_request(self, data, sender, socket, client_address):
-        pass
+    def handle_request(self, request, client_address):
+        """ returns the response bytes for an http_request, or None """
+        return None
 
     def get_name(self):
         return "unknown"
 
-    def respond_to_search(self, destination, search_target):
+    def search_template(self, search_target):
+        template = self.search_templates.get(search_target)
+        if template is None:
+            location_url = self.root_url % {'ip_address' : self.ip_address, 'port' : self.port, 'path_prefix' : self.path_prefix}
+            template = search_response_template(location_url, self.uuid, self.server_version, search_target, self.persistent_uuid, self.other_headers)
+            self.search_templates[search_target] = template
+        return template
+
+    def respond_to_search(self, destination, search_target, received = None):
         dbg("Responding to search for %s" % self.get_name())
-        date_str = email.utils.formatdate(timeval=None, localtime=False, usegmt=True)
-        location_url = self.root_url % {'ip_address' : self.ip_address, 'port' : self.port}
-        message = ("HTTP/1.1 200 OK\r\n"
-                  "CACHE-CONTROL: max-age=86400\r\n"
-                  "DATE: %s\r\n"
-                  "EXT:\r\n"
-                  "LOCATION: %s\r\n"
-                  "OPT: \"http://schemas.upnp.org/upnp/1/0/\"; ns=01\r\n"
-                  "01-NLS: %s\r\n"
-                  "SERVER: %s\r\n"
-                  "ST: %s\r\n"
-                  "USN: uuid:%s::%s\r\n" % (date_str, location_url, self.uuid, self.server_version, search_target, self.persistent_uuid, search_target))
-        if self.other_headers:
-            for header in self.other_headers:
-                message += "%s\r\n" % header
-        message += "\r\n"
-        temp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        temp_socket.sendto(message, destination)
+        if not upnp_device.reply_socket:
+            upnp_device.reply_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        upnp_device.reply_socket.sendto(dated(self.search_template(search_target)), destination)
+        if received is not None:
+            self.http.metrics.observe('fauxmo_ssdp_reply_seconds', time.monotonic() - received, device = self.get_name())
 
 
 # This subclass does the bulk of the work to mimic a WeMo switch on the network.
@@ -237,17 +1004,24 @@ class fauxmo(upnp_device):
     def make_uuid(name):
         return ''.join(["%x" % sum([ord(c) for c in name])] + ["%x" % ord(c) for c in "%sfauxmo!" % name])[:14]
 
-    def __init__(self, name, listener, poller, ip_address, port, action_handler = None):
+    def __init__(self, name, listener, poller, ip_address, port, action_handler = None, actions = None, http = None, states = None):
         self.serial = self.make_uuid(name)
         self.name = name
         self.ip_address = ip_address
         persistent_uuid = "Socket-1_0-" + self.serial
         other_headers = ['X-User-Agent: redsonic']
-        upnp_device.__init__(self, listener, poller, port, "http://%(ip_address)s:%(port)s/setup.xml", "Unspecified, UPnP/1.0, Unspecified", persistent_uuid, other_headers=other_headers, ip_address=ip_address)
+        upnp_device.__init__(self, listener, poller, port, "http://%(ip_address)s:%(port)s%(path_prefix)s/setup.xml", SERVER_VERSION, persistent_uuid, other_headers=other_headers, ip_address=ip_address, http=http)
         if action_handler:
             self.action_handler = action_handler
         else:
             self.action_handler = self
+        self.actions = actions or shared_action_queue()
+        self.states = states or shared_state_table()
+        xml = SETUP_XML % {'device_name' : self.name, 'device_serial' : self.serial, 'path_prefix' : self.path_prefix}
+        self.setup_responses = http_response_templates(xml, "text/xml", "LAST-MODIFIED: Sat, 01 Jan 2000 00:01:15 GMT\r\n")
+        # The echo is happy with the 200 status code and doesn't
+        # appear to care about the SOAP response body
+        self.soap_responses = http_response_templates("", "text/xml charset=\"utf-8\"", "EXT:\r\n")
         dbg("FauxMo device '%s' ready on %s:%s" % (self.name, self.ip_address, self.port))
 
     def get_name(self):
@@ -296,91 +1070,44 @@ class fauxmo(upnp_device):
 #        print("done")
 
 
-    def handle_request(self, data, sender, socket, client_address):
-        if data.find('GET /setup.xml HTTP/1.1') == 0:
+    def handle_request(self, request, client_address):
+        keep_alive = request.keep_alive()
+        soap_action = request.header("soapaction").strip('"')
+        if request.method == "GET" and request.path == "/setup.xml":
+            request.action = "setup"
             dbg("Responding to setup.xml for %s" % self.name)
-            xml = SETUP_XML % {'device_name' : self.name, 'device_serial' : self.serial}
-            date_str = email.utils.formatdate(timeval=None, localtime=False, usegmt=True)
-            message = ("HTTP/1.1 200 OK\r\n"
-                       "CONTENT-LENGTH: %d\r\n"
-                       "CONTENT-TYPE: text/xml\r\n"
-                       "DATE: %s\r\n"
-                       "LAST-MODIFIED: Sat, 01 Jan 2000 00:01:15 GMT\r\n"
-                       "SERVER: Unspecified, UPnP/1.0, Unspecified\r\n"
-                       "X-User-Agent: redsonic\r\n"
-                       "CONNECTION: close\r\n"
-                       "\r\n"
-                       "%s" % (len(xml), date_str, xml))
-            socket.send(message)
-        elif data.find('SOAPACTION: "urn:Belkin:service:basicevent:1#SetBinaryState"') != -1:
-            success = False
-            if data.find('<BinaryState>1</BinaryState>') != -1:
+            return dated(self.setup_responses[keep_alive])
+        if request.method == "POST" and soap_action == SET_BINARY_STATE:
+            # the handler runs on the action queue's thread; the Echo gets
+            # its answer now rather than after the robot routine
+            state = BINARY_STATE.search(request.body)
+            if state and state.group(1) == b"1":
                 # on
+                request.action = "on"
                 dbg("Responding to ON for %s" % self.name)
-                print "echo test123 on!"
-                ###
-                ROOMBA_PORT = "/dev/ttyUSB0"
-                robot = create.Create(ROOMBA_PORT)
-                robot.toSafeMode()
-                robot.play_starwars()
-                robot.close()
-
-                ser = serial.Serial('/dev/ttyUSB0', 115200)
-                ser.close()
-                time.sleep(0.03)
-
-                ser.open()
-                ser.write(chr(128)) # 128: start command
-                time.sleep(0.03)
-                ser.write(chr(131)) # 131: safe command
-                time.sleep(0.03)
-                ser.write(chr(135)) # 135: clean command
-                ser.close()
-                ###
-
-                success = self.action_handler.on(client_address[0], self.name)
-            elif data.find('<BinaryState>0</BinaryState>') != -1:
+                self.states.set(self.name, 1)
+                self.actions.put(self.action_handler, True, client_address[0], self.name)
+            elif state and state.group(1) == b"0":
                 # off
+                request.action = "off"
                 dbg("Responding to OFF for %s" % self.name)
-                print "echo test123 off!"
-                ###
-                ser = serial.Serial('/dev/ttyUSB0', 115200)
-                ser.close()
-
-                ser.open()
-                ser.write(chr(128)) # 128: start command
-                ser.write(chr(131)) # 131: safe command
-                ser.write(chr(133)) # 135: power off command
-                ser.close()
-                ###
-
-                success = self.action_handler.off(client_address[0], self.name)
+                self.states.set(self.name, 0)
+                self.actions.put(self.action_handler, False, client_address[0], self.name)
             else:
                 dbg("Unknown Binary State request:")
-                dbg(data)
-            if success:
-                # The echo is happy with the 200 status code and doesn't
-                # appear to care about the SOAP response body
-                soap = ""
-                date_str = email.utils.formatdate(timeval=None, localtime=False, usegmt=True)
-                message = ("HTTP/1.1 200 OK\r\n"
-                           "CONTENT-LENGTH: %d\r\n"
-                           "CONTENT-TYPE: text/xml charset=\"utf-8\"\r\n"
-                           "DATE: %s\r\n"
-                           "EXT:\r\n"
-                           "SERVER: Unspecified, UPnP/1.0, Unspecified\r\n"
-                           "X-User-Agent: redsonic\r\n"
-                           "CONNECTION: close\r\n"
-                           "\r\n"
-                           "%s" % (len(soap), date_str, soap))
-                socket.send(message)
-        else:
-            dbg(data)
-
-    def on(self):
+                dbg(request.body)
+                return dated(BAD_REQUEST_RESPONSES[keep_alive])
+            return dated(self.soap_responses[keep_alive])
+        if request.method == "POST" and soap_action == GET_BINARY_STATE:
+            request.action = "get_state"
+            return dated(GET_STATE_RESPONSES[self.states.get(self.name)][keep_alive])
+        dbg("Unhandled request %s %s" % (request.method, request.path))
+        return dated(NOT_FOUND_RESPONSES[keep_alive])
+
+    def on(self, client_address = None, name = None):
         return False
 
-    def off(self):
+    def off(self, client_address = None, name = None):
         return True
 
 
@@ -435,10 +1162,13 @@ class upnp_broadcast_responder(object):
     def do_read(self, fileno):
         data, sender = self.recvfrom(1024)
         if data:
-            if data.find('M-SEARCH') == 0 and data.find('urn:Belkin:device:**') != -1:
+            if data.startswith(b'M-SEARCH') and data.find(BELKIN_SEARCH_TARGET.encode()) != -1:
+                # each reply goes out at a random point within MX seconds, from
+                # a timer, so the poller keeps serving ON/OFF requests meanwhile
+                mx = search_mx(data)
+                received = time.monotonic()
                 for device in self.devices:
-                    time.sleep(0.5)
-                    device.respond_to_search(sender, 'urn:Belkin:device:**')
+                    device.poller.call_later(random.uniform(0, mx), device.respond_to_search, sender, BELKIN_SEARCH_TARGET, received)
             else:
                 pass
 
@@ -476,11 +1206,11 @@ class dummy_handler(object):
     def __init__(self, name):
         self.name = name
 
-    def on(self):
+    def on(self, client_address = None, name = None):
         print(self.name, "ON")
         return True
 
-    def off(self):
+    def off(self, client_address = None, name = None):
         print(self.name, "OFF")
         return True
 
@@ -490,16 +1220,17 @@ class rest_api_handler(object):
         self.on_cmd = on_cmd
         self.off_cmd = off_cmd
 
-    def on(self):
+    def on(self, client_address = None, name = None):
         r = requests.get(self.on_cmd)
         return r.status_code == 200
 
-    def off(self):
+    def off(self, client_address = None, name = None):
         r = requests.get(self.off_cmd)
         return r.status_code == 200
 
 if __name__ == "__main__":
     FAUXMOS = [
+        [config.FAUXMO_DEVICE_NAME, robot_handler()],
         ['office lights', dummy_handler("officelight")],
         ['kitchen lights', dummy_handler("kitchenlight")],
     ]
@@ -518,17 +1249,35 @@ if __name__ == "__main__":
     # when a broadcast is received.
     p.add(u)
 
+    # Serve the switches from a fixed port range, one each (the pool raises
+    # ValueError if there are more switches than ports), or from ephemeral ports
+    http = None
+    if config.FAUXMO_SHARED_PORTS:
+        http = listener_pool(p, None, range(config.FAUXMO_PORT, config.FAUXMO_PORT + config.FAUXMO_SHARED_PORTS))
+
     # Create our FauxMo virtual switch devices
     for one_faux in FAUXMOS:
-        switch = fauxmo(one_faux[0], u, p, None, 0, action_handler = one_faux[1])
+        switch = fauxmo(one_faux[0], u, p, None, 0, action_handler = one_faux[1], http = http)
+
+    # Prometheus metrics, if a port is configured
+    if config.FAUXMO_METRICS_PORT:
+        metrics_device(http_listener(p, "0.0.0.0", config.FAUXMO_METRICS_PORT))
+
+    # Keep the robot switch's state in step with the robot
+    telemetry = robot_telemetry(config.FAUXMO_DEVICE_NAME).start()
+
+    # SIGTERM (systemd) stops the loop; ctrl-c interrupts it
+    signal.signal(signal.SIGTERM, lambda signum, frame: p.stop())
 
     dbg("Entering main loop\n")
 
-    while True:
-        try:
-            # Allow time for a ctrl-c to stop the process
-            p.poll(100)
-            time.sleep(0.1)
-        except Exception as e:
-            dbg(e)
-            break
+    try:
+        # blocks until a request arrives or a timer is due
+        p.run()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        dbg(e)
+    finally:
+        telemetry.stop()
+        p.close()
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+asyncio implementation of the fauxmo WeMo emulator.
+
+fauxmo.py dispatches every socket from one hand-rolled poll loop, so a
+slow action handler stalls discovery and every other device. Here SSDP
+discovery is a DatagramProtocol on 239.255.255.250:1900 and each virtual
+switch serves its HTTP endpoint with asyncio.start_server, all on one
+event loop. Requests are parsed by fauxmo.http_parser, connections are
+kept alive, and ON/OFF is answered at once from the state table while the
+action handler runs in a task of its own, one action at a time per
+device. Action handlers may be coroutines; plain on()/off() handlers
+(such as the ones written for fauxmo.py) run in the default executor so
+they never block the loop.
+
+Usage:
+    python3 fauxmo_async.py
+
+Example:
+    import asyncio
+    from fauxmo_async import serve
+
+    class Lamp:
+        async def on(self, client_address, name):
+            return True
+
+        async def off(self, client_address, name):
+            return True
+
+    asyncio.run(serve([('lamp', Lamp(), 52002)]))
+"""
+
+import asyncio
+import functools
+import logging
+import random
+import socket
+import struct
+
+import config
+from fauxmo import (
+    BAD_REQUEST_RESPONSES, BELKIN_SEARCH_TARGET, BINARY_STATE, GET_BINARY_STATE,
+    GET_STATE_RESPONSES, NOT_FOUND_RESPONSES, SERVER_VERSION, SET_BINARY_STATE,
+    SETUP_XML, dated, fauxmo, http_listener, http_parser, http_response_templates,
+    robot_handler, robot_telemetry, search_mx, search_response_template,
+    shared_state_table, upnp_device
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SSDP_ADDR = '239.255.255.250'
+SSDP_PORT = 1900
+SEARCH_TARGET = BELKIN_SEARCH_TARGET
+
+# Seconds a client gets to finish a request it has started
+HTTP_TIMEOUT = 10.0
+
+# Seconds an idle keep-alive connection stays open
+KEEPALIVE_TIMEOUT = http_listener.KEEPALIVE_TIMEOUT
+
+
+async def call_handler(method, *args):
+    """
+    Call an action handler method without blocking the event loop.
+
+    Coroutine functions are awaited; plain functions run in the default
+    executor.
+    """
+    if asyncio.iscoroutinefunction(method):
+        return await method(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(method, *args))
+
+
+class AsyncUpnpDevice:
+    """
+    A UPnP device with an HTTP endpoint served by asyncio.
+
+    Subclasses implement handle_request().
+    """
+
+    def __init__(self, port, root_url, persistent_uuid, other_headers=None, ip_address=None):
+        """
+        Args:
+            port (int): HTTP port; 0 picks a free one in start()
+            root_url (str): LOCATION template with ip_address and port
+            persistent_uuid (str): USN uuid announced in search replies
+            other_headers (list): Extra header lines for search replies
+            ip_address (str): Address to bind; defaults to the LAN address
+        """
+        self.port = port
+        self.root_url = root_url
+        self.persistent_uuid = persistent_uuid
+        self.other_headers = other_headers or []
+        self.ip_address = ip_address or upnp_device.local_ip_address()
+        self.server = None
+        self.search_templates = {}
+
+    async def start(self):
+        """Start serving HTTP; resolves port 0 to the port chosen."""
+        self.server = await asyncio.start_server(
+            self._handle_client, self.ip_address, self.port, reuse_address=True)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.search_templates.clear()   # LOCATION carries the port
+        logger.debug(f'{self.get_name()} listening on {self.ip_address}:{self.port}')
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle_client(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        parser = http_parser()
+        try:
+            while True:
+                # a request in progress gets HTTP_TIMEOUT, an idle connection longer
+                waiting = parser.buffer or parser.request is not None
+                data = await asyncio.wait_for(
+                    reader.read(4096), HTTP_TIMEOUT if waiting else KEEPALIVE_TIMEOUT)
+                if not data:
+                    return
+                try:
+                    requests = parser.feed(data)
+                except ValueError as e:
+                    logger.debug(f'Bad request from {client_address}: {e}')
+                    writer.write(dated(BAD_REQUEST_RESPONSES[False]))
+                    await writer.drain()
+                    return
+                for request in requests:
+                    writer.write(self.handle_request(request, client_address))
+                    if not request.keep_alive():
+                        await writer.drain()
+                        return
+                await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug(f'Closed connection from {client_address}: {e!r}')
+        finally:
+            writer.close()
+
+    def handle_request(self, request, client_address):
+        """Return the response bytes for a fauxmo.http_request."""
+        return dated(NOT_FOUND_RESPONSES[request.keep_alive()])
+
+    def get_name(self):
+        return 'unknown'
+
+    def search_response(self, search_target):
+        """SSDP reply to an M-SEARCH for search_target (rendered once per target)."""
+        template = self.search_templates.get(search_target)
+        if template is None:
+            location_url = self.root_url % {'ip_address': self.ip_address, 'port': self.port}
+            template = search_response_template(location_url, self.persistent_uuid, SERVER_VERSION,
+                                                search_target, self.persistent_uuid,
+                                                self.other_headers)
+            self.search_templates[search_target] = template
+        return dated(template)
+
+
+class AsyncFauxmo(AsyncUpnpDevice):
+    """
+    A virtual WeMo switch whose ON/OFF requests go to an action handler.
+
+    The handler has on(client_address, name) and off(client_address, name)
+    methods returning True on success; either may be a coroutine. The Echo
+    gets its answer before the handler runs, and GetBinaryState is
+    answered from the state table. A handler with a debounce(name, state)
+    method is debounced as each request arrives and then called through
+    act(), as fauxmo.action_queue does.
+    """
+
+    def __init__(self, name, action_handler, port=0, ip_address=None, states=None):
+        self.name = name
+        self.serial = fauxmo.make_uuid(name)
+        self.action_handler = action_handler
+        self.states = states or shared_state_table()
+        super().__init__(port, "http://%(ip_address)s:%(port)s/setup.xml",
+                         "Socket-1_0-" + self.serial,
+                         other_headers=['X-User-Agent: redsonic'], ip_address=ip_address)
+        xml = SETUP_XML % {'device_name': self.name, 'device_serial': self.serial, 'path_prefix': ''}
+        self.setup_responses = http_response_templates(
+            xml, 'text/xml', "LAST-MODIFIED: Sat, 01 Jan 2000 00:01:15 GMT\r\n")
+        # The echo is happy with the 200 status code and doesn't
+        # appear to care about the SOAP response body
+        self.soap_responses = http_response_templates('', 'text/xml charset="utf-8"', "EXT:\r\n")
+        self.actions = set()
+        self._action_lock = None
+
+    def get_name(self):
+        return self.name
+
+    def handle_request(self, request, client_address):
+        keep_alive = request.keep_alive()
+        soap_action = request.header('soapaction').strip('"')
+        if request.method == 'GET' and request.path == '/setup.xml':
+            logger.debug(f'Responding to setup.xml for {self.name}')
+            return dated(self.setup_responses[keep_alive])
+        if request.method == 'POST' and soap_action == SET_BINARY_STATE:
+            state = BINARY_STATE.search(request.body)
+            if not state or state.group(1) not in (b'0', b'1'):
+                logger.debug(f'Unknown Binary State request: {request.body!r}')
+                return dated(BAD_REQUEST_RESPONSES[keep_alive])
+            on = state.group(1) == b'1'
+            logger.debug(f"Responding to {'ON' if on else 'OFF'} for {self.name}")
+            self.states.set(self.name, int(on))
+            self.start_action(on, client_address[0])
+            return dated(self.soap_responses[keep_alive])
+        if request.method == 'POST' and soap_action == GET_BINARY_STATE:
+            return dated(GET_STATE_RESPONSES[self.states.get(self.name)][keep_alive])
+        logger.debug(f'Unhandled request {request.method} {request.path}')
+        return dated(NOT_FOUND_RESPONSES[keep_alive])
+
+    def start_action(self, on, client_address):
+        """Run the handler for ON or OFF in a task; returns the task, or None if debounced."""
+        debounce = getattr(self.action_handler, 'debounce', None)
+        if debounce is not None and debounce(self.name, on):
+            logger.debug(f"Dropped repeated {'ON' if on else 'OFF'} for {self.name}")
+            return None
+        task = asyncio.get_running_loop().create_task(self._run_action(on, client_address))
+        # the loop only keeps weak references to its tasks
+        self.actions.add(task)
+        task.add_done_callback(self.actions.discard)
+        return task
+
+    async def _run_action(self, on, client_address):
+        if self._action_lock is None:
+            self._action_lock = asyncio.Lock()
+        # one action at a time, in the order the requests arrived
+        async with self._action_lock:
+            try:
+                if hasattr(self.action_handler, 'debounce'):
+                    await call_handler(self.action_handler.act, client_address, on, self.name)
+                elif on:
+                    await call_handler(self.action_handler.on, client_address, self.name)
+                else:
+                    await call_handler(self.action_handler.off, client_address, self.name)
+            except Exception as e:
+                logger.error(f"Action {'ON' if on else 'OFF'} for {self.name} failed: {e}")
+
+    async def join(self):
+        """Wait for the actions started so far."""
+        while self.actions:
+            await asyncio.gather(*self.actions, return_exceptions=True)
+
+
+class SSDPResponder(asyncio.DatagramProtocol):
+    """
+    Answers the Echo's WeMo M-SEARCH broadcasts for every registered device.
+
+    Like fauxmo.upnp_broadcast_responder, only the search for
+    urn:Belkin:device:** is recognised.
+    """
+
+    def __init__(self):
+        self.devices = []
+        self.transport = None
+
+    def add_device(self, device):
+        self.devices.append(device)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if not data.startswith(b'M-SEARCH') or SEARCH_TARGET.encode() not in data:
+            return
+        # spread the replies over the MX seconds the searcher asked for
+        mx = search_mx(data)
+        loop = asyncio.get_running_loop()
+        for device in self.devices:
+            logger.debug(f'Responding to search for {device.get_name()}')
+            loop.call_later(random.uniform(0, mx), self._reply, device, addr)
+
+    def _reply(self, device, addr):
+        if self.transport is not None:
+            self.transport.sendto(device.search_response(SEARCH_TARGET), addr)
+
+
+def ssdp_socket():
+    """UDP socket bound to the SSDP port and joined to its multicast group."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', SSDP_PORT))
+    mreq = struct.pack("4sl", socket.inet_aton(SSDP_ADDR), socket.INADDR_ANY)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    sock.setblocking(False)
+    return sock
+
+
+async def start(switches, ip_address=None, responder=None):
+    """
+    Start virtual switches and their SSDP responder on the running loop.
+
+    Args:
+        switches (list): (name, action_handler, port) for each switch
+        ip_address (str): Address for the HTTP endpoints
+        responder (SSDPResponder): Use this instead of joining SSDP multicast
+
+    Returns:
+        tuple: (devices, responder)
+    """
+    loop = asyncio.get_running_loop()
+    if responder is None:
+        responder = SSDPResponder()
+        await loop.create_datagram_endpoint(lambda: responder, sock=ssdp_socket())
+        logger.debug('Listening for UPnP broadcasts')
+
+    devices = []
+    for name, handler, port in switches:
+        device = AsyncFauxmo(name, handler, port, ip_address)
+        await device.start()
+        responder.add_device(device)
+        devices.append(device)
+        logger.debug(f"FauxMo device '{name}' ready on {device.ip_address}:{device.port}")
+    return devices, responder
+
+
+async def serve(switches, ip_address=None):
+    """Run virtual switches until cancelled."""
+    devices, responder = await start(switches, ip_address)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for device in devices:
+            await device.stop()
+        if responder.transport is not None:
+            responder.transport.close()
+
+
+def main():
+    config.configure_logging(level=logging.DEBUG if config.FAUXMO_DEBUG else logging.INFO)
+    # robot_handler blocks on the robot, so it runs in the executor
+    switches = [(config.FAUXMO_DEVICE_NAME, robot_handler(), config.FAUXMO_PORT)]
+    # keeps GetBinaryState in step with the robot
+    telemetry = robot_telemetry(config.FAUXMO_DEVICE_NAME).start()
+    try:
+        asyncio.run(serve(switches))
+    except KeyboardInterrupt:
+        logger.info('Interrupted by user')
+    finally:
+        telemetry.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -145,15 +145,16 @@ setup_systemd() {
     if [[ "$INSTALL_SERVICE" =~ ^[Yy]$ ]]; then
         # Update service file with correct paths
         sed "s|INSTALL_DIR|$SCRIPT_DIR|g" roomba.service.template > roomba.service
+        sed "s|INSTALL_DIR|$SCRIPT_DIR|g" roomba-daemon.service.template > roomba-daemon.service
 
-        sudo cp roomba.service /etc/systemd/system/
+        sudo cp roomba.service roomba-daemon.service /etc/systemd/system/
         sudo systemctl daemon-reload
 
         print_success "Systemd service installed"
 
         read -p "Enable service to start on boot? (y/N): " ENABLE_SERVICE
         if [[ "$ENABLE_SERVICE" =~ ^[Yy]$ ]]; then
-            sudo systemctl enable roomba.service
+            sudo systemctl enable roomba-daemon.service roomba.service
             print_success "Service enabled for auto-start"
         fi
 
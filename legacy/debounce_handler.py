@@ -1,3 +1,4 @@
+import threading
 import time
 
 class debounce_handler(object):
@@ -7,31 +8,43 @@ class debounce_handler(object):
     DEBOUNCE_SECONDS = 0.3
 
     def __init__(self):
-        self.lastEcho = time.time()
+        # (device name, requested state) -> monotonic time it was accepted,
+        # oldest first, holding only commands from the last DEBOUNCE_SECONDS
+        self.recent = {}
+        self.lock = threading.Lock()
 
     def on(self, client_address, name):
-        if self.debounce():
+        if self.debounce(name, True):
             return True
         return self.act(client_address, True, name)
 
     def off(self, client_address, name):
-        if self.debounce():
+        if self.debounce(name, False):
             return True
         return self.act(client_address, False, name)
 
-    def act(self, client_address, state):
+    def act(self, client_address, state, name):
         pass
 
-    def debounce(self):
+    def debounce(self, name, state):
         """If multiple Echos are present, the one most likely to respond first
            is the one that can best hear the speaker... which is the closest one.
-           Adding a refractory period to handlers keeps us from worrying about
-           one Echo overhearing a command meant for another one.
+           Every Echo that heard the command sends the same device and state, so
+           a repeat of a command accepted within DEBOUNCE_SECONDS is dropped;
+           a command for another device, or the opposite state, always goes
+           through. Uses the monotonic clock, so clock steps can't affect it.
         """
-        if (time.time() - self.lastEcho) < self.DEBOUNCE_SECONDS:
-            return True
-
-        self.lastEcho = time.time()
-        return False
-
-
+        key = (name, state)
+        now = time.monotonic()
+        with self.lock:
+            # entries are in acceptance order, so expired ones are at the front
+            while self.recent:
+                oldest = next(iter(self.recent))
+                if now - self.recent[oldest] < self.DEBOUNCE_SECONDS:
+                    break
+                del self.recent[oldest]
+
+            if key in self.recent:
+                return True
+            self.recent[key] = now
+            return False
@@ -5,7 +5,6 @@ import fauxmo
 from debounce_handler import debounce_handler
 import threading
 import logging
-import time
 logging.basicConfig(level=logging.DEBUG)
 
 # ---------- Network constants -----------
@@ -25,7 +24,7 @@ class light_handler(debounce_handler):
         debounce_handler.__init__(self)
         self.mqtt = mqtt
 
-    def act(self, client_address, state):
+    def act(self, client_address, state, name):
         if client_address == ECHO_LIVINGROOM:
             self.mqtt.publish("livingroom", state)
             print("Published to living room")
@@ -56,11 +55,10 @@ if __name__ == "__main__":
 
     # Loop and poll for incoming Echo requests
     logging.debug("Entering fauxmo polling loop")
-    while True:
-        try:
-            # Allow time for a ctrl-c to stop the process
-            p.poll(100)
-            time.sleep(0.1)
-        except Exception as e:
-            logging.critical("Critical exception: " + str(e))
-            break
\ No newline at end of file
+    try:
+        # Blocks until a request arrives; ctrl-c stops the process
+        p.run()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logging.critical("Critical exception: " + str(e))
\ No newline at end of file
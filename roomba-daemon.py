@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Robot daemon - keeps the Roomba's serial port open and serves commands.
+
+Run this once (see roomba-daemon.service.template); fauxmo.py and other
+clients then talk to the robot through the Unix socket in ROBOT_SOCKET
+instead of opening the serial port themselves. By default the robot is
+kept warm: safe mode confirmed every few seconds and the Imperial March
+preloaded, so Alexa's ON starts with no set-up delay. After
+ROBOT_STANDBY_IDLE seconds without a command the robot is left to sleep.
+
+Usage:
+    python3 roomba-daemon.py
+    python3 roomba-daemon.py --port /dev/ttyUSB0 --socket /tmp/roomba.sock
+    python3 roomba-daemon.py --no-standby
+"""
+
+import argparse
+import logging
+import signal
+import sys
+
+from roomba import Create, SAFE_MODE
+from roomba.calibration import CalibrationStore
+from roomba.daemon import RobotDaemon
+from config import (DEFAULT_PORT, DEFAULT_BAUD_RATE, ROBOT_SOCKET, ROBOT_ID, FLOOR_TYPE,
+                    CALIBRATION_FILE, ROBOT_STANDBY_IDLE, configure_logging)
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Roomba serial port daemon')
+    parser.add_argument('--port', default=DEFAULT_PORT, help='Serial port')
+    parser.add_argument('--baud', type=int, default=DEFAULT_BAUD_RATE, help='Baud rate')
+    parser.add_argument('--socket', default=ROBOT_SOCKET, help='Unix socket path')
+    parser.add_argument('--no-standby', dest='standby', action='store_false',
+                        help="Don't keep the robot in safe mode with the jingle preloaded")
+    parser.add_argument('--standby-idle', type=float, default=ROBOT_STANDBY_IDLE,
+                        help='Seconds without a command before standby lets the robot '
+                             'sleep (0 keeps it warm forever)')
+    args = parser.parse_args()
+
+    configure_logging()
+
+    logger.info(f"Connecting to robot on {args.port}...")
+    robot = Create(args.port, args.baud, startingMode=SAFE_MODE)
+    CalibrationStore(CALIBRATION_FILE).apply(robot, ROBOT_ID, FLOOR_TYPE)
+    daemon = RobotDaemon(robot, args.socket, standby=args.standby,
+                         standby_idle=args.standby_idle or None)
+
+    # systemd stops us with SIGTERM; unwind through the finally below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        daemon.start()
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user")
+    finally:
+        daemon.shutdown()
+        robot.close()
+        logger.info("Robot daemon stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -41,7 +41,7 @@ __all__ = [
     'DRIVE', 'DRIVEDIRECT', 'MOTORS', 'LEDS',
     'SONG', 'PLAY', 'SENSORS', 'QUERYLIST', 'STREAM',
     'FORCESEEKINGDOCK', 'SCRIPT', 'ENDSCRIPT',
-    'WAITDIST', 'WAITANGLE', 'PAUSERESUME',
+    'WAITTIME', 'WAITDIST', 'WAITANGLE', 'MAX_SCRIPT_LENGTH', 'PAUSERESUME',
     'OFF_MODE', 'PASSIVE_MODE', 'SAFE_MODE', 'FULL_MODE',
 
     # Sensor constants (from sensors.py)
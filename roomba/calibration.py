@@ -0,0 +1,360 @@
+"""
+Odometry calibration for iRobot Create/Roomba.
+
+The odometry constants in sensors.py (WHEEL_SPAN, TICK_PER_MM and the
+ANGULAR_ERROR fudge factor) were tuned for one robot on one floor. This
+module runs scripted straight-line and rotation maneuvers, records the wheel
+encoder counts together with the robot's own DISTANCE/ANGLE packets, and fits
+the three constants with least squares. Results are stored per robot and per
+floor type so they can be applied with Create.setCalibration().
+
+Example:
+    from roomba.calibration import OdometryCalibrator, CalibrationStore
+
+    calibrator = OdometryCalibrator(robot)
+    calibrator.run_square(side_cm=50)
+    calibrator.run_rotation(turns=2, measured_deg=690)
+    result = calibrator.fit()
+
+    store = CalibrationStore('calibration.json')
+    store.save('stardust', 'carpet', result)
+
+    # later, wherever the robot is opened
+    CalibrationStore('calibration.json').apply(robot, 'stardust', 'carpet')
+"""
+
+import json
+import logging
+import math
+import os
+
+from .sensors import (
+    ENCODER_LEFT, ENCODER_RIGHT, DISTANCE, ANGLE,
+    WHEEL_SPAN, TICK_PER_MM, ANGULAR_ERROR
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Encoder counts wrap around at 2^16
+ENCODER_RANGE = 65536
+
+# Maneuver kinds
+STRAIGHT = 'straight'
+ROTATION = 'rotation'
+CORNER = 'corner'       # a turn without a measured angle (see run_square)
+
+
+def encoder_delta(old, new):
+    """
+    Difference between two encoder readings, accounting for wraparound.
+
+    Args:
+        old (int): Earlier encoder count (0-65535)
+        new (int): Later encoder count (0-65535)
+
+    Returns:
+        int: Signed tick difference
+    """
+    delta = new - old
+    if delta < -ENCODER_RANGE // 2:
+        delta += ENCODER_RANGE
+    elif delta > ENCODER_RANGE // 2:
+        delta -= ENCODER_RANGE
+    return delta
+
+
+def _fit_gain(xs, ys):
+    """
+    Least-squares fit of y = k * x (a line through the origin).
+
+    Returns:
+        float: The gain k
+    """
+    sxx = sum(x * x for x in xs)
+    if sxx == 0:
+        raise ValueError('Cannot fit a gain from all-zero inputs')
+    return sum(x * y for x, y in zip(xs, ys)) / sxx
+
+
+class ManeuverSample:
+    """
+    Measurements from one calibration maneuver.
+
+    Attributes:
+        kind (str): STRAIGHT, ROTATION or CORNER
+        left_ticks (int): Left encoder ticks travelled
+        right_ticks (int): Right encoder ticks travelled
+        distance_mm (int): Distance reported by the robot (packet 19)
+        angle_deg (int): Angle reported by the robot (packet 20)
+        true_distance_mm (float): Ground-truth distance for straight runs
+        true_angle_deg (float): Ground-truth angle for rotations
+    """
+
+    def __init__(self, kind, left_ticks, right_ticks, distance_mm, angle_deg,
+                 true_distance_mm=0.0, true_angle_deg=0.0):
+        self.kind = kind
+        self.left_ticks = left_ticks
+        self.right_ticks = right_ticks
+        self.distance_mm = distance_mm
+        self.angle_deg = angle_deg
+        self.true_distance_mm = float(true_distance_mm)
+        self.true_angle_deg = float(true_angle_deg)
+
+    def __repr__(self):
+        return (f'ManeuverSample({self.kind!r}, left={self.left_ticks}, '
+                f'right={self.right_ticks}, distance={self.distance_mm}, '
+                f'angle={self.angle_deg})')
+
+
+class CalibrationResult:
+    """
+    Fitted odometry constants for one robot on one floor type.
+
+    Attributes:
+        wheel_span (float): Distance between the wheels in mm
+        tick_per_mm (float): Encoder ticks per mm of wheel travel
+        angular_error (float): Correction applied to encoder-derived turns
+        samples (int): Number of maneuvers the fit was based on
+    """
+
+    def __init__(self, wheel_span=WHEEL_SPAN, tick_per_mm=TICK_PER_MM,
+                 angular_error=ANGULAR_ERROR, samples=0):
+        self.wheel_span = wheel_span
+        self.tick_per_mm = tick_per_mm
+        self.angular_error = angular_error
+        self.samples = samples
+
+    def apply(self, robot):
+        """Install these constants on a Create instance."""
+        robot.setCalibration(wheelSpan=self.wheel_span,
+                             tickPerMM=self.tick_per_mm,
+                             angularError=self.angular_error)
+
+    def to_dict(self):
+        """Return a JSON-serialisable dictionary."""
+        return {
+            'wheel_span': self.wheel_span,
+            'tick_per_mm': self.tick_per_mm,
+            'angular_error': self.angular_error,
+            'samples': self.samples,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a result from a dictionary produced by to_dict()."""
+        return cls(wheel_span=float(data['wheel_span']),
+                   tick_per_mm=float(data['tick_per_mm']),
+                   angular_error=float(data['angular_error']),
+                   samples=int(data.get('samples', 0)))
+
+    def __repr__(self):
+        return (f'CalibrationResult(wheel_span={self.wheel_span:.2f}, '
+                f'tick_per_mm={self.tick_per_mm:.4f}, '
+                f'angular_error={self.angular_error:.4f}, samples={self.samples})')
+
+
+def fit_calibration(samples):
+    """
+    Fit WHEEL_SPAN, TICK_PER_MM and ANGULAR_ERROR from maneuver samples.
+
+    The three constants are fitted in sequence, each a least-squares line
+    through the origin:
+
+    1. TICK_PER_MM from straight runs: mean wheel ticks against true distance.
+    2. WHEEL_SPAN from rotations and corners: wheel travel difference (mm)
+       against the angle the robot itself reported, i.e. the geometry of
+       this robot.
+    3. ANGULAR_ERROR from rotations only: true angle against the angle
+       derived from the encoders with the fitted span, i.e. slip on this
+       floor. Corners have no true angle, so they take no part in it.
+
+    Args:
+        samples (list): ManeuverSample instances, at least one of each kind
+
+    Returns:
+        CalibrationResult: The fitted constants
+
+    Raises:
+        ValueError: If straight or rotation samples are missing
+    """
+    straight = [s for s in samples if s.kind == STRAIGHT]
+    rotation = [s for s in samples if s.kind == ROTATION]
+    turns = [s for s in samples if s.kind in (ROTATION, CORNER)]
+    if not straight:
+        raise ValueError('At least one straight maneuver is needed to fit TICK_PER_MM')
+    if not rotation:
+        raise ValueError('At least one rotation maneuver is needed to fit WHEEL_SPAN')
+
+    tick_per_mm = _fit_gain(
+        [s.true_distance_mm for s in straight],
+        [(s.left_ticks + s.right_ticks) / 2.0 for s in straight])
+
+    wheel_span = _fit_gain(
+        [math.radians(s.angle_deg) for s in turns],
+        [(s.right_ticks - s.left_ticks) / tick_per_mm for s in turns])
+
+    angular_error = _fit_gain(
+        [(s.right_ticks - s.left_ticks) / tick_per_mm / wheel_span for s in rotation],
+        [math.radians(s.true_angle_deg) for s in rotation])
+
+    result = CalibrationResult(wheel_span, tick_per_mm, angular_error, len(samples))
+    logger.info(f'Fitted odometry calibration: {result}')
+    return result
+
+
+class OdometryCalibrator:
+    """
+    Runs calibration maneuvers on a robot and collects ManeuverSamples.
+
+    Straight legs and turns are driven with the robot's own scripts
+    (Create.move / Create.turn). Ground truth defaults to the commanded
+    value; for a better fit, mark the start position with tape and pass
+    the measured distance or angle instead.
+    """
+
+    def __init__(self, robot, speed_cm_s=10, turn_deg_s=20):
+        """
+        Args:
+            robot: A Create instance in SAFE_MODE or FULL_MODE
+            speed_cm_s (int): Speed for straight legs
+            turn_deg_s (int): Speed for rotations
+        """
+        self.robot = robot
+        self.speed_cm_s = speed_cm_s
+        self.turn_deg_s = turn_deg_s
+        self.samples = []
+
+    def _read_odometry(self):
+        """Read encoders and the DISTANCE/ANGLE accumulators (clearing them)."""
+        d = self.robot.sensors([ENCODER_LEFT, ENCODER_RIGHT, DISTANCE, ANGLE])
+        return d[ENCODER_LEFT], d[ENCODER_RIGHT], d[DISTANCE], d[ANGLE]
+
+    def _record(self, kind, maneuver, true_distance_mm=0.0, true_angle_deg=0.0):
+        """Run a maneuver and store the odometry it produced."""
+        left0, right0, _, _ = self._read_odometry()
+        maneuver()
+        left1, right1, distance, angle = self._read_odometry()
+        sample = ManeuverSample(kind, encoder_delta(left0, left1), encoder_delta(right0, right1),
+                                distance, angle, true_distance_mm, true_angle_deg)
+        logger.debug(f'Recorded {sample}')
+        self.samples.append(sample)
+        return sample
+
+    def run_straight(self, distance_cm, measured_cm=None):
+        """
+        Drive a straight leg and record it.
+
+        Args:
+            distance_cm (float): Commanded distance
+            measured_cm (float): Distance actually travelled, if measured
+        """
+        true_mm = 10.0 * (distance_cm if measured_cm is None else measured_cm)
+        return self._record(STRAIGHT, lambda: self.robot.move(distance_cm, self.speed_cm_s),
+                            true_distance_mm=true_mm)
+
+    def run_turn(self, angle_deg, measured_deg=None):
+        """
+        Turn in place and record it.
+
+        Args:
+            angle_deg (float): Commanded angle (positive is counter-clockwise)
+            measured_deg (float): Angle actually turned, if measured
+        """
+        true_deg = angle_deg if measured_deg is None else measured_deg
+        return self._record(ROTATION, lambda: self.robot.turn(angle_deg, self.turn_deg_s),
+                            true_angle_deg=true_deg)
+
+    def run_square(self, side_cm=50, laps=1):
+        """
+        Drive a square, recording each side and each 90 degree corner.
+
+        Corners are recorded as CORNER samples: their angle is never
+        measured, so they help fit WHEEL_SPAN but are left out of the
+        ANGULAR_ERROR fit, which needs a rotation with a true angle
+        (see run_rotation()).
+
+        Returns:
+            list: The samples recorded
+        """
+        recorded = []
+        for _ in range(4 * laps):
+            recorded.append(self.run_straight(side_cm))
+            recorded.append(self._record(CORNER, lambda: self.robot.turn(90, self.turn_deg_s)))
+        return recorded
+
+    def run_rotation(self, turns=2, measured_deg=None):
+        """
+        Spin in place for whole turns and record a single rotation sample.
+
+        Args:
+            turns (int): Number of full turns to command
+            measured_deg (float): Total angle actually turned, if measured
+        """
+        return self.run_turn(360 * turns, measured_deg)
+
+    def fit(self):
+        """Fit constants from all recorded samples (see fit_calibration)."""
+        return fit_calibration(self.samples)
+
+
+class CalibrationStore:
+    """
+    JSON file of calibration results keyed by robot id and floor type.
+
+    The file layout is {robot_id: {floor_type: CalibrationResult.to_dict()}}.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load_all(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def load(self, robot_id, floor_type):
+        """
+        Return the stored CalibrationResult, or None if there is none.
+        """
+        entry = self._load_all().get(robot_id, {}).get(floor_type)
+        if entry is None:
+            return None
+        return CalibrationResult.from_dict(entry)
+
+    def save(self, robot_id, floor_type, result):
+        """Store a CalibrationResult, replacing any previous one."""
+        data = self._load_all()
+        data.setdefault(robot_id, {})[floor_type] = result.to_dict()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        logger.info(f'Saved calibration for {robot_id}/{floor_type} to {self.path}')
+
+    def floors(self, robot_id):
+        """Return the floor types stored for a robot."""
+        return sorted(self._load_all().get(robot_id, {}))
+
+    def apply(self, robot, robot_id, floor_type):
+        """
+        Install the stored result for robot_id on floor_type, if there is one.
+
+        Used wherever a robot is opened; a missing or unreadable file leaves
+        the robot on the default constants.
+
+        Returns:
+            CalibrationResult: The result applied, or None
+        """
+        try:
+            result = self.load(robot_id, floor_type)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f'Could not read calibration from {self.path}: {e}')
+            return None
+        if result is None:
+            logger.info(f'No calibration for {robot_id}/{floor_type}; using defaults')
+            return None
+        result.apply(robot)
+        logger.info(f'Applied calibration for {robot_id}/{floor_type}: {result}')
+        return result
@@ -44,8 +44,10 @@ FORCESEEKINGDOCK = bytes([143])  # Force robot to seek dock
 # Script commands (for autonomous sequences)
 SCRIPT = bytes([152])       # Start script definition (+ N bytes)
 ENDSCRIPT = bytes([153])    # End script and execute
+WAITTIME = bytes([155])     # Wait for time in script (+ 1 byte, tenths of a second)
 WAITDIST = bytes([156])     # Wait for distance in script (+ 2 bytes)
 WAITANGLE = bytes([157])    # Wait for angle in script (+ 2 bytes)
+MAX_SCRIPT_LENGTH = 100     # Longest script body the OI stores (bytes)
 
 # Operating modes
 OFF_MODE = 0
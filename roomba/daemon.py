@@ -0,0 +1,368 @@
+"""
+Robot daemon: one long-running process owns the serial port.
+
+Opening the port and putting the robot into safe mode costs far more than
+the command that follows, and only one process can use the port at a time.
+RobotDaemon keeps a single Create session open and serves a compact
+request/response protocol over a Unix domain socket, so the Alexa handler,
+the dashboard and behaviors can all share the robot with millisecond
+command latency.
+
+In warm standby the daemon also keeps the robot ready between requests:
+the mode is re-confirmed every KEEPALIVE_INTERVAL seconds and the start of
+the jingle sits in the song slots, so the Alexa ON sequence
+(safe, play_jingle, clean) only sends the PLAY and CLEAN bytes. Once no
+command has come in for STANDBY_IDLE_TIMEOUT seconds the keepalive stops,
+so a robot left off the dock can go to sleep instead of draining its
+battery; the next command wakes it.
+
+Protocol (one JSON array per line in each direction):
+
+    request:  ["go", 20, 0]
+    response: [true, null]            on success, with the command's result
+              [false, "message"]      on failure
+
+Example:
+    from roomba.daemon import RobotClient
+
+    with RobotClient('/home/pi/alexa_roomba/roomba.sock') as robot:
+        robot.call('safe')
+        robot.call('go', 20, 0)
+        battery = robot.call('sensors', [25, 26])
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+
+from .commands import OFF_MODE, SAFE_MODE
+from .songs import SongPlayer, STARWARS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Default time a client waits for a reply; move/turn block until done
+CLIENT_TIMEOUT = 30.0
+
+# Warm standby re-confirms the mode this often, a little more often than
+# Create.ensureMode() would re-check it, so requests never wait for a query
+KEEPALIVE_INTERVAL = 4.0
+
+# While the robot doesn't answer (asleep, off the dock, rebooting) the
+# interval doubles each round up to this, instead of a handshake every round
+KEEPALIVE_MAX_INTERVAL = 60.0
+
+# Warm standby stops after this many seconds without a command. Every
+# keepalive wakes the OI, so a robot kept warm forever never sleeps
+STANDBY_IDLE_TIMEOUT = 600.0
+
+
+class RobotDaemonError(Exception):
+    """Raised by RobotClient when the daemon reports a failed command."""
+
+
+def _notes(notes):
+    """JSON turns (note, duration) tuples into lists; setSong wants tuples."""
+    return [tuple(note) for note in notes]
+
+
+def _started(result):
+    """Background music returns a Future, which stays in the daemon."""
+    return None if isinstance(result, Future) else result
+
+
+# Command name -> function(robot, *args). Only these can be called remotely.
+COMMANDS = {
+    'ping': lambda robot: 'pong',
+    'mode': lambda robot: robot.getMode(),
+    'passive': lambda robot: robot._start(),
+    'safe': lambda robot: robot.toSafeMode(),
+    'full': lambda robot: robot.toFullMode(),
+    'go': lambda robot, cm_per_sec=0, deg_per_sec=0: robot.go(cm_per_sec, deg_per_sec),
+    'stop': lambda robot: robot.stop(),
+    'move': lambda robot, distance_cm, cm_per_sec=10: robot.move(distance_cm, cm_per_sec),
+    'turn': lambda robot, angle_deg, deg_per_sec=20: robot.turn(angle_deg, deg_per_sec),
+    'sensors': lambda robot, sensor_ids: {
+        str(k): v for k, v in robot.sensors(list(sensor_ids)).items()},
+    'pose': lambda robot: robot.getPose(),
+    'set_song': lambda robot, number, notes: robot.setSong(number, _notes(notes)),
+    'play_song': lambda robot, number: robot.playSongNumber(number),
+    'play_notes': lambda robot, notes: robot.playSong(_notes(notes)),
+    'leds': lambda robot, color, intensity, play, advance: robot.setLEDs(
+        color, intensity, play, advance),
+    'clean': lambda robot: robot.clean(),
+    'power': lambda robot: robot.power(),
+    'seek_dock': lambda robot: robot.seekDock(),
+    'play_starwars': lambda robot, wait=True: _started(robot.play_starwars(wait)),
+    'play_jingle': lambda robot: robot.playJingle(),
+    'play_melody': lambda robot, notes, wait=True: _started(robot.playMelody(_notes(notes), wait)),
+}
+
+
+def run_command(robot, name, *args):
+    """
+    Run one protocol command directly on a Create instance.
+
+    Args:
+        robot: Create instance
+        name (str): Command name from COMMANDS
+
+    Returns:
+        The command's result
+
+    Raises:
+        KeyError: If the command is unknown
+    """
+    if name not in COMMANDS:
+        raise KeyError(f'Unknown command {name!r}')
+    return COMMANDS[name](robot, *args)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Serves one client connection: a request line in, a response line out."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            self.wfile.write(self.server.daemon.handle_line(line))
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class RobotDaemon:
+    """
+    Owns a Create session and serves it over a Unix domain socket.
+
+    Each client connection gets its own thread; commands from all clients
+    are serialised through one lock so they never interleave on the port.
+    """
+
+    def __init__(self, robot, socket_path, standby=False, jingle=STARWARS,
+                 keepalive_interval=KEEPALIVE_INTERVAL, standby_idle=STANDBY_IDLE_TIMEOUT):
+        """
+        Args:
+            robot: Connected Create instance
+            socket_path (str): Filesystem path for the Unix socket
+            standby (bool): Keep the robot warm (see warm_up())
+            jingle (list): Melody to keep preloaded in the song slots
+            keepalive_interval (float): Seconds between keepalive rounds
+            standby_idle (float): Seconds without a command before the
+                keepalive lets the robot sleep; None keeps it warm forever
+        """
+        self.robot = robot
+        self.socket_path = socket_path
+        self.standby = standby
+        self.jingle = jingle
+        self.keepalive_interval = keepalive_interval
+        self.standby_idle = standby_idle
+        self.lock = threading.Lock()
+        self.server = None
+        self._stopping = threading.Event()
+        self._keepalive_thread = None
+        self._unresponsive = False
+        self._last_command = time.monotonic()
+        self._idle = False
+
+    def execute(self, name, *args):
+        """Run a command with exclusive access to the robot."""
+        with self.lock:
+            self._last_command = time.monotonic()
+            if self._idle:
+                # it may have slept since, which empties the song slots;
+                # the command's own ensureMode() checks the mode and wakes it
+                logger.info('Robot in use again; resuming warm standby')
+                self.robot._loadedSongs = None
+                self.robot._invalidateMode()
+                self._idle = False
+            return run_command(self.robot, name, *args)
+
+    def warm_up(self):
+        """
+        Get the robot ready for instant commands.
+
+        Puts it in safe mode and uploads the start of the jingle, so that
+        playing the jingle sends one PLAY and 'safe' sends nothing at all.
+        """
+        with self.lock:
+            self.robot.ensureMode(SAFE_MODE)
+            self._preload()
+        logger.info('Robot warm: safe mode, jingle preloaded')
+
+    def keepalive(self):
+        """
+        One keepalive round: re-confirm the mode and re-arm the jingle.
+
+        A robot that doesn't answer may have rebooted or slept, which
+        empties its song slots, so the slot cache is dropped before it is
+        warmed up again and the jingle is uploaded afresh. Nothing is sent
+        once the robot has been idle for standby_idle seconds.
+
+        Returns:
+            bool: False if the robot could not be reached
+        """
+        with self.lock:
+            if self.robot.getMode() == OFF_MODE:
+                return True     # powered down on purpose; the next 'safe' wakes it
+            if self.standby_idle is not None and \
+                    time.monotonic() - self._last_command >= self.standby_idle:
+                if not self._idle:
+                    logger.info(f'No commands for {self.standby_idle:.0f}s; letting the robot sleep')
+                    self._idle = True
+                return True
+            if self.robot.verifyMode() is None:
+                if not self._unresponsive:
+                    logger.warning('Robot did not answer the keepalive; warming up again')
+                self.robot._loadedSongs = None
+                if not self.robot.ensureMode(SAFE_MODE):
+                    self._unresponsive = True
+                    return False
+            if self._unresponsive:
+                logger.info('Robot answering again')
+                self._unresponsive = False
+            self._preload()
+            return True
+
+    def _preload(self):
+        # not while a melody is streaming through the slots
+        if self.robot.waitForMusic(timeout=0):
+            SongPlayer(self.robot).preload(self.jingle)
+
+    def _keepalive_loop(self):
+        interval = self.keepalive_interval
+        while not self._stopping.wait(interval):
+            try:
+                answered = self.keepalive()
+            except Exception as e:
+                logger.warning(f'Keepalive failed: {e}')
+                answered = False
+            if answered:
+                interval = self.keepalive_interval
+            else:
+                interval = min(interval * 2, max(KEEPALIVE_MAX_INTERVAL, self.keepalive_interval))
+
+    def handle_line(self, line):
+        """
+        Decode one request line, run it, and encode the response line.
+
+        Returns:
+            bytes: Newline-terminated JSON response
+        """
+        try:
+            request = json.loads(line)
+            if not isinstance(request, list) or not request:
+                raise ValueError('request must be a non-empty JSON array')
+            response = [True, self.execute(request[0], *request[1:])]
+        except Exception as e:
+            logger.warning(f'Robot command failed: {e}')
+            response = [False, str(e)]
+        return json.dumps(response, separators=(',', ':')).encode('utf-8') + b'\n'
+
+    def start(self):
+        """Bind the socket, replacing a stale one left by a previous run."""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self.standby:
+            self.warm_up()
+            self._stopping.clear()
+            self._keepalive_thread = threading.Thread(
+                target=self._keepalive_loop, name='robot-keepalive', daemon=True)
+            self._keepalive_thread.start()
+        self.server = _UnixServer(self.socket_path, _RequestHandler)
+        self.server.daemon = self
+        os.chmod(self.socket_path, 0o660)
+        logger.info(f'Robot daemon listening on {self.socket_path}')
+
+    def serve_forever(self):
+        """Serve clients until shutdown() is called from another thread."""
+        if self.server is None:
+            self.start()
+        self.server.serve_forever()
+
+    def shutdown(self):
+        """Stop serving and remove the socket (the robot stays open)."""
+        if self._keepalive_thread is not None:
+            self._stopping.set()
+            self._keepalive_thread.join()
+            self._keepalive_thread = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class RobotClient:
+    """
+    Client for RobotDaemon.
+
+    The connection is opened on the first call and reused for later ones.
+    """
+
+    def __init__(self, socket_path, timeout=CLIENT_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.sock = None
+        self.rfile = None
+
+    def connect(self):
+        """
+        Connect to the daemon.
+
+        Raises:
+            FileNotFoundError, ConnectionRefusedError: If no daemon is running
+        """
+        if self.sock is not None:
+            return
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+
+    def call(self, name, *args):
+        """
+        Run a command on the daemon's robot and return its result.
+
+        Raises:
+            RobotDaemonError: If the command failed on the daemon side
+            ConnectionError: If the daemon closed the connection
+        """
+        self.connect()
+        request = json.dumps([name] + list(args), separators=(',', ':'))
+        self.sock.sendall(request.encode('utf-8') + b'\n')
+        line = self.rfile.readline()
+        if not line:
+            self.close()
+            raise ConnectionError('Robot daemon closed the connection')
+        ok, result = json.loads(line)
+        if not ok:
+            raise RobotDaemonError(result)
+        return result
+
+    def close(self):
+        """Close the connection (a later call reconnects)."""
+        if self.rfile is not None:
+            self.rfile.close()
+            self.rfile = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
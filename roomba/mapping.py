@@ -0,0 +1,286 @@
+"""
+Occupancy and coverage grid built from odometry and bump events.
+
+CoverageGrid keeps a NumPy grid of the floor that is updated incrementally
+as the robot's pose estimate changes: every pose update sweeps the cells
+under the robot's footprint along the path travelled, and bump, cliff and
+light-bump events mark obstacle cells at the sensor positions. The grid
+reports a coverage percentage and the frontier between swept and unexplored
+floor, so a cleaning behavior can head for new ground instead of driving
+over the same area again.
+
+Requires NumPy (``pip install alexa-roomba[mapping]``).
+
+Example:
+    from roomba.mapping import CoverageGrid
+
+    grid = CoverageGrid(width_mm=5000, height_mm=4000)
+    robot.sensors([ENCODER_LEFT, ENCODER_RIGHT, LEFT_BUMP, RIGHT_BUMP])
+    grid.update_from_robot(robot)
+    print(f"{grid.coverage_percentage():.1f}% covered")
+"""
+
+import logging
+import math
+
+import numpy as np
+
+from .sensors import (
+    LEFT_BUMP, RIGHT_BUMP, CLIFF_LEFT, CLIFF_FRONT_LEFT,
+    CLIFF_FRONT_RIGHT, CLIFF_RIGHT, LIGHTBUMP
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cell states
+UNKNOWN = 0
+SWEPT = 1
+OBSTACLE = 2
+
+# Robot geometry (mm)
+ROBOT_RADIUS = 170.0        # Half the robot's diameter
+CLEANING_RADIUS = 140.0     # Half the width swept by the brushes
+
+# Sensor bearings relative to the robot's heading (radians, CCW positive)
+BUMP_BEARINGS = {
+    LEFT_BUMP: math.radians(45),
+    RIGHT_BUMP: math.radians(-45),
+}
+CLIFF_BEARINGS = {
+    CLIFF_LEFT: math.radians(65),
+    CLIFF_FRONT_LEFT: math.radians(20),
+    CLIFF_FRONT_RIGHT: math.radians(-20),
+    CLIFF_RIGHT: math.radians(-65),
+}
+# Packet 45 bit order: left, front left, center left, center right, front right, right
+LIGHTBUMP_BEARINGS = [math.radians(a) for a in (65, 40, 12, -12, -40, -65)]
+LIGHTBUMP_RANGE = 60.0      # Distance beyond the bumper a light bump sees (mm)
+
+
+class CoverageGrid:
+    """
+    Incrementally updated occupancy/coverage grid.
+
+    The world frame matches Create's odometry: x forward from the starting
+    pose, y to the left, theta counter-clockwise, all in mm and radians.
+    The starting pose sits at the centre of the grid unless an origin is
+    given. Size the grid to the room for a meaningful coverage percentage.
+    """
+
+    def __init__(self, width_mm=6000, height_mm=6000, resolution_mm=50,
+                 origin_mm=None, cleaning_radius_mm=CLEANING_RADIUS):
+        """
+        Args:
+            width_mm (float): Extent of the grid along x
+            height_mm (float): Extent of the grid along y
+            resolution_mm (float): Side length of one cell
+            origin_mm (tuple): World (x, y) of the grid's (0, 0) corner;
+                defaults to centring the grid on the starting pose
+            cleaning_radius_mm (float): Half the swept width
+        """
+        self.resolution = float(resolution_mm)
+        self.cols = int(math.ceil(width_mm / self.resolution))
+        self.rows = int(math.ceil(height_mm / self.resolution))
+        if origin_mm is None:
+            origin_mm = (-width_mm / 2.0, -height_mm / 2.0)
+        self.origin_x, self.origin_y = origin_mm
+        self.cleaning_radius = float(cleaning_radius_mm)
+
+        self.cells = np.zeros((self.rows, self.cols), dtype=np.uint8)
+        self.visits = np.zeros((self.rows, self.cols), dtype=np.uint16)
+        self.swept_count = 0
+        self.obstacle_count = 0
+        self.last_pose = None
+
+    # -- coordinates --------------------------------------------------------
+
+    def to_cell(self, x, y):
+        """Return the (row, col) containing world point (x, y) in mm."""
+        col = int((x - self.origin_x) // self.resolution)
+        row = int((y - self.origin_y) // self.resolution)
+        return row, col
+
+    def to_world(self, row, col):
+        """Return the world (x, y) in mm of a cell's centre."""
+        return (self.origin_x + (col + 0.5) * self.resolution,
+                self.origin_y + (row + 0.5) * self.resolution)
+
+    def in_bounds(self, row, col):
+        """True if (row, col) lies inside the grid."""
+        return 0 <= row < self.rows and 0 <= col < self.cols
+
+    def state_at(self, x, y):
+        """Return the cell state at world point (x, y), OBSTACLE if outside."""
+        row, col = self.to_cell(x, y)
+        if not self.in_bounds(row, col):
+            return OBSTACLE
+        return int(self.cells[row, col])
+
+    # -- updates ------------------------------------------------------------
+
+    def _window(self, x0, y0, x1, y1, margin):
+        """Cell index slices covering a bounding box grown by margin."""
+        r0, c0 = self.to_cell(min(x0, x1) - margin, min(y0, y1) - margin)
+        r1, c1 = self.to_cell(max(x0, x1) + margin, max(y0, y1) + margin)
+        r0, c0 = max(r0, 0), max(c0, 0)
+        r1, c1 = min(r1 + 1, self.rows), min(c1 + 1, self.cols)
+        if r0 >= r1 or c0 >= c1:
+            return None
+        return slice(r0, r1), slice(c0, c1)
+
+    def sweep(self, x0, y0, x1, y1):
+        """
+        Mark cells under the cleaning footprint between two positions.
+
+        Only the bounding box of the segment is touched, so the cost of an
+        update depends on the distance travelled, not on the grid size.
+
+        Returns:
+            int: Number of newly swept cells
+        """
+        window = self._window(x0, y0, x1, y1, self.cleaning_radius)
+        if window is None:
+            return 0
+        rows, cols = window
+        ys = self.origin_y + (np.arange(rows.start, rows.stop) + 0.5) * self.resolution
+        xs = self.origin_x + (np.arange(cols.start, cols.stop) + 0.5) * self.resolution
+        px, py = np.meshgrid(xs, ys)
+
+        # distance from each cell centre to the segment
+        dx, dy = x1 - x0, y1 - y0
+        length_sq = dx * dx + dy * dy
+        if length_sq == 0:
+            t = 0.0
+        else:
+            t = np.clip(((px - x0) * dx + (py - y0) * dy) / length_sq, 0.0, 1.0)
+        dist_sq = (px - (x0 + t * dx)) ** 2 + (py - (y0 + t * dy)) ** 2
+        footprint = dist_sq <= self.cleaning_radius ** 2
+
+        cells = self.cells[window]
+        newly_swept = footprint & (cells == UNKNOWN)
+        cells[newly_swept] = SWEPT
+        visits = self.visits[window]
+        visits[footprint] = np.minimum(visits[footprint], np.iinfo(np.uint16).max - 1) + 1
+
+        added = int(newly_swept.sum())
+        self.swept_count += added
+        return added
+
+    def update_pose(self, x, y, theta):
+        """
+        Feed a new pose estimate (mm, mm, radians) and sweep the path to it.
+
+        Returns:
+            int: Number of newly swept cells
+        """
+        if self.last_pose is None:
+            added = self.sweep(x, y, x, y)
+        else:
+            added = self.sweep(self.last_pose[0], self.last_pose[1], x, y)
+        self.last_pose = (x, y, theta)
+        return added
+
+    def mark_obstacle(self, x, y):
+        """Mark the cell at world point (x, y) as an obstacle."""
+        row, col = self.to_cell(x, y)
+        if not self.in_bounds(row, col):
+            return
+        previous = self.cells[row, col]
+        if previous == OBSTACLE:
+            return
+        if previous == SWEPT:
+            self.swept_count -= 1
+        self.cells[row, col] = OBSTACLE
+        self.obstacle_count += 1
+
+    def _mark_at_bearing(self, pose, bearing, distance):
+        x, y, theta = pose
+        self.mark_obstacle(x + distance * math.cos(theta + bearing),
+                           y + distance * math.sin(theta + bearing))
+
+    def mark_bumps(self, pose, left_bump, right_bump):
+        """Mark obstacles at the bumper positions that are pressed."""
+        distance = ROBOT_RADIUS + self.resolution / 2.0
+        if left_bump and right_bump:
+            self._mark_at_bearing(pose, 0.0, distance)
+        elif left_bump:
+            self._mark_at_bearing(pose, BUMP_BEARINGS[LEFT_BUMP], distance)
+        elif right_bump:
+            self._mark_at_bearing(pose, BUMP_BEARINGS[RIGHT_BUMP], distance)
+
+    def mark_cliffs(self, pose, cliffs):
+        """
+        Mark obstacles at triggered cliff sensors.
+
+        Args:
+            pose (tuple): (x, y, theta) in mm and radians
+            cliffs (dict): Cliff sensor ID -> truthy if a cliff is seen
+        """
+        for sensor, triggered in cliffs.items():
+            if triggered and sensor in CLIFF_BEARINGS:
+                self._mark_at_bearing(pose, CLIFF_BEARINGS[sensor], ROBOT_RADIUS)
+
+    def mark_light_bumps(self, pose, lightbump_bits):
+        """Mark obstacles for each bit set in packet 45 (LIGHTBUMP)."""
+        for bit, bearing in enumerate(LIGHTBUMP_BEARINGS):
+            if lightbump_bits & (1 << bit):
+                self._mark_at_bearing(pose, bearing, ROBOT_RADIUS + LIGHTBUMP_RANGE)
+
+    def update_from_robot(self, robot):
+        """
+        Update from a Create's current pose and sensor dictionary.
+
+        Call after robot.sensors(...) has read the encoders (so the pose is
+        current) and whichever bump, cliff and light-bump packets are used.
+
+        Returns:
+            int: Number of newly swept cells
+        """
+        pose = robot.getPose(dist='mm', angle='rad')
+        added = self.update_pose(*pose)
+        d = robot.sensord
+        self.mark_bumps(pose, d.get(LEFT_BUMP, 0), d.get(RIGHT_BUMP, 0))
+        self.mark_cliffs(pose, {s: d.get(s, 0) for s in CLIFF_BEARINGS})
+        self.mark_light_bumps(pose, d.get(LIGHTBUMP, 0))
+        return added
+
+    # -- queries ------------------------------------------------------------
+
+    def coverage_percentage(self):
+        """Percentage of non-obstacle cells that have been swept."""
+        free = self.rows * self.cols - self.obstacle_count
+        if free <= 0:
+            return 100.0
+        return 100.0 * self.swept_count / free
+
+    def frontier_cells(self):
+        """
+        Return swept cells that border unexplored floor.
+
+        Returns:
+            numpy.ndarray: (N, 2) array of (row, col) indices
+        """
+        swept = self.cells == SWEPT
+        unknown = self.cells == UNKNOWN
+        border = np.zeros_like(swept)
+        border[1:, :] |= unknown[:-1, :]
+        border[:-1, :] |= unknown[1:, :]
+        border[:, 1:] |= unknown[:, :-1]
+        border[:, :-1] |= unknown[:, 1:]
+        return np.argwhere(swept & border)
+
+    def nearest_frontier(self, x, y):
+        """
+        Return the world (x, y) of the frontier cell closest to (x, y).
+
+        Returns:
+            tuple: (x, y) in mm, or None if there is no frontier left
+        """
+        frontier = self.frontier_cells()
+        if len(frontier) == 0:
+            return None
+        row, col = self.to_cell(x, y)
+        dist_sq = (frontier[:, 0] - row) ** 2 + (frontier[:, 1] - col) ** 2
+        best_row, best_col = frontier[int(np.argmin(dist_sq))]
+        return self.to_world(int(best_row), int(best_col))
@@ -0,0 +1,286 @@
+"""
+Standard MIDI file import with streaming playback.
+
+MidiFile reads a .mid file lazily: opening it only reads the header and
+the position of each track, and notes() parses the chosen track from the
+file as it is consumed. Pitches are folded onto the OI's 31-127 range and
+durations are quantised to 1/64 s without drift. Feeding notes() to
+SongPlayer plays a long file without converting it all first.
+
+Example:
+    from roomba.midi import play_midi
+
+    play_midi(robot, 'imperial_march.mid', track=1)
+"""
+
+import logging
+import struct
+
+from .music import REST
+from .songs import SongPlayer
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# OI note range (anything else is a rest)
+LOWEST_NOTE = 31
+HIGHEST_NOTE = 127
+
+DEFAULT_TEMPO = 500000      # microseconds per quarter note (120 bpm)
+READ_SIZE = 4096            # bytes read from the file at a time
+
+
+def fit_pitch(note):
+    """Move a MIDI note number into the OI range by whole octaves."""
+    while note < LOWEST_NOTE:
+        note += 12
+    while note > HIGHEST_NOTE:
+        note -= 12
+    return note
+
+
+class _TrackReader:
+    """Reads one MTrk chunk from the file in small blocks."""
+
+    def __init__(self, stream, offset, length):
+        self.stream = stream
+        self.position = offset
+        self.remaining = length
+        self.buffer = b''
+        self.index = 0
+
+    def _fill(self):
+        if self.remaining <= 0:
+            raise EOFError('unexpected end of MIDI track')
+        self.stream.seek(self.position)
+        data = self.stream.read(min(READ_SIZE, self.remaining))
+        if not data:
+            raise EOFError('unexpected end of MIDI file')
+        self.position += len(data)
+        self.remaining -= len(data)
+        self.buffer = data
+        self.index = 0
+
+    def at_end(self):
+        return self.index >= len(self.buffer) and self.remaining <= 0
+
+    def byte(self):
+        if self.index >= len(self.buffer):
+            self._fill()
+        value = self.buffer[self.index]
+        self.index += 1
+        return value
+
+    def read(self, count):
+        return bytes(self.byte() for _ in range(count))
+
+    def varlen(self):
+        value = 0
+        while True:
+            b = self.byte()
+            value = (value << 7) | (b & 0x7F)
+            if not b & 0x80:
+                return value
+
+
+class _TempoMap:
+    """Converts ticks to seconds across tempo changes (ticks must not go back)."""
+
+    def __init__(self, division, changes=()):
+        self.division = division
+        self.changes = sorted(changes)
+        self.tick = 0
+        self.seconds = 0.0
+        self.tempo = DEFAULT_TEMPO
+        self.next_change = 0
+
+    def _seconds_per_tick(self):
+        if self.division & 0x8000:
+            # SMPTE: -frames per second, ticks per frame
+            fps = 256 - (self.division >> 8)
+            return 1.0 / (fps * (self.division & 0xFF))
+        return self.tempo / 1e6 / self.division
+
+    def set_tempo(self, tick, tempo):
+        self.to_seconds(tick)
+        self.tempo = tempo
+
+    def to_seconds(self, tick):
+        while (self.next_change < len(self.changes)
+               and self.changes[self.next_change][0] <= tick):
+            change_tick, tempo = self.changes[self.next_change]
+            self.seconds += (change_tick - self.tick) * self._seconds_per_tick()
+            self.tick = change_tick
+            self.tempo = tempo
+            self.next_change += 1
+        self.seconds += (tick - self.tick) * self._seconds_per_tick()
+        self.tick = tick
+        return self.seconds
+
+
+def _events(reader):
+    """Yield (tick, status, data) for every event of a track."""
+    tick = 0
+    status = None
+    while not reader.at_end():
+        tick += reader.varlen()
+        first = reader.byte()
+        if first == 0xFF:
+            kind = reader.byte()
+            data = reader.read(reader.varlen())
+            yield tick, 0xFF, (kind, data)
+            if kind == 0x2F:
+                return
+            continue
+        if first in (0xF0, 0xF7):
+            reader.read(reader.varlen())
+            continue
+        if first & 0x80:
+            status = first
+            data = []
+        elif status is None:
+            raise ValueError('MIDI running status without a status byte')
+        else:
+            data = [first]
+        needed = 1 if 0xC0 <= status < 0xE0 else 2
+        while len(data) < needed:
+            data.append(reader.byte())
+        yield tick, status, data
+
+
+class MidiFile:
+    """
+    A Standard MIDI File opened for lazy, streaming reads.
+
+    Accepts a path or a seekable binary file object.
+    """
+
+    def __init__(self, source):
+        if hasattr(source, 'read'):
+            self.stream = source
+            self._owned = False
+        else:
+            self.stream = open(source, 'rb')
+            self._owned = True
+        try:
+            self._read_header()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_header(self):
+        chunk, length = struct.unpack('>4sI', self.stream.read(8))
+        if chunk != b'MThd':
+            raise ValueError('not a Standard MIDI File')
+        self.format, track_count, self.division = struct.unpack('>HHH', self.stream.read(6))
+        position = 8 + length
+
+        # only the chunk positions are read here, not the tracks themselves
+        self.tracks = []
+        while len(self.tracks) < track_count:
+            self.stream.seek(position)
+            header = self.stream.read(8)
+            if len(header) < 8:
+                break
+            chunk, length = struct.unpack('>4sI', header)
+            if chunk == b'MTrk':
+                self.tracks.append((position + 8, length))
+            position += 8 + length
+
+    def close(self):
+        if self._owned:
+            self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _track_events(self, track):
+        offset, length = self.tracks[track]
+        return _events(_TrackReader(self.stream, offset, length))
+
+    def _tempo_changes(self):
+        """Tempo events of the first track (the tempo track in format 1)."""
+        if self.format != 1 or not self.tracks:
+            return []
+        return [(tick, int.from_bytes(data[1], 'big'))
+                for tick, status, data in self._track_events(0)
+                if status == 0xFF and data[0] == 0x51]
+
+    def _has_notes(self, track):
+        return any(0x90 <= status < 0xA0 and data[1] > 0
+                   for _, status, data in self._track_events(track))
+
+    def first_note_track(self):
+        """Index of the first track with any notes, or None."""
+        for track in range(len(self.tracks)):
+            if self._has_notes(track):
+                return track
+        return None
+
+    def notes(self, track=None, channel=None):
+        """
+        Yield the track's melody as (note, duration) pairs.
+
+        Overlapping notes are made monophonic (a new note ends the one
+        sounding) and silences become REST notes. Durations are in 1/64 s
+        and may exceed 255; SongPlayer splits those.
+
+        Args:
+            track (int): Track index; defaults to the first with notes
+            channel (int): Only use notes on this MIDI channel (0-15)
+
+        Yields:
+            tuple: (note, duration)
+        """
+        if track is None:
+            track = self.first_note_track()
+            if track is None:
+                return
+        tempo = _TempoMap(self.division, self._tempo_changes())
+
+        current = None          # (note, start in 1/64 s)
+        last_end = None         # end of the previous note in 1/64 s
+        for tick, status, data in self._track_events(track):
+            now = round(tempo.to_seconds(tick) * 64)
+            if status == 0xFF:
+                if data[0] == 0x51 and self.format != 1:
+                    tempo.set_tempo(tick, int.from_bytes(data[1], 'big'))
+                continue
+            kind = status & 0xF0
+            if channel is not None and status & 0x0F != channel:
+                continue
+            if kind == 0x90 and data[1] > 0:
+                if current is not None:
+                    if now > current[1]:
+                        yield fit_pitch(current[0]), now - current[1]
+                elif last_end is not None and now > last_end:
+                    yield REST, now - last_end
+                current = (data[0], now)
+            elif kind == 0x80 or kind == 0x90:
+                if current is not None and current[0] == data[0]:
+                    if now > current[1]:
+                        yield fit_pitch(current[0]), now - current[1]
+                    current = None
+                    last_end = now
+        if current is not None and now > current[1]:
+            yield fit_pitch(current[0]), now - current[1]
+
+
+def play_midi(robot, path, track=None, channel=None, slots=None):
+    """
+    Play a MIDI file's track on the robot, streaming it through the song slots.
+
+    Args:
+        robot: Create instance
+        path (str): .mid file
+        track (int): Track index; defaults to the first with notes
+        channel (int): Only use notes on this MIDI channel
+        slots (tuple): Song slots to use (default: SongPlayer's)
+    """
+    with MidiFile(path) as midi:
+        player = SongPlayer(robot) if slots is None else SongPlayer(robot, slots)
+        logger.info(f'Playing {path} (format {midi.format}, {len(midi.tracks)} tracks)')
+        player.play(midi.notes(track, channel))
@@ -0,0 +1,146 @@
+"""
+Monotonic-clock scheduler for music cues.
+
+A cue is a generator that does a little work each time it is resumed and
+yields the number of seconds until it wants to be resumed again, such as
+SongPlayer.steps(). MusicScheduler runs any number of cues on one
+background thread, ordered by their deadlines on time.monotonic(), so
+playing a song no longer holds up the thread that drives the robot.
+
+Example:
+    from roomba.scheduler import MusicScheduler
+    from roomba.songs import SongPlayer, STARWARS
+
+    scheduler = MusicScheduler()
+    song = scheduler.schedule(SongPlayer(robot).steps(STARWARS))
+    robot.clean()           # starts while the march is playing
+    song.result()
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class MusicScheduler:
+    """
+    Runs cue generators on a background thread at their deadlines.
+
+    The thread is started by the first schedule() call and sleeps on a
+    condition variable until the earliest deadline, so an idle scheduler
+    costs nothing.
+    """
+
+    def __init__(self, name='music-scheduler'):
+        """
+        Args:
+            name (str): Name of the scheduler thread
+        """
+        self.name = name
+        self._cond = threading.Condition()
+        self._queue = []                # (deadline, seq, cue, future)
+        self._pending = set()           # futures of cues not finished yet
+        self._seq = itertools.count()   # keeps equal deadlines in FIFO order
+        self._thread = None
+        self._running = False
+
+    def schedule(self, cue, delay=0.0):
+        """
+        Run a cue, first resuming it after delay seconds.
+
+        Args:
+            cue (generator): Yields seconds to wait before its next step
+            delay (float): Seconds before the first step
+
+        Returns:
+            Future: Resolves when the cue finishes; cancel() drops the cue
+        """
+        future = Future()
+        future.add_done_callback(self._finished)
+        with self._cond:
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._pending.add(future)
+            heapq.heappush(self._queue, (time.monotonic() + delay, next(self._seq), cue, future))
+            self._cond.notify()
+        return future
+
+    def join(self, timeout=None):
+        """
+        Wait until every scheduled cue has finished or been cancelled.
+
+        Returns:
+            bool: True if nothing is pending any more
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def stop(self):
+        """Cancel all pending cues and stop the scheduler thread."""
+        with self._cond:
+            self._running = False
+            for future in list(self._pending):
+                future.cancel()
+            self._cond.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        with self._cond:
+            for _, _, cue, _ in self._queue:
+                cue.close()
+            self._queue.clear()
+
+    def _finished(self, future):
+        with self._cond:
+            self._pending.discard(future)
+            self._cond.notify_all()
+
+    def _next_due(self):
+        """Pop the earliest cue once its deadline has passed (lock held)."""
+        while self._running:
+            if not self._queue:
+                self._cond.wait()
+                continue
+            remaining = self._queue[0][0] - time.monotonic()
+            if remaining > 0:
+                self._cond.wait(remaining)
+                continue
+            return heapq.heappop(self._queue)
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                entry = self._next_due()
+            if entry is None:
+                return
+            deadline, _, cue, future = entry
+            if future.cancelled():
+                cue.close()
+                continue
+
+            late = time.monotonic() - deadline
+            if late > 0.05:
+                logger.debug(f'Music cue resumed {late * 1000:.0f} ms late')
+            try:
+                delay = next(cue)
+            except StopIteration:
+                # a cue cancelled while its last step ran stays cancelled
+                if not future.done():
+                    future.set_result(None)
+            except Exception as e:
+                logger.error(f'Music cue failed: {e}')
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                with self._cond:
+                    heapq.heappush(self._queue, (time.monotonic() + max(0.0, delay),
+                                                 next(self._seq), cue, future))
@@ -0,0 +1,251 @@
+"""
+Open Interface script compiler for multi-segment paths.
+
+Create.move() and Create.turn() each upload and run their own small script,
+paying a full upload-and-poll cycle per leg. This module compiles a whole
+path of motion primitives into as few OI scripts (opcode 152, at most
+MAX_SCRIPT_LENGTH bytes each) as possible, so a multi-leg routine runs on
+the robot with one upload. Compiled paths are cached by their contents.
+
+Example:
+    from roomba.script import square, run_path
+
+    run_path(robot, square(side_cm=50))
+"""
+
+import logging
+import math
+from collections import namedtuple
+from functools import lru_cache
+
+from .commands import (
+    DRIVE, LEDS, PLAY, WAITTIME, WAITDIST, WAITANGLE, MAX_SCRIPT_LENGTH
+)
+from .sensors import WHEEL_SPAN
+from .utils import _toTwosComplement2Bytes
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Motion primitives. Drive has the same meaning as Create.go(); the waits
+# block the script until the robot has travelled / turned / waited that much.
+Drive = namedtuple('Drive', ['cm_per_sec', 'deg_per_sec'])
+WaitDistance = namedtuple('WaitDistance', ['distance_mm'])
+WaitAngle = namedtuple('WaitAngle', ['angle_deg'])
+WaitTime = namedtuple('WaitTime', ['seconds'])
+Leds = namedtuple('Leds', ['power_color', 'power_intensity', 'play', 'advance'])
+PlaySong = namedtuple('PlaySong', ['song_number'])
+
+STOP = Drive(0, 0)
+
+# Compiled paths kept by compile_path
+SCRIPT_CACHE_SIZE = 64
+
+
+def _int16(value, what):
+    value = int(value)
+    if not -32768 <= value <= 32767:
+        raise ValueError(f'{what} {value} does not fit in 16 bits')
+    return bytes(_toTwosComplement2Bytes(value))
+
+
+def _byte(value, what, low=0, high=255):
+    value = int(value)
+    if not low <= value <= high:
+        raise ValueError(f'{what} {value} outside {low}-{high}')
+    return bytes([value])
+
+
+def _encode_drive(cm_per_sec, deg_per_sec, wheel_span):
+    """DRIVE bytes matching Create.go() for the same arguments."""
+    radius_mm = None
+    if cm_per_sec == 0:
+        rad_per_sec = math.radians(deg_per_sec)
+        velocity_mm = math.fabs(rad_per_sec) * (wheel_span / 2.0)
+        # turn in place: radius 1 is CCW, -1 is CW
+        radius_mm = 1 if rad_per_sec >= 0 else -1
+    elif deg_per_sec == 0:
+        velocity_mm = 10.0 * cm_per_sec
+    else:
+        velocity_mm = 10.0 * cm_per_sec
+        radius_mm = velocity_mm / math.radians(deg_per_sec)
+
+    velocity_mm = max(-500, min(500, int(velocity_mm)))
+    if radius_mm is None or not -2000 <= int(radius_mm) <= 2000:
+        radius_bytes = bytes([0x80, 0x00])   # special case: straight
+    elif int(radius_mm) == 0:
+        radius_bytes = _int16(1 if radius_mm >= 0 else -1, 'radius')
+    else:
+        radius_bytes = _int16(radius_mm, 'radius')
+    return DRIVE + _int16(velocity_mm, 'velocity') + radius_bytes
+
+
+def encode(primitive, wheel_span=WHEEL_SPAN):
+    """
+    Encode one primitive as OI command bytes.
+
+    Args:
+        primitive: Drive, WaitDistance, WaitAngle, WaitTime, Leds or PlaySong
+        wheel_span (float): Wheel separation (mm) for in-place turns
+
+    Returns:
+        bytes: Command bytes for the script body
+
+    Raises:
+        ValueError: If an argument is outside the range the OI accepts
+    """
+    if isinstance(primitive, Drive):
+        return _encode_drive(primitive.cm_per_sec, primitive.deg_per_sec, wheel_span)
+    if isinstance(primitive, WaitDistance):
+        return WAITDIST + _int16(primitive.distance_mm, 'distance')
+    if isinstance(primitive, WaitAngle):
+        return WAITANGLE + _int16(primitive.angle_deg, 'angle')
+    if isinstance(primitive, WaitTime):
+        tenths = int(round(primitive.seconds * 10))
+        if tenths < 0:
+            raise ValueError(f'wait time {primitive.seconds} is negative')
+        # one WAITTIME holds at most 25.5 s
+        result = b''
+        while tenths > 0:
+            result += WAITTIME + bytes([min(tenths, 255)])
+            tenths -= 255
+        return result
+    if isinstance(primitive, Leds):
+        bits = (1 << 3 if primitive.advance else 0) | (1 << 1 if primitive.play else 0)
+        return (LEDS + bytes([bits])
+                + _byte(primitive.power_color, 'power color')
+                + _byte(primitive.power_intensity, 'power intensity'))
+    if isinstance(primitive, PlaySong):
+        return PLAY + _byte(primitive.song_number, 'song number', 0, 15)
+    raise TypeError(f'Not a script primitive: {primitive!r}')
+
+
+def _segments(path):
+    """
+    Split a path into segments that each start with a Drive.
+
+    A STOP directly followed by another Drive ends the segment before it
+    instead of starting one of its own. Within a script the next DRIVE
+    replaces it, so _compile leaves it out unless a script ends there.
+
+    Returns:
+        list: (primitives, ends_with_stop) pairs; the STOP itself is not
+        among the primitives
+    """
+    segments = [[[], False]]
+    for i, primitive in enumerate(path):
+        if isinstance(primitive, Drive):
+            if primitive == STOP and i + 1 < len(path) and isinstance(path[i + 1], Drive):
+                segments[-1][1] = True
+                segments.append([[], False])
+                continue
+            if segments[-1][0]:
+                segments.append([[], False])
+        segments[-1][0].append(primitive)
+    return [(primitives, stops) for primitives, stops in segments if primitives or stops]
+
+
+@lru_cache(maxsize=SCRIPT_CACHE_SIZE)
+def _compile(path, wheel_span):
+    scripts = []
+    current = b''
+    # the STOP elided after the last segment in current, sent only if the
+    # script ends there, so the robot never keeps driving between scripts
+    pending = b''
+    stop = encode(STOP, wheel_span)
+    for primitives, stops in _segments(path):
+        encoded = b''.join(encode(p, wheel_span) for p in primitives)
+        tail = stop if stops else b''
+        # scripts are split between segments where possible, so the robot
+        # only keeps its last drive command while the next script uploads
+        if len(current) + len(encoded) + len(tail) <= MAX_SCRIPT_LENGTH:
+            current += encoded
+            pending = tail
+            continue
+        if current or pending:
+            scripts.append(current + pending)
+            current = b''
+        for primitive in primitives:
+            command = encode(primitive, wheel_span)
+            if len(command) > MAX_SCRIPT_LENGTH:
+                raise ValueError(f'{primitive!r} does not fit in one script')
+            if len(current) + len(command) > MAX_SCRIPT_LENGTH:
+                scripts.append(current)
+                current = b''
+            current += command
+        if len(current) + len(tail) > MAX_SCRIPT_LENGTH:
+            scripts.append(current)
+            current = b''
+        pending = tail
+    if current or pending:
+        scripts.append(current + pending)
+    return tuple(scripts)
+
+
+def compile_path(path, wheel_span=WHEEL_SPAN):
+    """
+    Compile a path into OI script bodies.
+
+    Results are cached by path contents, so replaying the same routine
+    skips compilation (see compile_path.cache_info()).
+
+    Args:
+        path (list): Primitives to run in order
+        wheel_span (float): Wheel separation (mm) for in-place turns
+
+    Returns:
+        tuple: Script bodies (bytes), each at most MAX_SCRIPT_LENGTH long
+
+    Raises:
+        ValueError: If a primitive's arguments are out of range
+    """
+    return _compile(tuple(path), float(wheel_span))
+
+
+compile_path.cache_info = _compile.cache_info
+compile_path.cache_clear = _compile.cache_clear
+
+
+def run_path(robot, path, wait=True):
+    """
+    Compile a path for this robot and run it.
+
+    Args:
+        robot: Create instance
+        path (list): Primitives to run in order
+        wait (bool): If False, return a Future instead of blocking
+
+    Returns:
+        bool or Future: True if every script was seen to finish
+    """
+    scripts = compile_path(path, robot.wheelSpan)
+    logger.debug(f'Running path of {len(path)} primitives as {len(scripts)} script(s)')
+    return robot.runScripts(scripts, wait=wait)
+
+
+# -- path builders -----------------------------------------------------------
+
+def move(distance_cm, cm_per_sec=10):
+    """Primitives for Create.move(): drive straight distance_cm, then stop."""
+    if cm_per_sec == 0:
+        cm_per_sec = 10
+    cm_per_sec = math.copysign(abs(cm_per_sec), distance_cm)
+    return [Drive(cm_per_sec, 0), WaitDistance(int(distance_cm * 10)), STOP]
+
+
+def turn(angle_deg, deg_per_sec=20):
+    """Primitives for Create.turn(): turn in place angle_deg, then stop."""
+    if deg_per_sec == 0:
+        deg_per_sec = 20
+    deg_per_sec = math.copysign(abs(deg_per_sec), angle_deg)
+    return [Drive(0, deg_per_sec), WaitAngle(int(angle_deg)), STOP]
+
+
+def square(side_cm, cm_per_sec=10, deg_per_sec=20, clockwise=False):
+    """Primitives for a square: four legs with a 90 degree turn after each."""
+    corner = -90 if clockwise else 90
+    path = []
+    for _ in range(4):
+        path += move(side_cm, cm_per_sec)
+        path += turn(corner, deg_per_sec)
+    return path
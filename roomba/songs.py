@@ -0,0 +1,187 @@
+"""
+Gapless playback of melodies of any length through the robot's song slots.
+
+The Open Interface stores songs of at most 16 notes and can only start a
+song once the previous one has finished. SongPlayer splits a melody into
+16-note chunks, keeps the song slots filled ahead of playback (uploading
+the next chunk while the current one plays), and starts each chunk as soon
+as SONG_PLAYING (packet 37) reports the previous one has ended, instead of
+relying on hand-tuned sleeps.
+
+Example:
+    from roomba.songs import SongPlayer, STARWARS
+
+    SongPlayer(robot).play(STARWARS)
+"""
+
+import logging
+import time
+from collections import deque
+
+from .music import (
+    REST, QUARTER, HALF, EIGHTH, EIGHTH_DOT, SIXTEENTH,
+    e5, f4, f5, a4, a5, aes4, aes5, b4, bes4, c5, d5, des5, ees5, g5, ges5,
+)
+from .sensors import SONG_PLAYING
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# OI song limits
+MAX_SONG_NOTES = 16
+MAX_NOTE_DURATION = 255         # 1/64ths of a second
+SONG_SLOTS = (0, 1, 2, 3)       # slots every OI version has
+
+# Start polling SONG_PLAYING this long before a chunk should end, and poll
+# this often (the OI updates its sensors every 15 ms). If the robot still
+# reports a song playing SONG_END_GRACE after it should have ended, move on.
+SONG_END_MARGIN = 0.05
+SONG_POLL_INTERVAL = 0.015
+SONG_END_GRACE = 0.5
+
+# The Imperial March, in the parts play_starwars() used to sequence by hand
+_STARWARS_1 = [(a4, QUARTER), (a4, QUARTER), (a4, QUARTER), (f4, EIGHTH_DOT), (c5, SIXTEENTH),
+               (a4, QUARTER), (f4, EIGHTH_DOT), (c5, SIXTEENTH), (a4, HALF)]
+_STARWARS_2 = [(e5, QUARTER), (e5, QUARTER), (e5, QUARTER), (f5, EIGHTH_DOT), (c5, SIXTEENTH),
+               (aes4, QUARTER), (f4, EIGHTH_DOT), (c5, SIXTEENTH), (a4, HALF)]
+_STARWARS_3 = [(a5, QUARTER), (a4, EIGHTH_DOT), (a4, SIXTEENTH), (a5, QUARTER), (aes5, EIGHTH),
+               (g5, EIGHTH), (ges5, SIXTEENTH), (f5, SIXTEENTH), (ges5, SIXTEENTH)]
+_STARWARS_4 = [(REST, EIGHTH), (bes4, EIGHTH), (ees5, QUARTER), (d5, EIGHTH), (des5, EIGHTH),
+               (c5, SIXTEENTH), (b4, SIXTEENTH), (c5, EIGHTH), (c5, EIGHTH)]
+_STARWARS_5 = [(REST, EIGHTH), (f4, EIGHTH), (aes4, QUARTER), (f4, EIGHTH_DOT), (aes4, SIXTEENTH),
+               (c5, QUARTER), (a4, EIGHTH_DOT), (c5, SIXTEENTH), (e5, HALF)]
+_STARWARS_6 = [(REST, EIGHTH), (f4, EIGHTH), (aes4, QUARTER), (f4, EIGHTH_DOT), (c5, SIXTEENTH),
+               (a4, QUARTER), (f4, EIGHTH_DOT), (c5, SIXTEENTH), (a4, HALF)]
+STARWARS = (_STARWARS_1 + _STARWARS_2 + _STARWARS_3 + _STARWARS_4 +
+            _STARWARS_5 + _STARWARS_3 + _STARWARS_4 + _STARWARS_6)
+
+
+def iter_chunks(melody, max_notes=MAX_SONG_NOTES):
+    """
+    Lazily split a melody into chunks that each fit in one song slot.
+
+    Notes longer than MAX_NOTE_DURATION are split into repeated notes.
+    The melody is consumed one chunk at a time, so it can be a generator.
+
+    Args:
+        melody (iterable): (note, duration) pairs, duration in 1/64 s
+        max_notes (int): Notes per chunk
+
+    Yields:
+        list: (note, duration) tuples
+    """
+    chunk = []
+    for note, duration in melody:
+        duration = int(duration)
+        while duration > 0:
+            chunk.append((int(note), min(duration, MAX_NOTE_DURATION)))
+            duration -= MAX_NOTE_DURATION
+            if len(chunk) == max_notes:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def split_melody(melody, max_notes=MAX_SONG_NOTES):
+    """Split a melody into a list of song-slot chunks (see iter_chunks)."""
+    return list(iter_chunks(melody, max_notes))
+
+
+def melody_seconds(melody):
+    """Playing time of a melody in seconds."""
+    return sum(duration for _, duration in melody) / 64.0
+
+
+class SongPlayer:
+    """
+    Streams melodies of any length through a robot's song slots.
+
+    play() blocks until the melody has finished. steps() runs the same
+    schedule as a generator that yields how long to wait before it is
+    resumed, so playback can be driven by a scheduler instead.
+    """
+
+    def __init__(self, robot, slots=SONG_SLOTS):
+        """
+        Args:
+            robot: Create instance
+            slots (tuple): Song slot numbers to cycle through (at least two)
+        """
+        if len(slots) < 2:
+            raise ValueError('SongPlayer needs at least two song slots')
+        self.robot = robot
+        self.slots = tuple(slots)
+
+    def _is_playing(self):
+        return bool(self.robot.sensors([SONG_PLAYING])[SONG_PLAYING])
+
+    def preload(self, melody):
+        """
+        Upload the start of a melody ahead of time.
+
+        The robot remembers which notes are in each slot, so playing the
+        melody later begins with a single PLAY instead of song uploads.
+
+        Returns:
+            int: Number of chunks uploaded
+        """
+        loaded = 0
+        for slot, chunk in zip(self.slots, iter_chunks(melody)):
+            self.robot.setSong(slot, chunk)
+            loaded += 1
+        return loaded
+
+    def steps(self, melody):
+        """
+        Play a melody, yielding the seconds to wait between steps.
+
+        Args:
+            melody (iterable): (note, duration) pairs, duration in 1/64 s
+
+        Yields:
+            float: Seconds until the generator should be resumed
+        """
+        chunks = iter_chunks(melody)
+        queued = deque()        # (slot, chunk) uploaded but not played yet
+        for slot in self.slots:
+            chunk = next(chunks, None)
+            if chunk is None:
+                break
+            self.robot.setSong(slot, chunk)
+            queued.append((slot, chunk))
+
+        previous = None
+        while queued:
+            slot, chunk = queued.popleft()
+            self.robot.playSongNumber(slot)
+            ends = time.monotonic() + melody_seconds(chunk)
+
+            # the previous chunk's slot is free again: refill it while this one plays
+            if previous is not None:
+                upcoming = next(chunks, None)
+                if upcoming is not None:
+                    self.robot.setSong(previous, upcoming)
+                    queued.append((previous, upcoming))
+            previous = slot
+
+            if not queued:
+                remaining = ends - time.monotonic()
+                if remaining > 0:
+                    yield remaining
+                return
+
+            # sleep through most of the chunk, then watch for its end
+            wait = ends - SONG_END_MARGIN - time.monotonic()
+            if wait > 0:
+                yield wait
+            while self._is_playing():
+                if time.monotonic() > ends + SONG_END_GRACE:
+                    logger.warning('Robot still reports a song playing; continuing')
+                    break
+                yield SONG_POLL_INTERVAL
+
+    def play(self, melody):
+        """Play a melody and return once it has finished."""
+        for delay in self.steps(melody):
+            time.sleep(delay)
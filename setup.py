@@ -70,6 +70,9 @@ setup(
             'sphinx>=4.0.0',
             'sphinx-rtd-theme>=1.0.0',
         ],
+        'mapping': [
+            'numpy>=1.17.0',
+        ],
     },
 
     # Package classification
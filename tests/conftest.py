@@ -10,6 +10,7 @@ This module provides fixtures for testing without actual hardware:
 import pytest
 from unittest.mock import Mock, MagicMock
 import sys
+import time
 from pathlib import Path
 
 # Add project root to path
@@ -17,6 +18,185 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 
+class FakeOISerial:
+    """
+    In-memory stand-in for a robot on the other end of the serial port.
+
+    Parses the Open Interface byte stream written to it, tracks the OI mode
+    and answers SENSORS / QUERYLIST requests from the packets dictionary.
+    Every command is recorded in `commands` as (opcode, [args]).
+    While a DRIVE is in effect, each query that reads the encoders (43, 44)
+    advances them by a tenth of the wheel speed in mm/s. Songs play in real
+    time: SONG_PLAYING (37) reads 1 until the song's duration has passed,
+    and a PLAY during a song, or outside SAFE and FULL mode, is ignored
+    (and counted in `ignored_plays`). After reboot() the robot has lost its
+    songs and answers nothing until the next START. The next `lost_modes`
+    mode-changing commands are lost on the line and never reach it.
+    """
+
+    # opcode -> number of argument bytes (None = variable length)
+    ARG_LENGTHS = {
+        128: 0, 129: 1, 130: 0, 131: 0, 132: 0, 133: 0, 134: 0, 135: 0,
+        136: 1, 137: 4, 138: 1, 139: 3, 140: None, 141: 1, 142: 1, 143: 0,
+        145: 4, 148: None, 149: None, 150: 1, 152: None, 153: 0, 155: 1,
+        156: 2, 157: 2,
+    }
+    MODE_COMMANDS = {128: 1, 131: 2, 132: 3, 134: 1, 135: 1, 136: 1, 143: 1}
+
+    def __init__(self, mode=0):
+        from roomba.sensors import SENSOR_DATA_WIDTH
+        self.widths = SENSOR_DATA_WIDTH
+        self.mode = mode
+        self.packets = {}
+        self.commands = []
+        self.timeout = 0.5
+        self.is_open = True
+        self.mode_lag = 0         # queries answered with the old mode after a change
+        self.script_polls = 0     # queries ignored while a script "runs"
+        self.wheel_ticks = (0, 0)  # encoder ticks per query from the last DRIVE
+        self.songs = {}
+        self.plays = []           # (slot, monotonic time) of each accepted PLAY
+        self.ignored_plays = 0
+        self.asleep = False
+        self.lost_modes = 0
+        self._song_ends = 0.0
+        self._pending = bytearray()
+        self._output = bytearray()
+
+    def isOpen(self):
+        return self.is_open
+
+    def write(self, data):
+        self._pending += bytes(data)
+        while self._pending:
+            opcode = self._pending[0]
+            needed = self._command_length(opcode)
+            if needed is None or len(self._pending) < needed:
+                return
+            command = bytes(self._pending[:needed])
+            del self._pending[:needed]
+            self._handle(command[0], list(command[1:]))
+
+    def _command_length(self, opcode):
+        if opcode not in self.ARG_LENGTHS:
+            return 1
+        length = self.ARG_LENGTHS[opcode]
+        if length is not None:
+            return 1 + length
+        if opcode in (148, 149, 152):
+            if len(self._pending) < 2:
+                return None
+            return 2 + self._pending[1]
+        if opcode == 140:
+            if len(self._pending) < 3:
+                return None
+            return 3 + 2 * self._pending[2]
+        return 1
+
+    def _handle(self, opcode, args):
+        if self.lost_modes and opcode in self.MODE_COMMANDS:
+            self.lost_modes -= 1
+            return
+        self.commands.append((opcode, args))
+        if opcode == 128:
+            self.asleep = False
+        if opcode in self.MODE_COMMANDS:
+            self._old_mode = self.mode
+            self.mode = self.MODE_COMMANDS[opcode]
+            self._lag_left = self.mode_lag
+        elif opcode == 133:
+            self.mode = 0
+        elif opcode == 137:
+            self._drive(args)
+        elif opcode == 140:
+            self.songs[args[0]] = list(zip(args[2::2], args[3::2]))
+        elif opcode == 141:
+            self._play(args[0])
+        elif opcode == 153:
+            self._script_left = self.script_polls
+        elif opcode == 142:
+            self._reply([args[0]])
+        elif opcode == 149:
+            self._reply(args[1:])
+
+    def _drive(self, args):
+        velocity = int.from_bytes(bytes(args[:2]), 'big', signed=True)
+        radius = int.from_bytes(bytes(args[2:]), 'big', signed=True)
+        ticks = velocity // 10
+        if radius == 1:
+            self.wheel_ticks = (-ticks, ticks)
+        elif radius == -1:
+            self.wheel_ticks = (ticks, -ticks)
+        else:
+            self.wheel_ticks = (ticks, ticks)
+
+    def _play(self, slot):
+        now = time.monotonic()
+        if self.mode not in (2, 3) or now < self._song_ends:
+            self.ignored_plays += 1
+            return
+        self.plays.append((slot, now))
+        self._song_ends = now + sum(d for _, d in self.songs.get(slot, [])) / 64.0
+
+    def reboot(self):
+        """Restart the robot: OFF mode, empty song slots, no replies until START."""
+        self.mode = 0
+        self.songs = {}
+        self.asleep = True
+
+    def _reply(self, packet_ids):
+        if self.asleep:
+            return
+        if getattr(self, '_script_left', 0) > 0:
+            self._script_left -= 1
+            return
+        if 43 in packet_ids or 44 in packet_ids:
+            for packet_id, ticks in zip((43, 44), self.wheel_ticks):
+                self.packets[packet_id] = (self.packets.get(packet_id, 0) + ticks) & 0xFFFF
+        self.packets[37] = int(time.monotonic() < self._song_ends)
+        for packet_id in packet_ids:
+            width = self.widths[packet_id] if packet_id < len(self.widths) else 1
+            if packet_id == 35:
+                value = self.mode
+                if getattr(self, '_lag_left', 0) > 0:
+                    self._lag_left -= 1
+                    value = self._old_mode
+            else:
+                value = self.packets.get(packet_id, 0)
+            self._output += (value & 0xFFFF).to_bytes(2, 'big')[-width:]
+
+    def sent(self, opcode):
+        """Return the argument lists of every command with this opcode."""
+        return [args for op, args in self.commands if op == opcode]
+
+    def read(self, size=1):
+        if len(self._output) < size and self.timeout:
+            # nothing more is coming; a real port waits out its timeout
+            time.sleep(self.timeout)
+        data = bytes(self._output[:size])
+        del self._output[:size]
+        return data
+
+    @property
+    def in_waiting(self):
+        return len(self._output)
+
+    def inWaiting(self):
+        return len(self._output)
+
+    def reset_input_buffer(self):
+        self._output.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+
+
 @pytest.fixture
 def mock_serial():
     """
@@ -93,6 +273,34 @@ def mock_create_instance(mock_serial, monkeypatch):
     return robot
 
 
+@pytest.fixture
+def fake_oi_serial():
+    """
+    Fake robot that speaks the Open Interface.
+
+    Returns:
+        FakeOISerial: Serial stand-in, starting in OFF_MODE
+    """
+    return FakeOISerial()
+
+
+@pytest.fixture
+def fake_robot(fake_oi_serial, monkeypatch):
+    """
+    Create instance constructed against FakeOISerial.
+
+    Returns:
+        Create: Robot in SAFE_MODE talking to the fake serial port
+    """
+    monkeypatch.setattr('serial.Serial', lambda *args, **kwargs: fake_oi_serial)
+
+    from roomba import Create, SAFE_MODE
+
+    robot = Create('/dev/ttyUSB0', startingMode=SAFE_MODE)
+    fake_oi_serial.commands.clear()
+    return robot
+
+
 @pytest.fixture
 def temp_config_file(tmp_path):
     """
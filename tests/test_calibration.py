@@ -0,0 +1,196 @@
+"""
+Unit tests for roomba.calibration module.
+
+Tests encoder wraparound, least-squares fitting, maneuver recording
+and the per-robot/per-floor calibration store.
+"""
+
+import math
+import pytest
+from unittest.mock import Mock
+from roomba.calibration import (
+    encoder_delta, fit_calibration, ManeuverSample, CalibrationResult,
+    CalibrationStore, OdometryCalibrator, STRAIGHT, ROTATION, CORNER
+)
+from roomba.sensors import ENCODER_LEFT, ENCODER_RIGHT, DISTANCE, ANGLE
+
+
+def straight(true_mm, tick_per_mm):
+    ticks = int(round(true_mm * tick_per_mm))
+    return ManeuverSample(STRAIGHT, ticks, ticks, int(true_mm), 0, true_distance_mm=true_mm)
+
+
+def rotation(reported_deg, true_deg, wheel_span, tick_per_mm, angular_error):
+    # encoder angle = true / angular_error, split evenly across the wheels
+    wheel_mm = math.radians(true_deg / angular_error) * wheel_span
+    ticks = int(round(wheel_mm * tick_per_mm / 2.0))
+    return ManeuverSample(ROTATION, -ticks, ticks, 0, reported_deg, true_angle_deg=true_deg)
+
+
+class TestEncoderDelta:
+    """Test encoder wraparound handling."""
+
+    @pytest.mark.unit
+    def test_forward(self):
+        assert encoder_delta(100, 250) == 150
+
+    @pytest.mark.unit
+    def test_backward(self):
+        assert encoder_delta(250, 100) == -150
+
+    @pytest.mark.unit
+    def test_wrap_forward(self):
+        assert encoder_delta(65530, 10) == 16
+
+    @pytest.mark.unit
+    def test_wrap_backward(self):
+        assert encoder_delta(10, 65530) == -16
+
+
+class TestFitCalibration:
+    """Test least-squares fitting of the odometry constants."""
+
+    @pytest.mark.unit
+    def test_recovers_constants(self):
+        samples = [straight(d, 2.5) for d in (300, 500, 1000)]
+        samples += [rotation(360, 290, 240.0, 2.5, 0.8),
+                    rotation(720, 575, 240.0, 2.5, 0.8)]
+
+        result = fit_calibration(samples)
+
+        assert result.tick_per_mm == pytest.approx(2.5, rel=1e-3)
+        assert result.angular_error == pytest.approx(0.8, rel=1e-2)
+        assert result.samples == 5
+
+    @pytest.mark.unit
+    def test_wheel_span_matches_reported_angle(self):
+        # robot reports exactly the wheel geometry angle for a 250 mm span
+        wheel_mm = math.radians(360) * 250.0
+        ticks = int(round(wheel_mm * 2.0 / 2.0))
+        samples = [straight(1000, 2.0),
+                   ManeuverSample(ROTATION, -ticks, ticks, 0, 360, true_angle_deg=360)]
+
+        result = fit_calibration(samples)
+
+        assert result.wheel_span == pytest.approx(250.0, rel=1e-3)
+        assert result.angular_error == pytest.approx(1.0, rel=1e-3)
+
+    @pytest.mark.unit
+    def test_corners_fit_span_but_not_angular_error(self):
+        # a corner that really turned 75 degrees when 90 were commanded
+        corner = rotation(94, 75, 240.0, 2.5, 0.8)
+        corner.kind, corner.true_angle_deg = CORNER, 90
+        samples = [straight(d, 2.5) for d in (300, 500, 1000)]
+        samples += [rotation(360, 290, 240.0, 2.5, 0.8), corner, corner]
+
+        result = fit_calibration(samples)
+
+        assert result.angular_error == pytest.approx(0.8, rel=1e-2)
+
+    @pytest.mark.unit
+    def test_requires_straight_samples(self):
+        with pytest.raises(ValueError):
+            fit_calibration([rotation(360, 360, 235.0, 2.25, 1.0)])
+
+    @pytest.mark.unit
+    def test_requires_rotation_samples(self):
+        with pytest.raises(ValueError):
+            fit_calibration([straight(500, 2.25)])
+
+
+class TestCalibrationResult:
+    """Test CalibrationResult serialisation and application."""
+
+    @pytest.mark.unit
+    def test_round_trip(self):
+        result = CalibrationResult(240.0, 2.4, 0.85, 9)
+        copy = CalibrationResult.from_dict(result.to_dict())
+        assert copy.to_dict() == result.to_dict()
+
+    @pytest.mark.unit
+    def test_apply(self):
+        robot = Mock()
+        CalibrationResult(240.0, 2.4, 0.85).apply(robot)
+        robot.setCalibration.assert_called_once_with(
+            wheelSpan=240.0, tickPerMM=2.4, angularError=0.85)
+
+    @pytest.mark.integration
+    def test_apply_to_create(self, mock_create_instance):
+        robot = mock_create_instance
+        CalibrationResult(240.0, 2.4, 0.85).apply(robot)
+        assert robot.wheelSpan == 240.0
+        assert robot.tickPerMM == 2.4
+        assert robot.angularError == 0.85
+
+
+class TestCalibrationStore:
+    """Test the per-robot, per-floor JSON store."""
+
+    @pytest.mark.unit
+    def test_missing_file(self, tmp_path):
+        store = CalibrationStore(str(tmp_path / 'cal.json'))
+        assert store.load('robot', 'carpet') is None
+
+    @pytest.mark.unit
+    def test_save_and_load_per_floor(self, tmp_path):
+        store = CalibrationStore(str(tmp_path / 'cal.json'))
+        store.save('robot', 'carpet', CalibrationResult(240.0, 2.4, 0.80))
+        store.save('robot', 'tile', CalibrationResult(240.0, 2.4, 0.95))
+
+        assert store.load('robot', 'carpet').angular_error == 0.80
+        assert store.load('robot', 'tile').angular_error == 0.95
+        assert store.floors('robot') == ['carpet', 'tile']
+        assert store.load('other', 'carpet') is None
+
+    @pytest.mark.integration
+    def test_apply_stored(self, tmp_path, mock_create_instance):
+        store = CalibrationStore(str(tmp_path / 'cal.json'))
+        store.save('robot', 'carpet', CalibrationResult(240.0, 2.4, 0.80))
+
+        assert store.apply(mock_create_instance, 'robot', 'carpet').angular_error == 0.80
+        assert mock_create_instance.wheelSpan == 240.0
+        assert mock_create_instance.angularError == 0.80
+
+    @pytest.mark.unit
+    def test_apply_without_entry(self, tmp_path):
+        robot = Mock()
+        (tmp_path / 'bad.json').write_text('{not json')
+
+        assert CalibrationStore(str(tmp_path / 'cal.json')).apply(robot, 'robot', 'carpet') is None
+        assert CalibrationStore(str(tmp_path / 'bad.json')).apply(robot, 'robot', 'carpet') is None
+        robot.setCalibration.assert_not_called()
+
+
+class TestOdometryCalibrator:
+    """Test maneuver recording against a mocked robot."""
+
+    @pytest.mark.integration
+    def test_run_square_records_legs_and_corners(self):
+        readings = iter([
+            {ENCODER_LEFT: 0, ENCODER_RIGHT: 0, DISTANCE: 0, ANGLE: 0},
+            {ENCODER_LEFT: 1125, ENCODER_RIGHT: 1125, DISTANCE: 500, ANGLE: 0},
+        ] * 8)
+        robot = Mock()
+        robot.sensors = Mock(side_effect=lambda sensors: next(readings))
+
+        samples = OdometryCalibrator(robot).run_square(side_cm=50)
+
+        assert len(samples) == 8
+        assert [s.kind for s in samples[:2]] == [STRAIGHT, CORNER]
+        assert samples[0].true_distance_mm == 500
+        assert samples[0].left_ticks == 1125
+        # the commanded 90 degrees is not taken as ground truth
+        assert samples[1].true_angle_deg == 0
+        assert robot.move.call_count == 4
+        assert robot.turn.call_count == 4
+
+    @pytest.mark.integration
+    def test_measured_rotation_overrides_commanded(self):
+        robot = Mock()
+        robot.sensors = Mock(return_value={ENCODER_LEFT: 0, ENCODER_RIGHT: 0,
+                                           DISTANCE: 0, ANGLE: 0})
+
+        sample = OdometryCalibrator(robot).run_rotation(turns=2, measured_deg=700)
+
+        robot.turn.assert_called_once_with(720, 20)
+        assert sample.true_angle_deg == 700
@@ -0,0 +1,261 @@
+"""
+Tests for roomba.daemon module.
+
+Runs RobotDaemon on a temporary Unix socket in front of a Create talking
+to FakeOISerial, and drives it through RobotClient.
+"""
+
+import logging
+import threading
+import time
+import pytest
+from roomba import FULL_MODE, PASSIVE_MODE, SAFE_MODE
+from roomba.daemon import (KEEPALIVE_MAX_INTERVAL, RobotDaemon, RobotClient,
+                           RobotDaemonError, run_command)
+from roomba.sensors import BATTERY_CHARGE
+
+DRIVE_OP, CLEAN_OP, POWER_OP = 137, 135, 133
+SAFE_OP, SONG_OP, PLAY_OP, SENSORS_OP, QUERYLIST_OP = 131, 140, 141, 142, 149
+
+
+@pytest.fixture
+def daemon(fake_robot, tmp_path):
+    """RobotDaemon serving fake_robot from a background thread."""
+    daemon = RobotDaemon(fake_robot, str(tmp_path / 'roomba.sock'))
+    daemon.start()
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    thread.join(timeout=1)
+
+
+@pytest.fixture
+def warm_daemon(fake_robot, tmp_path):
+    """RobotDaemon in warm standby with a fast keepalive."""
+    daemon = RobotDaemon(fake_robot, str(tmp_path / 'roomba.sock'), standby=True,
+                         keepalive_interval=0.05)
+    daemon.start()
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    yield daemon
+    daemon.shutdown()
+    thread.join(timeout=1)
+
+
+@pytest.fixture
+def client(daemon):
+    """RobotClient connected to the daemon fixture."""
+    with RobotClient(daemon.socket_path, timeout=2) as client:
+        yield client
+
+
+class TestRunCommand:
+    """Test the command table used by the daemon."""
+
+    @pytest.mark.unit
+    def test_unknown_command(self, fake_robot):
+        with pytest.raises(KeyError):
+            run_command(fake_robot, 'format_disk')
+
+    @pytest.mark.integration
+    def test_clean_drops_to_passive(self, fake_robot, fake_oi_serial):
+        run_command(fake_robot, 'clean')
+        assert fake_oi_serial.sent(CLEAN_OP)
+        assert fake_robot.getMode() == PASSIVE_MODE
+
+
+class TestRobotDaemon:
+    """Test requests and responses over the socket."""
+
+    @pytest.mark.integration
+    def test_ping(self, client):
+        assert client.call('ping') == 'pong'
+
+    @pytest.mark.integration
+    def test_commands_reach_robot(self, client, fake_oi_serial):
+        client.call('go', 20, 0)
+        client.call('stop')
+        assert len(fake_oi_serial.sent(DRIVE_OP)) == 2
+
+    @pytest.mark.integration
+    def test_mode_change(self, client, fake_oi_serial):
+        assert client.call('full') is True
+        assert client.call('mode') == FULL_MODE
+        assert fake_oi_serial.mode == FULL_MODE
+
+    @pytest.mark.integration
+    def test_sensor_keys_are_strings(self, client, fake_oi_serial):
+        fake_oi_serial.packets[BATTERY_CHARGE] = 1500
+        result = client.call('sensors', [BATTERY_CHARGE])
+        assert result[str(BATTERY_CHARGE)] == 1500
+
+    @pytest.mark.integration
+    def test_error_keeps_connection(self, client):
+        with pytest.raises(RobotDaemonError):
+            client.call('format_disk')
+        with pytest.raises(RobotDaemonError):
+            client.call('go', 'fast')
+        assert client.call('ping') == 'pong'
+
+    @pytest.mark.integration
+    def test_set_song_accepts_lists(self, client, fake_oi_serial):
+        client.call('set_song', 1, [[60, 16], [62, 16]])
+        assert fake_oi_serial.sent(140) == [[1, 2, 60, 16, 62, 16]]
+
+    @pytest.mark.integration
+    def test_background_melody_returns_at_once(self, client, fake_oi_serial):
+        assert client.call('play_melody', [[60, 32]] * 20, False) is None
+        client.call('go', 10, 0)
+
+        assert fake_oi_serial.sent(DRIVE_OP)
+        assert len(fake_oi_serial.plays) == 1
+
+    @pytest.mark.integration
+    def test_clients_are_serialised(self, daemon, fake_oi_serial):
+        def drive():
+            with RobotClient(daemon.socket_path, timeout=2) as client:
+                for _ in range(20):
+                    client.call('go', 10, 0)
+
+        threads = [threading.Thread(target=drive) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # every DRIVE arrived intact with its four argument bytes
+        assert len(fake_oi_serial.sent(DRIVE_OP)) == 80
+        assert all(len(args) == 4 for args in fake_oi_serial.sent(DRIVE_OP))
+
+    @pytest.mark.integration
+    def test_no_daemon(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            RobotClient(str(tmp_path / 'missing.sock')).call('ping')
+
+
+class TestWarmStandby:
+    """Test keeping the robot ready between requests."""
+
+    @pytest.mark.integration
+    def test_warm_up_preloads_jingle(self, warm_daemon, fake_oi_serial):
+        assert len(fake_oi_serial.sent(SONG_OP)) == 4
+        assert warm_daemon.robot.getMode() == SAFE_MODE
+
+    @pytest.mark.integration
+    def test_on_sends_only_play_and_clean(self, warm_daemon, fake_oi_serial):
+        with RobotClient(warm_daemon.socket_path, timeout=2) as client:
+            with warm_daemon.lock:
+                fake_oi_serial.commands.clear()
+            started = time.monotonic()
+            client.call('safe')
+            client.call('play_jingle')
+            client.call('clean')
+            # nothing waits for the march, so OFF goes straight through
+            client.call('power')
+            elapsed = time.monotonic() - started
+
+        ops = [op for op, _ in fake_oi_serial.commands if op not in (SENSORS_OP, QUERYLIST_OP)]
+        # the jingle starts in safe mode, then CLEAN drops to passive
+        assert ops == [PLAY_OP, CLEAN_OP, POWER_OP]
+        assert elapsed < 1.0
+        assert fake_oi_serial.ignored_plays == 0
+        assert len(fake_oi_serial.plays) == 1
+
+    @pytest.mark.integration
+    def test_keepalive_confirms_mode(self, warm_daemon, fake_oi_serial):
+        fake_oi_serial.commands.clear()
+        threading.Event().wait(0.2)
+        # OI_MODE queries, but no mode changes or song uploads
+        assert [1, 35] in fake_oi_serial.sent(QUERYLIST_OP)
+        assert not fake_oi_serial.sent(SONG_OP)
+        assert not fake_oi_serial.sent(SAFE_OP)
+
+    @pytest.mark.integration
+    def test_keepalive_leaves_powered_off_robot(self, warm_daemon, fake_oi_serial):
+        with RobotClient(warm_daemon.socket_path, timeout=2) as client:
+            client.call('power')
+        fake_oi_serial.commands.clear()
+        threading.Event().wait(0.2)
+        assert fake_oi_serial.commands == []
+
+    @pytest.mark.integration
+    def test_keepalive_reloads_jingle_after_reboot(self, fake_robot, fake_oi_serial, tmp_path):
+        daemon = RobotDaemon(fake_robot, str(tmp_path / 'roomba.sock'), standby=True)
+        daemon.warm_up()
+        fake_oi_serial.timeout = 0.01
+        fake_oi_serial.reboot()
+        fake_oi_serial.commands.clear()
+
+        assert daemon.keepalive()
+        # the slot cache was stale; the jingle goes up again
+        assert len(fake_oi_serial.sent(SONG_OP)) == 4
+        assert len(fake_oi_serial.songs) == 4
+        assert fake_robot.getMode() == SAFE_MODE
+
+    @pytest.mark.integration
+    def test_idle_robot_left_to_sleep(self, fake_robot, fake_oi_serial, tmp_path):
+        daemon = RobotDaemon(fake_robot, str(tmp_path / 'roomba.sock'), standby=True,
+                             standby_idle=0.05)
+        daemon.warm_up()
+        time.sleep(0.1)
+        fake_oi_serial.commands.clear()
+
+        assert daemon.keepalive()
+        assert fake_oi_serial.commands == []
+
+        # it slept and forgot its songs; the next ON wakes it and reloads them
+        fake_oi_serial.timeout = 0.01
+        fake_oi_serial.reboot()
+        daemon.execute('safe')
+        daemon.execute('play_jingle')
+        assert fake_robot.getMode() == SAFE_MODE
+        assert fake_oi_serial.sent(SONG_OP)
+        assert len(fake_oi_serial.plays) == 1
+        assert fake_oi_serial.ignored_plays == 0
+
+    @pytest.mark.unit
+    def test_keepalive_runs_while_in_use(self, fake_robot, fake_oi_serial, tmp_path):
+        daemon = RobotDaemon(fake_robot, str(tmp_path / 'roomba.sock'), standby=True,
+                             standby_idle=0.05)
+        daemon.warm_up()
+        time.sleep(0.1)
+        daemon.execute('ping')
+        fake_oi_serial.commands.clear()
+
+        assert daemon.keepalive()
+        assert [1, 35] in fake_oi_serial.sent(QUERYLIST_OP)
+
+    @pytest.mark.unit
+    def test_keepalive_warns_once_while_unresponsive(self, fake_robot, tmp_path,
+                                                      monkeypatch, caplog):
+        daemon = RobotDaemon(fake_robot, str(tmp_path / 'roomba.sock'), standby=True)
+        monkeypatch.setattr(fake_robot, 'verifyMode', lambda: None)
+        monkeypatch.setattr(fake_robot, 'ensureMode', lambda mode: False)
+
+        with caplog.at_level(logging.INFO, logger='roomba.daemon'):
+            assert [daemon.keepalive() for _ in range(3)] == [False] * 3
+            monkeypatch.setattr(fake_robot, 'verifyMode', lambda: SAFE_MODE)
+            assert daemon.keepalive()
+
+        messages = [record.getMessage() for record in caplog.records]
+        assert messages[0] == 'Robot did not answer the keepalive; warming up again'
+        assert messages[1:] == ['Robot answering again']
+
+    @pytest.mark.unit
+    def test_keepalive_backs_off_while_unresponsive(self, fake_robot, tmp_path, monkeypatch):
+        daemon = RobotDaemon(fake_robot, str(tmp_path / 'roomba.sock'), standby=True,
+                             keepalive_interval=10.0)
+        answers = iter([False] * 5 + [True, False])
+        waits = []
+
+        def wait(timeout):
+            waits.append(timeout)
+            return len(waits) > 7
+
+        monkeypatch.setattr(daemon, 'keepalive', lambda: next(answers))
+        monkeypatch.setattr(daemon._stopping, 'wait', wait)
+        daemon._keepalive_loop()
+
+        assert waits == [10.0, 20.0, 40.0, KEEPALIVE_MAX_INTERVAL, KEEPALIVE_MAX_INTERVAL,
+                         KEEPALIVE_MAX_INTERVAL, 10.0, 20.0]
@@ -0,0 +1,123 @@
+"""
+Tests for legacy/debounce_handler.py.
+
+Checks that repeats of one command from several Echos are dropped while
+commands for other devices or states go through.
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+import pytest
+
+import fauxmo
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'legacy'))
+
+import debounce_handler as debounce_module
+from debounce_handler import debounce_handler
+
+
+class Recorder(debounce_handler):
+    def __init__(self):
+        debounce_handler.__init__(self)
+        self.acts = []
+
+    def act(self, client_address, state, name):
+        self.acts.append((client_address, state, name))
+        return True
+
+
+class SlowRecorder(Recorder):
+    """Recorder whose act() blocks until released."""
+
+    def __init__(self):
+        Recorder.__init__(self)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def act(self, client_address, state, name):
+        Recorder.act(self, client_address, state, name)
+        self.started.set()
+        self.release.wait(2)
+        return True
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(debounce_module.time, 'monotonic', lambda: now[0])
+    return now
+
+
+class TestDebounceHandler:
+    """Test dropping duplicate commands from multiple Echos."""
+
+    @pytest.mark.unit
+    def test_duplicate_from_second_echo_dropped(self, clock):
+        handler = Recorder()
+        assert handler.on('10.0.0.5', 'kitchen')
+        clock[0] += 0.1
+        assert handler.on('10.0.0.6', 'kitchen')
+
+        assert handler.acts == [('10.0.0.5', True, 'kitchen')]
+
+    @pytest.mark.unit
+    def test_other_device_not_swallowed(self, clock):
+        handler = Recorder()
+        handler.on('10.0.0.5', 'kitchen')
+        handler.on('10.0.0.5', 'office')
+        handler.off('10.0.0.5', 'kitchen')
+
+        assert [(state, name) for _, state, name in handler.acts] == \
+            [(True, 'kitchen'), (True, 'office'), (False, 'kitchen')]
+
+    @pytest.mark.unit
+    def test_repeat_after_window(self, clock):
+        handler = Recorder()
+        handler.on('10.0.0.5', 'kitchen')
+        clock[0] += handler.DEBOUNCE_SECONDS
+        handler.on('10.0.0.5', 'kitchen')
+
+        assert len(handler.acts) == 2
+        assert list(handler.recent) == [('kitchen', True)]
+
+    @pytest.mark.unit
+    def test_wall_clock_step_ignored(self, clock, monkeypatch):
+        handler = Recorder()
+        handler.on('10.0.0.5', 'kitchen')
+        # NTP steps the wall clock back an hour; the monotonic clock moves on
+        monkeypatch.setattr(debounce_module.time, 'time', lambda: 0.0)
+        clock[0] += 1.0
+        handler.on('10.0.0.5', 'kitchen')
+
+        assert len(handler.acts) == 2
+
+    @pytest.mark.unit
+    def test_expired_fingerprints_are_dropped(self, clock):
+        handler = Recorder()
+        for i in range(100):
+            handler.on('10.0.0.5', 'room %d' % i)
+            clock[0] += 0.01
+        clock[0] += handler.DEBOUNCE_SECONDS
+
+        handler.off('10.0.0.5', 'hall')
+        assert list(handler.recent) == [('hall', False)]
+
+    @pytest.mark.integration
+    def test_duplicate_dropped_while_first_in_flight(self):
+        handler = SlowRecorder()
+        actions = fauxmo.action_queue(window=0.05)
+        actions.put(handler, True, '10.0.0.1', 'robot')
+        assert handler.started.wait(1)
+
+        # past the queue's coalescing window, inside the debounce window
+        time.sleep(0.1)
+        actions.put(handler, True, '10.0.0.2', 'robot')
+        # the first routine outlasts the debounce window
+        time.sleep(handler.DEBOUNCE_SECONDS)
+        handler.release.set()
+
+        assert actions.join(timeout=1)
+        assert handler.acts == [('10.0.0.1', True, 'robot')]
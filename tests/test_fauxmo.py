@@ -0,0 +1,780 @@
+"""
+Tests for fauxmo.py.
+
+Tests the selector-based poller (socket dispatch, timers, and waking a
+blocked poll from another thread), the incremental HTTP parser and the
+pre-rendered device responses.
+"""
+
+import socket
+import threading
+import time
+import pytest
+
+import fauxmo
+
+
+class Reader:
+    """Poll target that records what it reads."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reads = []
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def do_read(self, fileno):
+        self.reads.append((fileno, self.sock.recv(1024)))
+
+
+@pytest.fixture
+def poller():
+    p = fauxmo.poller()
+    yield p
+    p.close()
+
+
+@pytest.fixture
+def sockets():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+class TestPoller:
+    """Test the fauxmo socket and timer poller."""
+
+    @pytest.mark.unit
+    def test_dispatches_ready_socket(self, poller, sockets):
+        reader = Reader(sockets[0])
+        poller.add(reader)
+        sockets[1].send(b'M-SEARCH')
+
+        assert poller.poll(1000) == 1
+        assert reader.reads == [(sockets[0].fileno(), b'M-SEARCH')]
+
+    @pytest.mark.unit
+    def test_idle_poll_blocks(self, poller, sockets):
+        poller.add(Reader(sockets[0]))
+
+        started = time.monotonic()
+        assert poller.poll(100) == 0
+        assert time.monotonic() - started == pytest.approx(0.1, abs=0.05)
+
+    @pytest.mark.unit
+    def test_request_is_handled_immediately(self, poller, sockets):
+        reader = Reader(sockets[0])
+        poller.add(reader)
+        threading.Timer(0.05, sockets[1].send, [b'GET']).start()
+
+        started = time.monotonic()
+        poller.poll(1000)
+        assert reader.reads
+        assert time.monotonic() - started < 0.1
+
+    @pytest.mark.unit
+    def test_remove(self, poller, sockets):
+        reader = Reader(sockets[0])
+        poller.add(reader)
+        poller.remove(reader)
+        sockets[1].send(b'x')
+        assert poller.poll(10) == 0
+
+    @pytest.mark.unit
+    def test_timers_run_in_order(self, poller):
+        fired = []
+        poller.call_later(0.04, fired.append, 'second')
+        poller.call_later(0.02, fired.append, 'first')
+        cancelled = poller.call_later(0.01, fired.append, 'cancelled')
+        poller.cancel_timer(cancelled)
+
+        started = time.monotonic()
+        while len(fired) < 2 and time.monotonic() - started < 1:
+            poller.poll()
+
+        assert fired == ['first', 'second']
+        assert time.monotonic() - started == pytest.approx(0.04, abs=0.03)
+
+    @pytest.mark.unit
+    def test_stop_wakes_blocked_run(self, poller):
+        thread = threading.Thread(target=poller.run)
+        thread.start()
+        time.sleep(0.05)
+
+        started = time.monotonic()
+        poller.stop()
+        thread.join(timeout=1)
+
+        assert not thread.is_alive()
+        assert time.monotonic() - started < 0.1
+
+    @pytest.mark.unit
+    def test_timer_from_other_thread_wakes_poll(self, poller):
+        fired = []
+        threading.Timer(0.02, poller.call_later, [0, fired.append, 'now']).start()
+
+        started = time.monotonic()
+        while not fired and time.monotonic() - started < 1:
+            poller.poll(1000)
+
+        assert fired == ['now']
+        assert time.monotonic() - started < 0.2
+
+
+def set_state(state, connection=b'close'):
+    body = b'<BinaryState>%d</BinaryState>' % state
+    return (b'POST /upnp/control/basicevent1 HTTP/1.1\r\n'
+            b'SOAPACTION: "urn:Belkin:service:basicevent:1#SetBinaryState"\r\n'
+            b'Connection: %s\r\n'
+            b'Content-Length: %d\r\n\r\n%s' % (connection, len(body), body))
+
+
+def get_state():
+    return (b'POST /upnp/control/basicevent1 HTTP/1.1\r\n'
+            b'SOAPACTION: "urn:Belkin:service:basicevent:1#GetBinaryState"\r\n'
+            b'Content-Length: 0\r\n\r\n')
+
+
+def parse(data):
+    requests = fauxmo.http_parser().feed(data)
+    assert len(requests) == 1
+    return requests[0]
+
+
+class Handler:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+        self.spans = []
+
+    def _act(self, state, name):
+        started = time.monotonic()
+        time.sleep(self.delay)
+        self.calls.append((state, name))
+        self.spans.append((started, time.monotonic()))
+        return True
+
+    def on(self, client_address, name):
+        return self._act('on', name)
+
+    def off(self, client_address, name):
+        return self._act('off', name)
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, destination):
+        self.sent.append((data, destination))
+
+    def sendall(self, data):
+        self.sent.append((data, None))
+
+
+def read_response(client):
+    """Read one Content-Length delimited response from a socket."""
+    data = b''
+    while b'\r\n\r\n' not in data:
+        data += client.recv(4096)
+    head, body = data.split(b'\r\n\r\n', 1)
+    length = int(head.split(b'CONTENT-LENGTH: ')[1].split(b'\r\n')[0])
+    while len(body) < length:
+        body += client.recv(4096)
+    return head, body
+
+
+class TestHttpParser:
+    """Test parsing requests incrementally off a connection."""
+
+    @pytest.mark.unit
+    def test_request_split_across_reads(self):
+        data = set_state(1)
+        parser = fauxmo.http_parser()
+
+        requests = []
+        for i in range(len(data)):
+            requests += parser.feed(data[i:i + 1])
+
+        assert len(requests) == 1
+        request = requests[0]
+        assert (request.method, request.path, request.version) == \
+            ('POST', '/upnp/control/basicevent1', 'HTTP/1.1')
+        assert request.header('soapaction') == '"urn:Belkin:service:basicevent:1#SetBinaryState"'
+        assert request.body == b'<BinaryState>1</BinaryState>'
+
+    @pytest.mark.unit
+    def test_pipelined_requests(self):
+        data = b'GET /setup.xml HTTP/1.1\r\n\r\n' + set_state(0, b'keep-alive') + b'GET /x HTTP/1.1\r\n'
+        parser = fauxmo.http_parser()
+
+        requests = parser.feed(data)
+        assert [r.path for r in requests] == ['/setup.xml', '/upnp/control/basicevent1']
+        assert requests[1].body == b'<BinaryState>0</BinaryState>'
+        assert [r.path for r in parser.feed(b'\r\n')] == ['/x']
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize('data,keep_alive', [
+        (b'GET / HTTP/1.1\r\n\r\n', True),
+        (b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n', False),
+        (b'GET / HTTP/1.0\r\n\r\n', False),
+        (b'GET / HTTP/1.0\r\nConnection: Keep-Alive\r\n\r\n', True),
+    ])
+    def test_keep_alive(self, data, keep_alive):
+        assert parse(data).keep_alive() is keep_alive
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize('data', [
+        b'GARBAGE\r\n\r\n',
+        b'GET / HTTP/1.1\r\nno colon\r\n\r\n',
+        b'POST / HTTP/1.1\r\nContent-Length: -1\r\n\r\n',
+        b'POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n',
+        b'GET / HTTP/1.1\r\nX: ' + b'x' * 9000,
+    ])
+    def test_malformed_requests(self, data):
+        with pytest.raises(ValueError):
+            fauxmo.http_parser().feed(data)
+
+
+@pytest.fixture
+def actions():
+    return fauxmo.action_queue(window=0.02)
+
+
+@pytest.fixture
+def device(poller, actions):
+    listener = fauxmo.upnp_broadcast_responder()
+    device = fauxmo.fauxmo('robot', listener, poller, '127.0.0.1', 0,
+                           action_handler=Handler(), actions=actions, states=fauxmo.state_table())
+    yield device
+    device.socket.close()
+
+
+@pytest.fixture
+def serve(poller):
+    """Run the poller on a thread while the test talks to it."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.is_set():
+            poller.poll(20)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    yield
+    stop.set()
+    thread.join()
+
+
+class TestResponses:
+    """Test the pre-rendered HTTP and SSDP responses."""
+
+    @pytest.mark.unit
+    def test_date_formatted_once_a_second(self, monkeypatch):
+        calls = []
+        formatdate = fauxmo.email.utils.formatdate
+        monkeypatch.setattr(fauxmo.email.utils, 'formatdate',
+                            lambda *args, **kwargs: calls.append(args) or formatdate(*args, **kwargs))
+        monkeypatch.setattr(fauxmo.time, 'time', lambda: 1700000000.25)
+        first = fauxmo.http_date()
+        monkeypatch.setattr(fauxmo.time, 'time', lambda: 1700000000.75)
+        assert fauxmo.http_date() is first
+        monkeypatch.setattr(fauxmo.time, 'time', lambda: 1700000001.0)
+        assert fauxmo.http_date() == b'Tue, 14 Nov 2023 22:13:21 GMT'
+        assert len(calls) == 2
+
+    @pytest.mark.unit
+    def test_setup_xml_over_http(self, poller, device):
+        client = socket.create_connection(('127.0.0.1', device.port))
+        try:
+            client.sendall(b'GET /setup.xml HTTP/1.1\r\nHost: x\r\n\r\n')
+            poller.poll(1000)       # accept
+            poller.poll(1000)       # request
+            response = client.recv(4096)
+        finally:
+            client.close()
+
+        head, body = response.split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 200 OK')
+        assert b'CONTENT-LENGTH: %d' % len(body) in head
+        assert b' GMT\r\nLAST-MODIFIED: ' in head
+        assert b'<friendlyName>robot</friendlyName>' in body
+
+    @pytest.mark.unit
+    def test_set_binary_state(self, device, actions):
+        response = device.handle_request(parse(set_state(1)), ('10.0.0.5', 1))
+
+        # answered before the handler has run
+        assert response.startswith(b'HTTP/1.1 200 OK')
+        assert response.endswith(b'CONNECTION: close\r\n\r\n')
+        assert device.action_handler.calls == []
+        assert actions.join(timeout=1)
+        assert device.action_handler.calls == [('on', 'robot')]
+
+    @pytest.mark.unit
+    def test_unknown_requests(self, device):
+        assert device.handle_request(parse(b'GET /nothing HTTP/1.1\r\n\r\n'), ('10.0.0.5', 1)) \
+            .startswith(b'HTTP/1.1 404 Not Found')
+        bad_state = set_state(7)
+        assert device.handle_request(parse(bad_state), ('10.0.0.5', 1)) \
+            .startswith(b'HTTP/1.1 400 Bad Request')
+
+    @pytest.mark.unit
+    def test_keep_alive_connection(self, poller, device, actions):
+        client = socket.create_connection(('127.0.0.1', device.port))
+        try:
+            poller.poll(1000)       # accept
+            client.sendall(b'GET /setup.xml HTTP/1.1\r\nHost: x\r\n\r\n' + set_state(1, b'keep-alive')[:40])
+            poller.poll(1000)
+            head, body = read_response(client)
+            assert b'CONNECTION: keep-alive' in head
+            assert b'<friendlyName>robot</friendlyName>' in body
+
+            client.sendall(set_state(1, b'keep-alive')[40:])
+            poller.poll(1000)
+            head, _ = read_response(client)
+            assert head.startswith(b'HTTP/1.1 200 OK') and b'CONNECTION: keep-alive' in head
+
+            client.sendall(set_state(0))
+            poller.poll(1000)
+            head, _ = read_response(client)
+            assert b'CONNECTION: close' in head
+            assert client.recv(4096) == b''     # closed by the device
+            assert device.client_sockets == {}
+        finally:
+            client.close()
+        assert actions.join(timeout=1)
+
+    @pytest.mark.unit
+    def test_idle_connection_times_out(self, poller, device, monkeypatch):
+        monkeypatch.setattr(device.http, 'KEEPALIVE_TIMEOUT', 0.05)
+        client = socket.create_connection(('127.0.0.1', device.port))
+        try:
+            poller.poll(1000)       # accept
+            assert len(device.client_sockets) == 1
+            started = time.monotonic()
+            while device.client_sockets and time.monotonic() - started < 1:
+                poller.poll()
+            assert device.client_sockets == {}
+            assert client.recv(4096) == b''
+        finally:
+            client.close()
+
+    @pytest.mark.unit
+    def test_busy_connection_keeps_one_timer(self, poller, device):
+        client = socket.create_connection(('127.0.0.1', device.port))
+        try:
+            poller.poll(1000)       # accept
+            timers = len(poller.timers)
+            for _ in range(20):
+                client.sendall(get_state())
+                poller.poll(1000)
+                read_response(client)
+            assert len(poller.timers) == timers
+        finally:
+            client.close()
+
+    @pytest.mark.unit
+    def test_active_connection_outlives_timeout(self, poller, device, monkeypatch):
+        monkeypatch.setattr(device.http, 'KEEPALIVE_TIMEOUT', 0.2)
+        client = socket.create_connection(('127.0.0.1', device.port))
+        try:
+            poller.poll(1000)       # accept
+            time.sleep(0.15)
+            client.sendall(get_state())
+            poller.poll(1000)
+            read_response(client)
+            # the first timer finds the connection active and waits again
+            started = time.monotonic()
+            while time.monotonic() - started < 0.1:
+                poller.poll(10)
+            assert len(device.client_sockets) == 1
+            while device.client_sockets and time.monotonic() - started < 1:
+                poller.poll(10)
+            assert device.client_sockets == {}
+        finally:
+            client.close()
+
+    @pytest.mark.unit
+    def test_search_reply_is_prerendered(self, device, monkeypatch):
+        assert fauxmo.BELKIN_SEARCH_TARGET in device.search_templates
+        reply = RecordingSocket()
+        monkeypatch.setattr(fauxmo.upnp_device, 'reply_socket', reply)
+
+        device.respond_to_search(('10.0.0.5', 50000), fauxmo.BELKIN_SEARCH_TARGET)
+
+        data, destination = reply.sent[0]
+        assert destination == ('10.0.0.5', 50000)
+        assert b'GMT\r\nEXT:\r\n' in data
+        assert b'LOCATION: http://127.0.0.1:%d/setup.xml' % device.port in data
+        assert data.endswith(b'X-User-Agent: redsonic\r\n\r\n')
+
+
+def fetch(port, data):
+    client = socket.create_connection(('127.0.0.1', port))
+    try:
+        client.sendall(data)
+        return read_response(client)
+    finally:
+        client.close()
+
+
+def dated_search(device):
+    return fauxmo.dated(device.search_template(fauxmo.BELKIN_SEARCH_TARGET))
+
+
+class TestListenerPool:
+    """Test serving many devices from shared listeners."""
+
+    @pytest.fixture
+    def pool(self, poller):
+        pool = fauxmo.listener_pool(poller, '127.0.0.1', ports=(0, 0))
+        yield pool
+        pool.close()
+
+    @pytest.fixture
+    def overcommitted(self, poller):
+        pool = fauxmo.listener_pool(poller, '127.0.0.1', ports=(0, 0), overcommit=True)
+        yield pool
+        pool.close()
+
+    def make_devices(self, poller, pool, actions, count):
+        listener = fauxmo.upnp_broadcast_responder()
+        return [fauxmo.fauxmo('room %d' % i, listener, poller, '127.0.0.1', 0,
+                              action_handler=Handler(), actions=actions, http=pool)
+                for i in range(count)]
+
+    @pytest.mark.unit
+    def test_device_per_port(self, poller, pool, actions):
+        devices = self.make_devices(poller, pool, actions, 2)
+
+        assert [len(listener.devices) for listener in pool.listeners] == [1, 1]
+        assert len({device.port for device in devices}) == 2
+        assert devices[0].path_prefix == '/' + devices[0].persistent_uuid
+        location = b'LOCATION: http://127.0.0.1:%d/%s/setup.xml' % (
+            devices[0].port, devices[0].persistent_uuid.encode())
+        assert location in dated_search(devices[0])
+
+    @pytest.mark.unit
+    def test_overcommit_refused(self, poller, pool, actions):
+        self.make_devices(poller, pool, actions, 2)
+
+        with pytest.raises(ValueError, match='no free port'):
+            self.make_devices(poller, pool, actions, 1)
+        assert [len(listener.devices) for listener in pool.listeners] == [1, 1]
+
+    @pytest.mark.unit
+    def test_echo_reaches_every_device(self, poller, pool, actions, serve):
+        devices = self.make_devices(poller, pool, actions, 2)
+
+        # the Echo posts to the bare control path, not the controlURL
+        for device in devices:
+            assert fetch(device.port, set_state(1))[0].startswith(b'HTTP/1.1 200 OK')
+        assert actions.join(timeout=1)
+        assert [device.action_handler.calls for device in devices] == \
+            [[('on', 'room 0')], [('on', 'room 1')]]
+
+    @pytest.mark.unit
+    def test_overcommit_routes_by_path_prefix(self, poller, overcommitted, actions, serve):
+        devices = self.make_devices(poller, overcommitted, actions, 4)
+        assert [len(listener.devices) for listener in overcommitted.listeners] == [2, 2]
+
+        for device in devices:
+            head, body = fetch(device.port, b'GET %s/setup.xml HTTP/1.1\r\n\r\n'
+                               % device.path_prefix.encode())
+            assert b'<friendlyName>%s</friendlyName>' % device.name.encode() in body
+            assert b'<controlURL>%s/upnp/control/basicevent1</controlURL>' \
+                % device.path_prefix.encode() in body
+
+        post = set_state(1).replace(b'POST ', b'POST %s' % devices[3].path_prefix.encode())
+        head, _ = fetch(devices[3].port, post)
+        assert head.startswith(b'HTTP/1.1 200 OK')
+        assert actions.join(timeout=1)
+        assert devices[3].action_handler.calls == [('on', 'room 3')]
+        assert all(not device.action_handler.calls for device in devices[:3])
+
+        # a port shared by several devices can't tell which one the Echo means
+        head, _ = fetch(devices[0].port, set_state(1))
+        assert head.startswith(b'HTTP/1.1 404 Not Found')
+
+
+class FakeClient:
+    """Stands in for roomba.daemon.RobotClient."""
+
+    def __init__(self, sensors):
+        self.sensors = sensors
+        self.calls = []
+
+    def __call__(self, socket_path):
+        return self
+
+    def __enter__(self):
+        if self.sensors is None:
+            raise FileNotFoundError('roomba.sock')
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def call(self, *command):
+        self.calls.append(command)
+        return self.sensors
+
+
+
+class TestBinaryState:
+    """Test answering GetBinaryState from the state table."""
+
+    @pytest.mark.unit
+    def test_get_follows_set(self, device, actions):
+        def state():
+            response = device.handle_request(parse(get_state()), ('10.0.0.5', 1))
+            assert response.startswith(b'HTTP/1.1 200 OK')
+            return response.split(b'<BinaryState>')[1][:1]
+
+        assert state() == b'0'
+        device.handle_request(parse(set_state(1)), ('10.0.0.5', 1))
+        assert state() == b'1'
+        device.handle_request(parse(set_state(0)), ('10.0.0.5', 1))
+        assert state() == b'0'
+        assert actions.join(timeout=1)
+
+    @pytest.mark.unit
+    def test_get_does_not_run_handler(self, device, actions):
+        device.states.set('robot', 1)
+        for _ in range(100):
+            device.handle_request(parse(get_state()), ('10.0.0.5', 1))
+        assert actions.join(timeout=1)
+        assert device.action_handler.calls == []
+
+    @pytest.mark.unit
+    def test_set_reports_change(self):
+        states = fauxmo.state_table()
+        assert states.get('kitchen') == 0
+        assert states.set('kitchen', 1) is True
+        assert states.set('kitchen', 1) is False
+        assert states.get('kitchen') == 1
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize('sensors,state', [
+        ({'35': 0, '21': 0}, 0),        # OI off
+        ({'35': 1, '21': 2}, 0),        # docked and charging
+        ({'35': 1, '21': 0}, None),     # passive, maybe cleaning
+        ({'35': 2, '21': 0}, None),
+    ])
+    def test_telemetry_state(self, sensors, state):
+        assert fauxmo.robot_telemetry('robot', fauxmo.state_table()).robot_state(sensors) == state
+
+    @pytest.mark.unit
+    def test_telemetry_turns_docked_robot_off(self, monkeypatch):
+        states = fauxmo.state_table()
+        states.set('robot', 1)
+        client = FakeClient({'35': 1, '21': 2})
+        monkeypatch.setattr(fauxmo, 'RobotClient', client)
+
+        fauxmo.robot_telemetry('robot', states).poll()
+
+        assert client.calls == [('sensors', [35, 21])]
+        assert states.get('robot') == 0
+
+    @pytest.mark.unit
+    def test_telemetry_without_daemon(self, monkeypatch):
+        states = fauxmo.state_table()
+        states.set('robot', 1)
+        monkeypatch.setattr(fauxmo, 'RobotClient', FakeClient(None))
+        monkeypatch.setattr(fauxmo.create, 'Create', None)    # never opens the port
+
+        assert fauxmo.robot_telemetry('robot', states).poll() is None
+        assert states.get('robot') == 1
+
+
+class TestMetrics:
+    """Test the request timing histograms and the /metrics endpoint."""
+
+    @pytest.mark.unit
+    def test_histogram_buckets(self):
+        h = fauxmo.histogram(buckets=(0.001, 0.01))
+        for value in (0.0005, 0.001, 0.005, 3.0):
+            h.observe(value)
+
+        assert h.counts == [2, 1, 1]
+        assert h.count == 4
+        assert h.sum == pytest.approx(3.0065)
+
+    @pytest.mark.unit
+    def test_render(self):
+        m = fauxmo.metrics()
+        m.observe('fauxmo_request_seconds', 0.0003, device='say "hi"', action='on')
+        m.observe('fauxmo_request_seconds', 0.02, device='say "hi"', action='on')
+
+        lines = m.render().splitlines()
+        assert lines[0].startswith('# HELP fauxmo_request_seconds ')
+        assert lines[1] == '# TYPE fauxmo_request_seconds histogram'
+        labels = 'action="on",device="say \\"hi\\"'
+        assert 'fauxmo_request_seconds_bucket{%s",le="0.00025"} 0' % labels in lines
+        assert 'fauxmo_request_seconds_bucket{%s",le="0.0005"} 1' % labels in lines
+        assert 'fauxmo_request_seconds_bucket{%s",le="+Inf"} 2' % labels in lines
+        assert 'fauxmo_request_seconds_count{%s"} 2' % labels in lines
+        assert 'fauxmo_request_seconds_sum{%s"} 0.0203' % labels in lines
+
+    @pytest.mark.unit
+    def test_requests_and_actions_are_timed(self, poller, serve):
+        m = fauxmo.metrics()
+        actions = fauxmo.action_queue(window=0.01, metrics=m)
+        device = fauxmo.fauxmo('robot', fauxmo.upnp_broadcast_responder(), poller, '127.0.0.1', 0,
+                               action_handler=Handler(), actions=actions, states=fauxmo.state_table(),
+                               http=fauxmo.http_listener(poller, '127.0.0.1', metrics=m))
+        endpoint = fauxmo.metrics_device(fauxmo.http_listener(poller, '127.0.0.1'), metrics=m)
+        try:
+            fetch(device.port, b'GET /setup.xml HTTP/1.1\r\n\r\n')
+            fetch(device.port, set_state(1))
+            assert actions.join(timeout=1)
+            head, body = fetch(endpoint.port, b'GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n')
+        finally:
+            device.http.close()
+            endpoint.http.close()
+
+        assert head.startswith(b'HTTP/1.1 200 OK')
+        assert b'CONTENT-TYPE: text/plain; version=0.0.4' in head
+        text = body.decode()
+        for action in ('setup', 'on'):
+            assert 'fauxmo_request_seconds_count{action="%s",device="robot"} 1' % action in text
+            for stage in ('parse', 'handler', 'send'):
+                assert ('fauxmo_request_stage_seconds_count{action="%s",device="robot",stage="%s"} 1'
+                        % (action, stage)) in text
+        assert 'fauxmo_action_seconds_count{action="on",device="robot"} 1' in text
+
+    @pytest.mark.unit
+    def test_ssdp_reply_is_timed(self, device, monkeypatch):
+        m = fauxmo.metrics()
+        monkeypatch.setattr(device.http, 'metrics', m)
+        monkeypatch.setattr(fauxmo.upnp_device, 'reply_socket', RecordingSocket())
+
+        device.respond_to_search(('10.0.0.5', 50000), fauxmo.BELKIN_SEARCH_TARGET, time.monotonic() - 0.3)
+
+        h = m.histograms[('fauxmo_ssdp_reply_seconds', (('device', 'robot'),))]
+        assert h.count == 1 and h.sum == pytest.approx(0.3, abs=0.05)
+
+
+class TestSearchReplies:
+    """Test spreading SSDP replies over the search's MX window."""
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize('data,mx', [
+        (b'M-SEARCH * HTTP/1.1\r\nMX: 3\r\nST: ssdp:all\r\n\r\n', 3),
+        (b'M-SEARCH * HTTP/1.1\r\nmx:2\r\n\r\n', 2),
+        (b'M-SEARCH * HTTP/1.1\r\nMX: 120\r\n\r\n', fauxmo.MAX_MX),
+        (b'M-SEARCH * HTTP/1.1\r\n\r\n', fauxmo.DEFAULT_MX),
+    ])
+    def test_search_mx(self, data, mx):
+        assert fauxmo.search_mx(data) == mx
+
+    @pytest.mark.unit
+    def test_search_does_not_block_poller(self, poller, monkeypatch):
+        listener = fauxmo.upnp_broadcast_responder()
+        devices = [fauxmo.fauxmo('robot %d' % i, listener, poller, '127.0.0.1', 0, Handler())
+                   for i in range(10)]
+        reply = RecordingSocket()
+        monkeypatch.setattr(fauxmo.upnp_device, 'reply_socket', reply)
+        monkeypatch.setattr(fauxmo.random, 'uniform', lambda low, high: high / 10.0)
+        search = b'M-SEARCH * HTTP/1.1\r\nMX: 1\r\nST: urn:Belkin:device:**\r\n\r\n'
+        monkeypatch.setattr(listener, 'recvfrom', lambda size: (search, ('10.0.0.5', 50000)))
+
+        started = time.monotonic()
+        listener.do_read(None)
+        assert time.monotonic() - started < 0.05
+        assert reply.sent == []
+
+        while len(reply.sent) < 10 and time.monotonic() - started < 1:
+            poller.poll()
+        assert len(reply.sent) == 10
+        assert time.monotonic() - started == pytest.approx(0.1, abs=0.05)
+        for device in devices:
+            device.socket.close()
+
+
+class TestActionQueue:
+    """Test running handler actions off the request path."""
+
+    @pytest.mark.unit
+    def test_on_then_off_coalesces_to_off(self, actions):
+        handler = Handler()
+        actions.put(handler, True, '10.0.0.5', 'robot')
+        time.sleep(0.005)
+        actions.put(handler, False, '10.0.0.5', 'robot')
+
+        assert actions.join(timeout=1)
+        assert handler.calls == [('off', 'robot')]
+
+    @pytest.mark.unit
+    def test_spaced_actions_both_run(self, actions):
+        handler = Handler()
+        actions.put(handler, True, '10.0.0.5', 'robot')
+        time.sleep(0.05)
+        actions.put(handler, False, '10.0.0.5', 'robot')
+
+        assert actions.join(timeout=1)
+        assert handler.calls == [('on', 'robot'), ('off', 'robot')]
+
+    @pytest.mark.unit
+    def test_devices_sharing_a_handler_are_not_coalesced(self, actions):
+        handler = Handler()
+        actions.put(handler, True, '10.0.0.5', 'lights')
+        actions.put(handler, True, '10.0.0.5', 'lamp')
+
+        assert actions.join(timeout=1)
+        assert sorted(handler.calls) == [('on', 'lamp'), ('on', 'lights')]
+
+    @pytest.mark.unit
+    def test_actions_are_serialised(self, actions):
+        first, second = Handler(delay=0.05), Handler(delay=0.05)
+        actions.put(first, True, '10.0.0.5', 'one')
+        actions.put(second, True, '10.0.0.5', 'two')
+
+        assert actions.join(timeout=1)
+        assert first.calls == [('on', 'one')] and second.calls == [('on', 'two')]
+        # different handlers are not coalesced, but never run at once
+        assert first.spans[0][1] <= second.spans[0][0]
+
+    @pytest.mark.unit
+    def test_slow_handler_does_not_delay_reply(self, poller, actions):
+        handler = Handler(delay=0.3)
+        listener = fauxmo.upnp_broadcast_responder()
+        device = fauxmo.fauxmo('robot', listener, poller, '127.0.0.1', 0, handler, actions)
+        try:
+            started = time.monotonic()
+            assert device.handle_request(parse(set_state(1)), ('10.0.0.5', 1))
+            assert time.monotonic() - started < 0.05
+        finally:
+            actions.join(timeout=1)
+            device.socket.close()
+
+    @pytest.mark.unit
+    def test_robot_handler(self, monkeypatch):
+        commands = []
+        monkeypatch.setattr(fauxmo, 'robot_commands', lambda *c: commands.append(c))
+        robot = fauxmo.robot_handler()
+
+        assert robot.on('10.0.0.5', 'robot') and robot.off('10.0.0.5', 'robot')
+        # the jingle starts before CLEAN drops the robot to passive mode
+        assert commands[0] == (('safe',), ('play_jingle',), ('clean',))
+        assert commands[1][-1] == ('power',)
+
+    @pytest.mark.integration
+    def test_direct_robot_is_calibrated(self, fake_robot, tmp_path, monkeypatch):
+        from roomba.calibration import CalibrationResult, CalibrationStore
+
+        path = str(tmp_path / 'calibration.json')
+        CalibrationStore(path).save('stardust', 'carpet', CalibrationResult(240.0, 2.4, 0.80))
+        monkeypatch.setattr(fauxmo.config, 'CALIBRATION_FILE', path)
+        monkeypatch.setattr(fauxmo.config, 'ROBOT_ID', 'stardust')
+        monkeypatch.setattr(fauxmo.config, 'FLOOR_TYPE', 'carpet')
+        monkeypatch.setattr(fauxmo.config, 'ROBOT_SOCKET', str(tmp_path / 'no-daemon.sock'))
+        monkeypatch.setattr(fauxmo.create, 'Create', lambda *args: fake_robot)
+
+        # no daemon, so the robot is opened directly
+        assert fauxmo.robot_commands(('ping',)) == ['pong']
+        assert (fake_robot.wheelSpan, fake_robot.tickPerMM, fake_robot.angularError) == \
+            (240.0, 2.4, 0.80)
@@ -0,0 +1,235 @@
+"""
+Tests for fauxmo_async.py.
+
+Runs virtual switches on 127.0.0.1 inside asyncio.run() and talks to them
+over real sockets; SSDP replies go to a recording transport.
+"""
+
+import asyncio
+import re
+import time
+import pytest
+
+import fauxmo
+import fauxmo_async
+from fauxmo_async import AsyncFauxmo, SSDPResponder, start
+
+SET_STATE = ('POST /upnp/control/basicevent1 HTTP/1.1\r\n'
+             'SOAPACTION: "urn:Belkin:service:basicevent:1#SetBinaryState"\r\n'
+             'Connection: %s\r\n'
+             'Content-Length: %d\r\n\r\n%s')
+
+GET_STATE = (b'POST /upnp/control/basicevent1 HTTP/1.1\r\n'
+             b'SOAPACTION: "urn:Belkin:service:basicevent:1#GetBinaryState"\r\n'
+             b'Content-Length: 0\r\n\r\n')
+
+CONTENT_LENGTH = re.compile(rb'^content-length:\s*(\d+)', re.IGNORECASE | re.MULTILINE)
+
+
+def set_state(state, connection='close'):
+    body = '<BinaryState>%d</BinaryState>' % state
+    return (SET_STATE % (connection, len(body), body)).encode()
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = int(CONTENT_LENGTH.search(head).group(1))
+    return head + await reader.readexactly(length)
+
+
+async def request(device, data):
+    """Send one request and read its response."""
+    reader, writer = await asyncio.open_connection(device.ip_address, device.port)
+    try:
+        writer.write(data)
+        await writer.drain()
+        return await read_response(reader)
+    finally:
+        writer.close()
+
+
+class AsyncHandler:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.calls = []
+
+    async def on(self, client_address, name):
+        await asyncio.sleep(self.delay)
+        self.calls.append(('on', client_address, name))
+        return True
+
+    async def off(self, client_address, name):
+        self.calls.append(('off', client_address, name))
+        return True
+
+
+class SlowHandler:
+    """A blocking handler written for fauxmo.py."""
+
+    def on(self, client_address, name):
+        time.sleep(0.5)
+        return True
+
+    def off(self, client_address, name):
+        return True
+
+
+class RecordingTransport:
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, addr):
+        self.sent.append((data, addr))
+
+    def close(self):
+        pass
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def with_device(handler, scenario, states=None):
+    device = AsyncFauxmo('robot', handler, 0, '127.0.0.1', states=states or fauxmo.state_table())
+    await device.start()
+    try:
+        return await scenario(device)
+    finally:
+        await device.stop()
+
+
+class TestAsyncFauxmo:
+    """Test the per-device HTTP endpoint."""
+
+    @pytest.mark.unit
+    def test_setup_xml(self):
+        async def scenario(device):
+            return await request(device, b'GET /setup.xml HTTP/1.1\r\nHost: x\r\n\r\n')
+
+        response = run(with_device(AsyncHandler(), scenario))
+        assert response.startswith(b'HTTP/1.1 200 OK\r\n')
+        assert b'<friendlyName>robot</friendlyName>' in response
+
+    @pytest.mark.unit
+    def test_async_handler_on_off(self):
+        handler = AsyncHandler()
+
+        async def scenario(device):
+            responses = [await request(device, set_state(1)),
+                         await request(device, set_state(0))]
+            await device.join()
+            return responses
+
+        on, off = run(with_device(handler, scenario))
+        assert on.startswith(b'HTTP/1.1 200 OK') and off.startswith(b'HTTP/1.1 200 OK')
+        assert [(call, name) for call, _, name in handler.calls] == [('on', 'robot'), ('off', 'robot')]
+        assert handler.calls[0][1] == '127.0.0.1'
+
+    @pytest.mark.unit
+    def test_reply_before_slow_handler(self):
+        async def scenario(device):
+            started = time.monotonic()
+            response = await request(device, set_state(1))
+            elapsed = time.monotonic() - started
+            await device.join()
+            return response, elapsed
+
+        response, elapsed = run(with_device(SlowHandler(), scenario))
+        assert response.startswith(b'HTTP/1.1 200 OK')
+        assert elapsed < 0.2
+
+    @pytest.mark.unit
+    def test_actions_run_in_order(self):
+        handler = AsyncHandler(delay=0.1)
+
+        async def scenario(device):
+            await request(device, set_state(1))
+            await request(device, set_state(0))
+            await device.join()
+
+        run(with_device(handler, scenario))
+        assert [call for call, _, _ in handler.calls] == ['on', 'off']
+
+    @pytest.mark.unit
+    def test_keep_alive_and_get_state(self):
+        states = fauxmo.state_table()
+
+        async def scenario(device):
+            reader, writer = await asyncio.open_connection(device.ip_address, device.port)
+            try:
+                responses = []
+                for data in (GET_STATE, set_state(1, 'keep-alive'), GET_STATE):
+                    writer.write(data)
+                    await writer.drain()
+                    responses.append(await read_response(reader))
+                await device.join()
+                return responses
+            finally:
+                writer.close()
+
+        before, on, after = run(with_device(AsyncHandler(), scenario, states))
+        assert b'<BinaryState>0</BinaryState>' in before
+        assert b'CONNECTION: keep-alive' in on
+        assert b'<BinaryState>1</BinaryState>' in after
+        assert states.get('robot') == 1
+
+    @pytest.mark.unit
+    def test_bad_requests(self):
+        async def scenario(device):
+            return [await request(device, b'NONSENSE\r\n\r\n'),
+                    await request(device, set_state(2)),
+                    await request(device, b'GET /other HTTP/1.1\r\n\r\n')]
+
+        bad, unknown_state, missing = run(with_device(AsyncHandler(), scenario))
+        assert bad.startswith(b'HTTP/1.1 400 Bad Request')
+        assert unknown_state.startswith(b'HTTP/1.1 400 Bad Request')
+        assert missing.startswith(b'HTTP/1.1 404 Not Found')
+
+    @pytest.mark.unit
+    def test_slow_handler_does_not_block_other_devices(self):
+        async def scenario():
+            devices, _ = await start([('slow', SlowHandler(), 0), ('fast', AsyncHandler(), 0)],
+                                     '127.0.0.1', responder=SSDPResponder())
+            try:
+                await request(devices[0], set_state(1))
+                started = time.monotonic()
+                await request(devices[1], b'GET /setup.xml HTTP/1.1\r\n\r\n')
+                fast_elapsed = time.monotonic() - started
+                await devices[0].join()
+                return fast_elapsed
+            finally:
+                for device in devices:
+                    await device.stop()
+
+        assert run(scenario()) < 0.2
+
+
+class TestSSDPResponder:
+    """Test answering WeMo discovery searches."""
+
+    @pytest.mark.unit
+    def test_replies_for_each_device(self, monkeypatch):
+        delays = []
+        monkeypatch.setattr(fauxmo_async.random, 'uniform',
+                            lambda low, high: delays.append((low, high)) or 0.01)
+
+        async def scenario():
+            responder = SSDPResponder()
+            transport = RecordingTransport()
+            responder.connection_made(transport)
+            for name in ('one', 'two'):
+                responder.add_device(AsyncFauxmo(name, AsyncHandler(), 52000, '127.0.0.1'))
+
+            responder.datagram_received(b'M-SEARCH * HTTP/1.1\r\nMX: 3\r\n'
+                                        b'ST: urn:Belkin:device:**\r\n\r\n', ('10.0.0.5', 50000))
+            responder.datagram_received(b'M-SEARCH * HTTP/1.1\r\nST: ssdp:all\r\n\r\n',
+                                        ('10.0.0.5', 50000))
+            await asyncio.sleep(0.05)
+            return transport.sent
+
+        sent = run(scenario())
+        assert len(sent) == 2
+        assert delays == [(0, 3), (0, 3)]
+        assert all(addr == ('10.0.0.5', 50000) for _, addr in sent)
+        assert b'LOCATION: http://127.0.0.1:52000/setup.xml' in sent[0][0]
+        assert b'ST: urn:Belkin:device:**' in sent[1][0]
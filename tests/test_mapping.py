@@ -0,0 +1,151 @@
+"""
+Unit tests for roomba.mapping module.
+
+Tests incremental sweeping, obstacle marking, coverage and frontiers.
+"""
+
+import math
+import pytest
+from unittest.mock import Mock
+
+np = pytest.importorskip('numpy')
+
+from roomba.mapping import CoverageGrid, UNKNOWN, SWEPT, OBSTACLE  # noqa: E402
+from roomba.sensors import (  # noqa: E402
+    LEFT_BUMP, RIGHT_BUMP, CLIFF_FRONT_LEFT, LIGHTBUMP
+)
+
+
+@pytest.fixture
+def grid():
+    """A 2 m x 2 m grid at 50 mm resolution centred on the origin."""
+    return CoverageGrid(width_mm=2000, height_mm=2000, resolution_mm=50)
+
+
+class TestCoordinates:
+    """Test world <-> cell conversion."""
+
+    @pytest.mark.unit
+    def test_origin_is_centre(self, grid):
+        assert grid.to_cell(0, 0) == (20, 20)
+
+    @pytest.mark.unit
+    def test_round_trip(self, grid):
+        x, y = grid.to_world(*grid.to_cell(130, -420))
+        assert abs(x - 130) <= 25 and abs(y + 420) <= 25
+
+    @pytest.mark.unit
+    def test_outside_is_obstacle(self, grid):
+        assert grid.state_at(5000, 0) == OBSTACLE
+
+
+class TestSweep:
+    """Test footprint sweeping along the path."""
+
+    @pytest.mark.unit
+    def test_first_pose_sweeps_footprint(self, grid):
+        added = grid.update_pose(0, 0, 0)
+        assert added > 0
+        assert grid.state_at(0, 0) == SWEPT
+        assert grid.state_at(0, 300) == UNKNOWN
+
+    @pytest.mark.unit
+    def test_path_is_swept(self, grid):
+        grid.update_pose(0, 0, 0)
+        grid.update_pose(600, 0, 0)
+        for x in range(0, 601, 50):
+            assert grid.state_at(x, 0) == SWEPT
+        assert grid.state_at(300, 100) == SWEPT
+        assert grid.state_at(300, 250) == UNKNOWN
+
+    @pytest.mark.unit
+    def test_revisit_adds_nothing(self, grid):
+        grid.update_pose(0, 0, 0)
+        grid.update_pose(400, 0, 0)
+        before = grid.swept_count
+        assert grid.update_pose(0, 0, math.pi) == 0
+        assert grid.swept_count == before
+        row, col = grid.to_cell(200, 0)
+        assert grid.visits[row, col] == 2
+
+    @pytest.mark.unit
+    def test_swept_count_matches_grid(self, grid):
+        grid.update_pose(-500, -500, 0)
+        grid.update_pose(500, 300, 0)
+        assert grid.swept_count == int((grid.cells == SWEPT).sum())
+
+
+class TestObstacles:
+    """Test bump, cliff and light bump marking."""
+
+    @pytest.mark.unit
+    def test_front_bump(self, grid):
+        grid.mark_bumps((0, 0, 0), True, True)
+        assert grid.state_at(195, 0) == OBSTACLE
+
+    @pytest.mark.unit
+    def test_left_bump_uses_heading(self, grid):
+        grid.mark_bumps((0, 0, math.pi / 2), True, False)
+        x = 195 * math.cos(math.pi / 2 + math.radians(45))
+        y = 195 * math.sin(math.pi / 2 + math.radians(45))
+        assert grid.state_at(x, y) == OBSTACLE
+
+    @pytest.mark.unit
+    def test_obstacle_replaces_swept(self, grid):
+        grid.update_pose(0, 0, 0)
+        before = grid.swept_count
+        grid.mark_obstacle(0, 0)
+        assert grid.swept_count == before - 1
+        assert grid.obstacle_count == 1
+
+    @pytest.mark.unit
+    def test_cliff_and_light_bump(self, grid):
+        grid.mark_cliffs((0, 0, 0), {CLIFF_FRONT_LEFT: 1})
+        grid.mark_light_bumps((0, 0, 0), 0b001100)
+        assert grid.obstacle_count == 3
+
+    @pytest.mark.integration
+    def test_update_from_robot(self, grid):
+        robot = Mock()
+        robot.getPose = Mock(return_value=(0.0, 0.0, 0.0))
+        robot.sensord = {LEFT_BUMP: 1, RIGHT_BUMP: 1, LIGHTBUMP: 0}
+
+        grid.update_from_robot(robot)
+
+        robot.getPose.assert_called_once_with(dist='mm', angle='rad')
+        assert grid.state_at(0, 0) == SWEPT
+        assert grid.obstacle_count == 1
+
+
+class TestCoverage:
+    """Test coverage percentage and frontier detection."""
+
+    @pytest.mark.unit
+    def test_empty_grid(self, grid):
+        assert grid.coverage_percentage() == 0.0
+        assert len(grid.frontier_cells()) == 0
+        assert grid.nearest_frontier(0, 0) is None
+
+    @pytest.mark.unit
+    def test_coverage_grows(self, grid):
+        grid.update_pose(0, 0, 0)
+        first = grid.coverage_percentage()
+        grid.update_pose(800, 0, 0)
+        assert grid.coverage_percentage() > first > 0
+
+    @pytest.mark.unit
+    def test_frontier_borders_unknown(self, grid):
+        grid.update_pose(0, 0, 0)
+        frontier = grid.frontier_cells()
+        assert len(frontier) > 0
+        for row, col in frontier:
+            assert grid.cells[row, col] == SWEPT
+        # the robot's own cell is surrounded by swept floor
+        assert list(grid.to_cell(0, 0)) not in frontier.tolist()
+
+    @pytest.mark.unit
+    def test_nearest_frontier(self, grid):
+        grid.update_pose(-600, 0, 0)
+        grid.update_pose(600, 0, 0)
+        x, y = grid.nearest_frontier(700, 0)
+        assert x > 600
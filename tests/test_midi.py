@@ -0,0 +1,148 @@
+"""
+Unit tests for roomba.midi module.
+
+Builds small Standard MIDI Files in memory and checks the melody that
+notes() streams out of them.
+"""
+
+import io
+import struct
+import pytest
+from roomba.midi import MidiFile, fit_pitch, play_midi
+from roomba.music import REST
+from roomba.songs import split_melody
+
+TEMPO_120 = 500000
+TEMPO_60 = 1000000
+
+
+def varlen(value):
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.insert(0, (value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(data)
+
+
+def track(*events):
+    """MTrk chunk from (delta, bytes) events, with an end-of-track added."""
+    body = b''.join(varlen(delta) + data for delta, data in events)
+    body += varlen(0) + b'\xFF\x2F\x00'
+    return b'MTrk' + struct.pack('>I', len(body)) + body
+
+
+def tempo(value):
+    return b'\xFF\x51\x03' + value.to_bytes(3, 'big')
+
+
+def smf(*tracks, fmt=0, division=96):
+    header = b'MThd' + struct.pack('>IHHH', 6, fmt, len(tracks), division)
+    return io.BytesIO(header + b''.join(tracks))
+
+
+def on(note, channel=0, velocity=100):
+    return bytes([0x90 | channel, note, velocity])
+
+
+def off(note, channel=0):
+    return bytes([0x80 | channel, note, 0])
+
+
+class TestFitPitch:
+    """Test folding MIDI pitches onto the OI note range."""
+
+    @pytest.mark.unit
+    def test_in_range_unchanged(self):
+        assert fit_pitch(60) == 60
+
+    @pytest.mark.unit
+    def test_octaves(self):
+        assert fit_pitch(24) == 36
+        assert fit_pitch(0) == 36
+        assert fit_pitch(31) == 31
+
+
+class TestMidiFile:
+    """Test header parsing and note streaming."""
+
+    @pytest.mark.unit
+    def test_format0_quarter_notes(self):
+        # 96 ticks per quarter at 120 bpm: a quarter is 0.5 s = 32/64
+        midi = MidiFile(smf(track((0, on(60)), (96, off(60)), (0, on(62)), (96, off(62)))))
+        assert midi.format == 0
+        assert list(midi.notes()) == [(60, 32), (62, 32)]
+
+    @pytest.mark.unit
+    def test_running_status_and_zero_velocity_off(self):
+        data = track((0, on(60)), (48, b'\x3C\x00'), (48, b'\x3E\x64'), (96, b'\x3E\x00'))
+        assert list(MidiFile(smf(data)).notes()) == [(60, 16), (REST, 16), (62, 32)]
+
+    @pytest.mark.unit
+    def test_overlapping_notes_are_monophonic(self):
+        data = track((0, on(60)), (48, on(64)), (48, off(60)), (48, off(64)))
+        assert list(MidiFile(smf(data)).notes()) == [(60, 16), (64, 32)]
+
+    @pytest.mark.unit
+    def test_format1_tempo_track(self):
+        tempo_track = track((0, tempo(TEMPO_120)), (192, tempo(TEMPO_60)))
+        notes = track((0, on(60)), (192, off(60)), (0, on(60)), (96, off(60)))
+        midi = MidiFile(smf(tempo_track, notes, fmt=1))
+
+        assert midi.first_note_track() == 1
+        assert list(midi.notes()) == [(60, 64), (60, 64)]
+
+    @pytest.mark.unit
+    def test_tempo_change_in_format0(self):
+        data = track((0, tempo(TEMPO_60)), (0, on(60)), (96, off(60)))
+        assert list(MidiFile(smf(data)).notes()) == [(60, 64)]
+
+    @pytest.mark.unit
+    def test_quantisation_does_not_drift(self):
+        # 1 tick is 1/3 of 1/64 s: single notes round, the total must not drift
+        events = []
+        for _ in range(30):
+            events += [(0, on(60)), (1, off(60))]
+        data = track(*events)
+        notes = list(MidiFile(smf(data, division=96)).notes())
+        assert sum(duration for _, duration in notes) == 10
+
+    @pytest.mark.unit
+    def test_channel_filter_and_low_pitch(self):
+        data = track((0, on(20, channel=9)), (0, on(30, channel=1)), (96, off(30, channel=1)),
+                     (0, off(20, channel=9)))
+        assert list(MidiFile(smf(data)).notes(channel=1)) == [(42, 32)]
+
+    @pytest.mark.unit
+    def test_notes_are_lazy(self):
+        events = [(0, on(60)), (96, off(60))] * 5000
+        stream = smf(track(*events))
+        size = len(stream.getvalue())
+
+        notes = MidiFile(stream).notes(track=0)
+        assert next(notes) == (60, 32)
+        # only the first block of the track has been read
+        assert stream.tell() < size // 4
+        assert split_melody(notes, max_notes=4)[0] == [(60, 32)] * 4
+
+    @pytest.mark.unit
+    def test_not_a_midi_file(self):
+        with pytest.raises(ValueError):
+            MidiFile(io.BytesIO(b'RIFF' + bytes(10)))
+
+
+class TestPlayMidi:
+    """Test playing a file through the song slots."""
+
+    @pytest.mark.integration
+    def test_streams_through_slots(self, fake_robot, fake_oi_serial, tmp_path):
+        events = []
+        for i in range(20):
+            events += [(0, on(60 + i)), (3, off(60 + i))]
+        path = tmp_path / 'scale.mid'
+        path.write_bytes(smf(track(*events)).getvalue())
+
+        play_midi(fake_robot, str(path), slots=(0, 1))
+
+        assert [slot for slot, _ in fake_oi_serial.plays] == [0, 1]
+        assert fake_oi_serial.songs[1] == [(60 + i, 1) for i in range(16, 20)]
@@ -0,0 +1,258 @@
+"""
+Integration tests for Create against a fake Open Interface robot.
+
+Unlike test_create.py, which checks individual writes on a Mock, these
+tests run Create against FakeOISerial (see conftest.py), which parses the
+byte stream and answers sensor queries the way the robot would.
+"""
+
+import time
+import pytest
+from roomba import Create, PASSIVE_MODE, SAFE_MODE, FULL_MODE
+from create import MODE_RESEND_INTERVAL
+from roomba.sensors import CLIFF_LEFT, OI_MODE
+
+START_OP, SAFE_OP, FULL_OP, DRIVE_OP = 128, 131, 132, 137
+SONG_OP, PLAY_OP, SENSORS_OP, QUERYLIST_OP = 140, 141, 142, 149
+
+
+class TestModeHandshake:
+    """Test handshake-confirmed mode changes."""
+
+    @pytest.mark.integration
+    def test_constructor_confirms_safe_mode(self, fake_oi_serial, monkeypatch):
+        monkeypatch.setattr('serial.Serial', lambda *args, **kwargs: fake_oi_serial)
+
+        started = time.monotonic()
+        robot = Create('/dev/ttyUSB0', startingMode=SAFE_MODE)
+        elapsed = time.monotonic() - started
+
+        assert fake_oi_serial.mode == SAFE_MODE
+        assert robot.getMode() == SAFE_MODE
+        # no fixed sleeps: construction takes a couple of round trips
+        assert elapsed < 0.2
+
+    @pytest.mark.integration
+    def test_constructor_full_mode_skips_safe(self, fake_oi_serial, monkeypatch):
+        monkeypatch.setattr('serial.Serial', lambda *args, **kwargs: fake_oi_serial)
+
+        Create('/dev/ttyUSB0', startingMode=FULL_MODE)
+
+        opcodes = [op for op, _ in fake_oi_serial.commands if op != QUERYLIST_OP]
+        assert opcodes == [START_OP, FULL_OP]
+        assert fake_oi_serial.mode == FULL_MODE
+
+    @pytest.mark.integration
+    def test_polls_until_mode_reported(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.mode_lag = 3
+
+        assert fake_robot.toFullMode() is True
+
+        assert fake_robot.getMode() == FULL_MODE
+        # FULL goes straight from SAFE and is confirmed after the lag
+        assert len(fake_oi_serial.sent(QUERYLIST_OP)) == 4
+
+    @pytest.mark.integration
+    def test_gives_up_at_deadline(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.mode = PASSIVE_MODE
+        fake_oi_serial.mode_lag = 10 ** 6
+
+        started = time.monotonic()
+        confirmed = fake_robot._changeMode(bytes([SAFE_OP]), SAFE_MODE, timeout=0.05)
+
+        assert confirmed is False
+        assert time.monotonic() - started < 0.5
+        # the serial timeout is restored after polling
+        assert fake_oi_serial.timeout == 0.5
+
+    @pytest.mark.integration
+    def test_resends_lost_command(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.mode = PASSIVE_MODE
+        fake_oi_serial.lost_modes = 2
+
+        assert fake_robot._changeMode(bytes([SAFE_OP]), SAFE_MODE) is True
+
+        assert fake_oi_serial.mode == SAFE_MODE
+        assert fake_oi_serial.sent(SAFE_OP) == [[]]
+
+    @pytest.mark.integration
+    def test_asleep_robot_gets_command_again(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.reboot()
+        fake_oi_serial.lost_modes = 1
+
+        # the lost START leaves the robot silent, so it is resent at once
+        started = time.monotonic()
+        assert fake_robot._changeMode(bytes([START_OP]), PASSIVE_MODE) is True
+        assert time.monotonic() - started < MODE_RESEND_INTERVAL
+
+    @pytest.mark.integration
+    def test_query_mode(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.mode = PASSIVE_MODE
+        assert fake_robot._queryMode() == PASSIVE_MODE
+
+
+class TestModeManager:
+    """Test tracking of the confirmed mode and skipped transitions."""
+
+    @pytest.mark.integration
+    def test_redundant_transition_is_skipped(self, fake_robot, fake_oi_serial):
+        assert fake_robot.toSafeMode() is True
+        assert fake_oi_serial.commands == []
+
+    @pytest.mark.integration
+    def test_safe_to_full_skips_start(self, fake_robot, fake_oi_serial):
+        fake_robot.toFullMode()
+        opcodes = [op for op, _ in fake_oi_serial.commands if op != QUERYLIST_OP]
+        assert opcodes == [FULL_OP]
+
+    @pytest.mark.integration
+    def test_stale_mode_is_verified(self, fake_robot, fake_oi_serial):
+        fake_robot._modeConfirmedAt -= 60
+
+        assert fake_robot.toSafeMode() is True
+
+        # one OI_MODE query, no mode commands
+        assert [op for op, _ in fake_oi_serial.commands] == [QUERYLIST_OP]
+
+    @pytest.mark.integration
+    def test_cliff_forces_verification(self, fake_robot, fake_oi_serial):
+        # the robot fell back to passive on a cliff
+        fake_oi_serial.mode = PASSIVE_MODE
+        fake_oi_serial.packets[CLIFF_LEFT] = 1
+        fake_robot.sensors([CLIFF_LEFT])
+        fake_oi_serial.commands.clear()
+
+        assert fake_robot.toSafeMode() is True
+
+        assert fake_oi_serial.mode == SAFE_MODE
+        assert fake_oi_serial.sent(SAFE_OP) == [[]]
+        assert fake_oi_serial.sent(START_OP) == []
+
+    @pytest.mark.integration
+    def test_oi_mode_packet_confirms_mode(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.mode = FULL_MODE
+        fake_robot.sensors([OI_MODE])
+        fake_oi_serial.commands.clear()
+
+        assert fake_robot.getMode() == FULL_MODE
+        assert fake_robot.toFullMode() is True
+        assert fake_oi_serial.commands == []
+
+
+class TestScriptCompletion:
+    """Test probing for the end of an OI script."""
+
+    @pytest.mark.integration
+    def test_move_returns_on_first_answered_probe(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.script_polls = 3
+
+        started = time.monotonic()
+        fake_robot.move(10)
+
+        # three ignored probes, the fourth is answered
+        assert len(fake_oi_serial.sent(SENSORS_OP)) == 4
+        assert time.monotonic() - started < 0.5
+
+    @pytest.mark.integration
+    def test_timeout(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.script_polls = 10 ** 6
+
+        started = time.monotonic()
+        assert fake_robot._endScript(timeout=0.1) is False
+        assert time.monotonic() - started < 0.5
+        assert fake_oi_serial.timeout == 0.5
+
+    @pytest.mark.integration
+    def test_async_returns_future(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.script_polls = 2
+
+        future = fake_robot.turn(90, wait=False)
+
+        assert future.result(timeout=2) is True
+        assert len(fake_oi_serial.sent(SENSORS_OP)) == 3
+
+
+class TestAsyncMotion:
+    """Test host-driven, cancellable moveAsync/turnAsync."""
+
+    @staticmethod
+    def last_drive(fake_oi_serial):
+        return fake_oi_serial.sent(DRIVE_OP)[-1]
+
+    @pytest.mark.integration
+    def test_move_async_completes(self, fake_robot, fake_oi_serial):
+        future = fake_robot.moveAsync(10, 20)
+
+        assert future.result(timeout=2) >= 10
+        # stopped: zero velocity
+        assert self.last_drive(fake_oi_serial)[:2] == [0, 0]
+
+    @pytest.mark.integration
+    def test_cancel_stops_robot(self, fake_robot, fake_oi_serial):
+        future = fake_robot.moveAsync(1000, 10)
+        time.sleep(0.1)
+
+        assert future.cancel() is True
+
+        deadline = time.monotonic() + 1
+        while self.last_drive(fake_oi_serial)[:2] != [0, 0]:
+            assert time.monotonic() < deadline, 'robot was not stopped'
+            time.sleep(0.01)
+        assert future.cancelled()
+
+    @pytest.mark.integration
+    def test_caller_reads_sensors_while_turning(self, fake_robot, fake_oi_serial):
+        future = fake_robot.turnAsync(90, 90)
+        reads = 0
+        while not future.done():
+            fake_robot.sensors([CLIFF_LEFT])
+            reads += 1
+
+        assert future.result() >= 90
+        assert reads > 0
+
+
+class TestSongCache:
+    """Test the song slot cache behind playSong/setSong."""
+
+    JINGLE = [(72, 8), (76, 8), (79, 16)]
+
+    @pytest.mark.integration
+    def test_repeat_jingle_is_only_play(self, fake_robot, fake_oi_serial):
+        fake_robot.playSong(self.JINGLE)
+        fake_robot.playSong(list(self.JINGLE))
+
+        assert len(fake_oi_serial.sent(SONG_OP)) == 1
+        assert len(fake_oi_serial.sent(PLAY_OP)) == 2
+
+    @pytest.mark.integration
+    def test_upload_is_one_write(self, fake_robot, fake_oi_serial, monkeypatch):
+        writes = []
+        write = fake_oi_serial.write
+        monkeypatch.setattr(fake_oi_serial, 'write', lambda data: writes.append(data) or write(data))
+
+        fake_robot.setSong(2, self.JINGLE)
+
+        assert writes == [bytes([SONG_OP, 2, 3, 72, 8, 76, 8, 79, 16])]
+
+    @pytest.mark.integration
+    def test_least_recently_used_slot_is_evicted(self, fake_robot, fake_oi_serial):
+        songs = [[(60 + i, 8)] for i in range(5)]
+        for song in songs[:4]:
+            fake_robot.playSong(song)
+        fake_robot.playSong(songs[0])       # slot 0 is now most recent
+
+        fake_robot.playSong(songs[4])
+
+        # songs[1] (slot 1) was least recently used
+        assert fake_oi_serial.sent(SONG_OP)[-1][:2] == [1, 1]
+        fake_oi_serial.commands.clear()
+        fake_robot.playSong(songs[0])
+        assert fake_oi_serial.sent(SONG_OP) == []
+
+    @pytest.mark.integration
+    def test_power_forgets_songs(self, fake_robot, fake_oi_serial):
+        fake_robot.playSong(self.JINGLE)
+        fake_robot.power()
+        fake_robot.playSong(self.JINGLE)
+        assert len(fake_oi_serial.sent(SONG_OP)) == 2
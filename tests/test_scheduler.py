@@ -0,0 +1,162 @@
+"""
+Unit tests for roomba.scheduler module.
+
+Tests deadline ordering, cancellation, errors and shutdown of the
+music cue scheduler, and background music on a Create.
+"""
+
+import time
+import pytest
+from roomba.scheduler import MusicScheduler
+
+DRIVE_OP, CLEAN_OP, PLAY_OP, SONG_OP, SCRIPT_OP = 137, 135, 141, 140, 152
+
+
+def recorder(log, name, delays):
+    """Cue that records when each of its steps runs."""
+    for delay in delays:
+        log.append((name, time.monotonic()))
+        yield delay
+    log.append((name, time.monotonic()))
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = MusicScheduler()
+    yield scheduler
+    scheduler.stop()
+
+
+class TestMusicScheduler:
+    """Test running cues at their deadlines."""
+
+    @pytest.mark.unit
+    def test_cues_interleave_by_deadline(self, scheduler):
+        log = []
+        a = scheduler.schedule(recorder(log, 'a', [0.06, 0.06]))
+        b = scheduler.schedule(recorder(log, 'b', [0.04]), delay=0.03)
+
+        assert a.result(timeout=2) is None
+        assert b.result(timeout=2) is None
+        assert [name for name, _ in log] == ['a', 'b', 'a', 'b', 'a']
+
+    @pytest.mark.unit
+    def test_steps_run_on_time(self, scheduler):
+        log = []
+        started = time.monotonic()
+        scheduler.schedule(recorder(log, 'a', [0.05] * 4)).result(timeout=2)
+
+        times = [t - started for _, t in log]
+        for step, elapsed in enumerate(times):
+            assert elapsed == pytest.approx(0.05 * step, abs=0.03)
+
+    @pytest.mark.unit
+    def test_schedule_does_not_block(self, scheduler):
+        started = time.monotonic()
+        future = scheduler.schedule(recorder([], 'a', [0.3]))
+        assert time.monotonic() - started < 0.05
+        assert not future.done()
+        assert scheduler.join(timeout=2)
+
+    @pytest.mark.unit
+    def test_cancel(self, scheduler):
+        log = []
+        future = scheduler.schedule(recorder(log, 'a', [0.2, 0.2]))
+        time.sleep(0.05)
+
+        assert future.cancel()
+        assert scheduler.join(timeout=0.1)
+        time.sleep(0.25)
+        assert len(log) == 1
+
+    @pytest.mark.unit
+    def test_cue_error_sets_exception(self, scheduler):
+        def broken():
+            yield 0.01
+            raise RuntimeError('serial port gone')
+
+        future = scheduler.schedule(broken())
+        with pytest.raises(RuntimeError):
+            future.result(timeout=2)
+        # the scheduler keeps running other cues
+        assert scheduler.schedule(recorder([], 'a', [0.01])).result(timeout=2) is None
+
+    @pytest.mark.unit
+    def test_stop_cancels_pending(self):
+        scheduler = MusicScheduler()
+        future = scheduler.schedule(recorder([], 'a', [5.0]))
+        time.sleep(0.02)
+
+        scheduler.stop()
+
+        assert future.cancelled()
+        assert scheduler.join(timeout=0)
+
+
+class TestBackgroundMusic:
+    """Test Create.playMelody(wait=False) alongside motion."""
+
+    @pytest.mark.integration
+    def test_motion_starts_during_playback(self, fake_robot, fake_oi_serial):
+        melody = [(60 + i, 4) for i in range(40)]     # 2.5 s
+
+        started = time.monotonic()
+        song = fake_robot.playMelody(melody, wait=False)
+        fake_robot.go(10, 0)
+        drove = time.monotonic() - started
+
+        assert drove < 0.5
+        assert fake_oi_serial.sent(DRIVE_OP)
+        assert not song.done()
+        assert fake_robot.waitForMusic(timeout=5)
+        assert [slot for slot, _ in fake_oi_serial.plays] == [0, 1, 2]
+        assert fake_oi_serial.ignored_plays == 0
+
+    @pytest.mark.integration
+    def test_play_starwars_background(self, fake_robot, fake_oi_serial):
+        song = fake_robot.play_starwars(wait=False)
+        time.sleep(0.1)
+        assert fake_oi_serial.plays
+        song.cancel()
+        assert fake_robot.waitForMusic(timeout=1)
+
+    @pytest.mark.integration
+    def test_clean_waits_for_background_music(self, fake_robot, fake_oi_serial):
+        melody = [(60 + i, 4) for i in range(20)]     # 1.25 s, two chunks
+        fake_robot.playMelody(melody, wait=False)
+        fake_robot.clean()
+
+        # PLAY is ignored in passive mode, so every chunk goes before CLEAN
+        ops = [op for op, _ in fake_oi_serial.commands if op in (PLAY_OP, CLEAN_OP)]
+        assert ops == [PLAY_OP, PLAY_OP, CLEAN_OP]
+        assert fake_oi_serial.ignored_plays == 0
+
+    @pytest.mark.integration
+    def test_music_does_not_split_script_upload(self, fake_robot, fake_oi_serial, monkeypatch):
+        start_script = fake_robot._startScript
+
+        def start_music_mid_upload(number_of_bytes):
+            start_script(number_of_bytes)
+            # the scheduler thread tries to upload a song right now
+            fake_robot.playMelody([(60, 4), (64, 4)], wait=False)
+            time.sleep(0.1)
+
+        monkeypatch.setattr(fake_robot, '_startScript', start_music_mid_upload)
+        fake_robot.turn(90)
+        assert fake_robot.waitForMusic(timeout=2)
+
+        script = fake_oi_serial.sent(SCRIPT_OP)[0]
+        assert script[0] == 13 and script[1] == DRIVE_OP
+        assert fake_oi_serial.sent(SONG_OP)[0][:2] == [0, 2]
+        assert len(fake_oi_serial.plays) == 1
+
+    @pytest.mark.unit
+    def test_play_ignored_in_passive_mode(self, fake_robot, fake_oi_serial):
+        fake_robot.clean()
+        fake_robot.playSongNumber(0)
+        assert fake_oi_serial.plays == []
+        assert fake_oi_serial.ignored_plays == 1
+
+    @pytest.mark.unit
+    def test_wait_for_music_without_any(self, fake_robot):
+        assert fake_robot.waitForMusic(timeout=0) is True
@@ -0,0 +1,125 @@
+"""
+Unit tests for roomba.script module.
+
+Tests primitive encoding, packing into 100-byte scripts, the compile
+cache, and running compiled paths on a Create.
+"""
+
+import pytest
+from roomba.script import (
+    Drive, WaitDistance, WaitAngle, WaitTime, Leds, PlaySong, STOP,
+    encode, compile_path, run_path, move, turn, square
+)
+from roomba.commands import MAX_SCRIPT_LENGTH
+
+DRIVE_OP, SCRIPT_OP, ENDSCRIPT_OP = 137, 152, 153
+
+
+class TestEncode:
+    """Test encoding of single primitives."""
+
+    @pytest.mark.integration
+    @pytest.mark.parametrize('cm_per_sec,deg_per_sec', [
+        (20, 0), (-10, 0), (0, 45), (0, -45), (20, 30), (1, 1), (0, 0),
+    ])
+    def test_drive_matches_go(self, fake_robot, fake_oi_serial, cm_per_sec, deg_per_sec):
+        fake_robot.go(cm_per_sec, deg_per_sec)
+        expected = fake_oi_serial.sent(DRIVE_OP)[0]
+        encoded = encode(Drive(cm_per_sec, deg_per_sec), fake_robot.wheelSpan)
+        assert list(encoded) == [DRIVE_OP] + expected
+
+    @pytest.mark.unit
+    def test_waits(self):
+        assert list(encode(WaitDistance(-500))) == [156, 0xFE, 0x0C]
+        assert list(encode(WaitAngle(90))) == [157, 0, 90]
+        # longer than one WAITTIME can hold
+        assert list(encode(WaitTime(30))) == [155, 255, 155, 45]
+
+    @pytest.mark.unit
+    def test_leds_and_song(self):
+        assert list(encode(Leds(255, 128, 1, 1))) == [139, 10, 255, 128]
+        assert list(encode(PlaySong(3))) == [141, 3]
+
+    @pytest.mark.unit
+    def test_out_of_range(self):
+        with pytest.raises(ValueError):
+            encode(WaitDistance(40000))
+        with pytest.raises(ValueError):
+            encode(PlaySong(16))
+        with pytest.raises(TypeError):
+            encode(('drive', 10))
+
+
+class TestCompile:
+    """Test packing paths into scripts."""
+
+    @pytest.mark.unit
+    def test_square_is_one_script(self):
+        scripts = compile_path(square(side_cm=50))
+        assert len(scripts) == 1
+        # the STOP between legs is dropped, only the final one is kept
+        assert len(scripts[0]) == 8 * (5 + 3) + 5
+
+    @pytest.mark.unit
+    def test_long_path_splits_between_segments(self):
+        path = []
+        for _ in range(10):
+            path += move(20) + turn(45)
+
+        scripts = compile_path(path)
+
+        assert len(scripts) == 2
+        assert all(len(s) <= MAX_SCRIPT_LENGTH for s in scripts)
+        assert scripts[1][0] == DRIVE_OP
+        # each script ends with a STOP; the ones between legs are dropped
+        assert sum(len(s) for s in scripts) == 20 * 8 + 2 * 5
+
+    @pytest.mark.unit
+    def test_scripts_end_with_stop(self):
+        stop = encode(STOP)
+        scripts = compile_path(square(50) * 3)
+
+        assert len(scripts) > 1
+        assert all(len(s) <= MAX_SCRIPT_LENGTH for s in scripts)
+        # the wheels stop before the completion probes and the next upload
+        assert all(s.endswith(stop) for s in scripts)
+        assert all(s[0] == DRIVE_OP for s in scripts)
+        assert sum(len(s) for s in scripts) == 24 * 8 + len(scripts) * 5
+
+    @pytest.mark.unit
+    def test_cache(self):
+        compile_path.cache_clear()
+        first = compile_path(square(side_cm=30))
+        second = compile_path(square(side_cm=30))
+        assert first is second
+        assert compile_path.cache_info().hits == 1
+
+    @pytest.mark.unit
+    def test_move_and_turn_directions(self):
+        assert move(-30, 10)[0] == Drive(-10, 0)
+        assert turn(-90)[:2] == [Drive(0, -20), WaitAngle(-90)]
+        assert move(30)[-1] == STOP
+
+
+class TestRunPath:
+    """Test uploading and running compiled paths."""
+
+    @pytest.mark.integration
+    def test_square_is_one_upload(self, fake_robot, fake_oi_serial):
+        assert run_path(fake_robot, square(side_cm=50)) is True
+
+        uploads = fake_oi_serial.sent(SCRIPT_OP)
+        assert len(uploads) == 1
+        assert bytes(uploads[0][1:]) == compile_path(square(side_cm=50))[0]
+        assert len(fake_oi_serial.sent(ENDSCRIPT_OP)) == 1
+
+    @pytest.mark.integration
+    def test_async(self, fake_robot, fake_oi_serial):
+        fake_oi_serial.script_polls = 2
+        future = run_path(fake_robot, move(20) + turn(90), wait=False)
+        assert future.result(timeout=2) is True
+
+    @pytest.mark.integration
+    def test_rejects_oversized_script(self, fake_robot):
+        with pytest.raises(ValueError):
+            fake_robot.runScripts([bytes(101)])
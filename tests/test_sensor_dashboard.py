@@ -0,0 +1,87 @@
+"""
+Tests for examples/sensor_dashboard.py.
+
+Checks that SnapshotBroadcaster serialises each changed snapshot once,
+wakes the waiting /stream clients, keeps idle streams alive and ends
+them on close().
+"""
+
+import sys
+import threading
+from pathlib import Path
+import pytest
+
+pytest.importorskip('flask')
+sys.path.insert(0, str(Path(__file__).parent.parent / 'examples'))
+
+from sensor_dashboard import SnapshotBroadcaster
+
+
+def next_in_thread(stream):
+    """Start pulling the next frame from stream; returns (thread, result list)."""
+    result = []
+
+    def pull():
+        result.append(next(stream, None))
+
+    thread = threading.Thread(target=pull, daemon=True)
+    thread.start()
+    return thread, result
+
+
+class TestSnapshotBroadcaster:
+    """Test fanning sensor snapshots out to /stream clients."""
+
+    @pytest.mark.unit
+    def test_publish_skips_unchanged_snapshot(self):
+        broadcaster = SnapshotBroadcaster()
+
+        assert broadcaster.publish({'battery': 80})
+        assert not broadcaster.publish({'battery': 80})
+        assert broadcaster.publish({'battery': 79})
+
+    @pytest.mark.unit
+    def test_subscriber_gets_latest_snapshot_at_once(self):
+        broadcaster = SnapshotBroadcaster()
+        broadcaster.publish({'battery': 80})
+        broadcaster.publish({'battery': 79})
+
+        assert next(broadcaster.subscribe()) == b'data: {"battery": 79}\n\n'
+
+    @pytest.mark.unit
+    def test_publish_wakes_waiting_streams(self):
+        broadcaster = SnapshotBroadcaster(keepalive=5.0)
+        broadcaster.publish({'battery': 80})
+        streams = [broadcaster.subscribe() for _ in range(3)]
+        for stream in streams:
+            next(stream)
+
+        pulls = [next_in_thread(stream) for stream in streams]
+        broadcaster.publish({'battery': 79})
+        for thread, result in pulls:
+            thread.join(timeout=1)
+            assert result == [b'data: {"battery": 79}\n\n']
+
+    @pytest.mark.unit
+    def test_keepalive_when_idle(self):
+        broadcaster = SnapshotBroadcaster(keepalive=0.05)
+        broadcaster.publish({'battery': 80})
+        stream = broadcaster.subscribe()
+        next(stream)
+
+        # an unchanged snapshot doesn't count as news
+        broadcaster.publish({'battery': 80})
+        assert next(stream) == b': keepalive\n\n'
+
+    @pytest.mark.unit
+    def test_close_ends_streams(self):
+        broadcaster = SnapshotBroadcaster(keepalive=5.0)
+        broadcaster.publish({'battery': 80})
+        stream = broadcaster.subscribe()
+        next(stream)
+
+        thread, result = next_in_thread(stream)
+        broadcaster.close()
+        thread.join(timeout=1)
+        assert result == [None]
+        assert list(broadcaster.subscribe()) == []
@@ -0,0 +1,95 @@
+"""
+Tests for roomba.songs module.
+
+Tests melody splitting and gapless playback through the song slots
+against FakeOISerial, which plays songs in real time.
+"""
+
+import time
+import pytest
+from roomba.songs import (
+    SongPlayer, split_melody, melody_seconds, STARWARS, MAX_SONG_NOTES
+)
+
+
+def scale(count, duration=1):
+    return [(60 + i % 24, duration) for i in range(count)]
+
+
+class TestSplitMelody:
+    """Test splitting melodies into song-slot chunks."""
+
+    @pytest.mark.unit
+    def test_chunks_of_sixteen(self):
+        chunks = split_melody(scale(40))
+        assert [len(c) for c in chunks] == [16, 16, 8]
+        assert sum(chunks, []) == scale(40)
+
+    @pytest.mark.unit
+    def test_long_notes_are_split(self):
+        assert split_melody([(60, 300)]) == [[(60, 255), (60, 45)]]
+
+    @pytest.mark.unit
+    def test_empty(self):
+        assert split_melody([]) == []
+
+    @pytest.mark.unit
+    def test_starwars_is_complete(self):
+        # all eight parts, not just the first two
+        assert len(STARWARS) == 8 * 9
+        assert all(len(c) <= MAX_SONG_NOTES for c in split_melody(STARWARS))
+
+
+class TestSongPlayer:
+    """Test slot double-buffering and SONG_PLAYING-driven playback."""
+
+    @pytest.mark.unit
+    def test_needs_two_slots(self, fake_robot):
+        with pytest.raises(ValueError):
+            SongPlayer(fake_robot, slots=(0,))
+
+    @pytest.mark.integration
+    def test_plays_every_chunk_in_order(self, fake_robot, fake_oi_serial):
+        melody = scale(40, duration=1)
+        chunks = split_melody(melody)
+
+        SongPlayer(fake_robot, slots=(0, 1)).play(melody)
+
+        assert [slot for slot, _ in fake_oi_serial.plays] == [0, 1, 0]
+        assert fake_oi_serial.ignored_plays == 0
+        # the third chunk was uploaded into slot 0 after the first had played
+        assert fake_oi_serial.songs[0] == chunks[2]
+        assert fake_oi_serial.songs[1] == chunks[1]
+
+    @pytest.mark.integration
+    def test_no_gaps(self, fake_robot, fake_oi_serial):
+        melody = scale(48, duration=1)
+
+        started = time.monotonic()
+        SongPlayer(fake_robot).play(melody)
+        elapsed = time.monotonic() - started
+
+        starts = [t for _, t in fake_oi_serial.plays]
+        chunk = melody_seconds(melody) / 3
+        for earlier, later in zip(starts, starts[1:]):
+            assert later - earlier == pytest.approx(chunk, abs=0.06)
+        assert elapsed == pytest.approx(melody_seconds(melody), abs=0.15)
+
+    @pytest.mark.integration
+    def test_steps_yield_waits(self, fake_robot):
+        steps = list(SongPlayer(fake_robot).steps(scale(4, duration=32)))
+        # a single chunk: one wait for the whole song
+        assert len(steps) == 1
+        assert steps[0] == pytest.approx(2.0, abs=0.05)
+
+    @pytest.mark.integration
+    def test_preload_leaves_only_play(self, fake_robot, fake_oi_serial):
+        melody = scale(40, duration=1)
+        player = SongPlayer(fake_robot)
+        assert player.preload(melody) == 3
+
+        fake_oi_serial.commands.clear()
+        steps = player.steps(melody)
+        next(steps)
+        assert [op for op, _ in fake_oi_serial.commands] == [141]
+        steps.close()